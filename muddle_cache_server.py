@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+
+"""muddle_cache_server.py - a minimal remote artifact cache server
+
+    muddle_cache_server.py [-host <host>] [-port <port>] <directory>
+
+serves the remote artifact cache protocol (see muddled/cache.py) over HTTP,
+keeping each entry as a file in <directory>:
+
+* GET /<key>.tar.gz returns the entry for <key>, or 404 if there is none
+* PUT /<key>.tar.gz stores the entry for <key>
+
+Builds use it by setting (as well as $MUDDLE_CACHE)::
+
+    export MUDDLE_REMOTE_CACHE=http://<host>:<port>/
+
+The host defaults to localhost, and the port to 8086. If the port is 0, an
+unused port is chosen. Either way, the URL to use is printed when the server
+starts.
+
+This is meant as a reference, and for testing - it does no authentication,
+and makes no attempt to limit the size of the cache.
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+ENTRY_PATH = re.compile(r'^/([0-9a-f]+\.tar\.gz)$')
+
+class LocalError(Exception):
+    pass
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+
+    def _entry_file(self):
+        """Return the file for the requested entry, or None if it is not one.
+        """
+        match = ENTRY_PATH.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return None
+        return os.path.join(self.server.directory, match.group(1))
+
+    def do_GET(self):
+        filename = self._entry_file()
+        if filename is None:
+            return
+        try:
+            fd = open(filename, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+        with fd:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/gzip')
+            self.send_header('Content-Length', str(os.fstat(fd.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(fd, self.wfile)
+
+    def do_PUT(self):
+        filename = self._entry_file()
+        if filename is None:
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (KeyError, ValueError):
+            self.send_error(411)
+            return
+        fd, tmp_name = tempfile.mkstemp(dir=self.server.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while length > 0:
+                    data = self.rfile.read(min(length, 1024*1024))
+                    if not data:
+                        break
+                    out.write(data)
+                    length -= len(data)
+            if length:
+                self.send_error(400, 'Entry was truncated')
+                return
+            os.rename(tmp_name, filename)
+            tmp_name = None
+        finally:
+            if tmp_name:
+                os.remove(tmp_name)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        sys.stderr.write('%s\n'%(format%args))
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, directory):
+        HTTPServer.__init__(self, address, CacheRequestHandler)
+        self.directory = directory
+
+def main(args):
+
+    host = 'localhost'
+    port = 8086
+    directory = None
+
+    while args:
+        word = args.pop(0)
+        if word in ('-h', '-help', '--help'):
+            print __doc__
+            return
+        elif word == '-host' and args:
+            host = args.pop(0)
+        elif word == '-port' and args:
+            try:
+                port = int(args.pop(0))
+            except ValueError:
+                raise LocalError('The port must be a number')
+        elif word.startswith('-'):
+            raise LocalError('Unexpected switch "%s"'%word)
+        elif directory is None:
+            directory = word
+        else:
+            raise LocalError('Unexpected argument "%s"'%word)
+
+    if directory is None:
+        raise LocalError('Must specify the directory to keep the cache in')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    server = CacheServer((host, port), os.path.abspath(directory))
+    print 'Serving http://%s:%d/'%(host, server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+    except LocalError as what:
+        print what
+        sys.exit(1)
+
+# vim: set tabstop=8 softtabstop=4 shiftwidth=4 expandtab:
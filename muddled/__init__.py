@@ -2,6 +2,6 @@
 Muddle - A VCS-agnostic package build and configuration management system
 """
 
-# We import the vcs module here so that *its* __init__ can load each
-# individual VCS, and they can register the VCS with version_control.py
-import muddled.vcs
+# We import the trace module first, so that it can tell when we started
+# importing the rest of muddle
+import muddled.trace
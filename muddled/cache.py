@@ -0,0 +1,864 @@
+"""
+A cache of what building package labels produces.
+
+If $MUDDLE_CACHE is set, it names a directory in which muddle keeps copies
+of the files that building each package produced - everything in its object
+directory (see Builder.package_obj_path()), and the files it added to (or
+changed in) its install directory (see Builder.package_install_path()) when
+it was installed.
+
+Each entry in the cache is keyed by the fingerprint of the package's
+"postinstalled" label (see muddled.fingerprint), which covers the revisions
+of the checkouts it is built from, its environment, its action and the
+fingerprints of the packages it depends on, together with the paths of its
+object and install directories. When a package is about to be built, and
+the cache has an entry for its key, its files are restored from the cache
+instead of running its actions.
+
+Files are restored as reflinks (copy-on-write clones) where the filesystem
+supports them, and otherwise copied. If $MUDDLE_CACHE_HARDLINKS is set, they
+are restored as hard links instead, which is faster and saves space, but is
+only safe if nothing (a later build, for instance) changes the restored
+files in place, since that would also change the copy in the cache (and in
+any other build tree that has restored it).
+
+Packages are only stored in (or restored from) the cache if none of the
+checkouts they are built from (directly or indirectly) have local changes,
+since otherwise the checkout revisions would not describe what was built.
+
+The cache directory may be shared between build trees. However, what is
+built often contains the absolute paths it was built and installed with
+(for instance, in libtool .la files, pkg-config .pc files and the Makefiles
+written by configure), and restoring such files into a different directory
+would leave them pointing at the wrong place. So an entry is only used by
+a build tree at the same path as the one that stored it - for instance,
+successive builds in the same CI workspace, or build hosts that all use
+the same path for their build trees.
+
+The size of the cache is kept under $MUDDLE_CACHE_SIZE (default 5G), by
+discarding the entries that were least recently used. Files in the cache
+are checked against their hash before they are used, in case something
+has changed them.
+
+The cache directory contains:
+
+* objects/xx/yyyy... - the content of each file, named by its SHA1 hash
+* entries/<key> - one file per entry, listing the files it restores
+* stats - a line for each hit, miss, store or eviction
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import time
+import traceback
+import urlparse
+import zlib
+from collections import deque
+
+from muddled.utils import GiveUp
+
+DEFAULT_CACHE_SIZE = '5G'
+
+# Don't remove files that aren't in any entry until they are this old
+# (in seconds), in case another muddle is just about to add an entry for them
+ORPHAN_AGE = 60*60
+
+# The Linux ioctl to make a file a reflink (clone) of another
+FICLONE = 0x40049409
+
+# The areas that an entry restores files into
+OBJ_AREA = 'obj'
+INSTALL_AREA = 'install'
+
+def artifact_cache():
+    """Return the ArtifactCache named by $MUDDLE_CACHE, or None.
+    """
+    cache_dir = os.environ.get('MUDDLE_CACHE')
+    if not cache_dir:
+        return None
+    max_size = parse_size(os.environ.get('MUDDLE_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+    return ArtifactCache(os.path.abspath(os.path.expanduser(cache_dir)), max_size,
+                         hard_links=bool(os.environ.get('MUDDLE_CACHE_HARDLINKS')))
+
+def parse_size(text):
+    """Parse a size, in bytes, with an optional K, M or G suffix.
+
+    >>> parse_size('1000')
+    1000
+    >>> parse_size('2k')
+    2048
+    >>> parse_size('5G')
+    5368709120
+    """
+    multiplier = 1
+    text = text.strip()
+    if text and text[-1].upper() in 'KMG':
+        multiplier = 1024 ** ('KMG'.index(text[-1].upper()) + 1)
+        text = text[:-1]
+    try:
+        return int(text) * multiplier
+    except ValueError:
+        raise GiveUp("Cannot understand cache size '%s'"%text)
+
+def format_size(size):
+    """Return 'size' (in bytes) in a form suitable for people to read.
+
+    >>> format_size(100)
+    '100 bytes'
+    >>> format_size(3*1024*1024)
+    '3.0M'
+    """
+    if size < 1024:
+        return '%d bytes'%size
+    for suffix in 'KMG':
+        size /= 1024.0
+        if size < 1024 or suffix == 'G':
+            return '%.1f%s'%(size, suffix)
+
+def tree_state(path):
+    """Return a dictionary describing the files under 'path'.
+
+    Each relative path maps to a tuple (inode, size, mtime, link target),
+    where the link target is None if it is not a symbolic link.
+    """
+    state = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames + [d for d in dirnames
+                                 if os.path.islink(os.path.join(dirpath, d))]:
+            filename = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(filename)
+            except OSError:
+                continue
+            if os.path.islink(filename):
+                target = os.readlink(filename)
+            else:
+                target = None
+            state[os.path.relpath(filename, path)] = (st.st_ino, st.st_size,
+                                                      st.st_mtime, target)
+    return state
+
+def changed_files(before, after):
+    """Return the (sorted) files in tree state 'after' that differ from 'before'.
+    """
+    return sorted(name for name, value in after.items()
+                  if before.get(name) != value)
+
+def write_file_list(filename, names):
+    """Write the list of 'names' (relative paths) to 'filename'.
+    """
+    tmp_name = '%s.tmp'%filename
+    with open(tmp_name, 'w') as fd:
+        for name in names:
+            fd.write('%s\n'%name)
+    os.rename(tmp_name, filename)
+
+def read_file_list(filename):
+    """Read a list of relative paths written by write_file_list().
+
+    Returns None if the file does not exist.
+    """
+    try:
+        with open(filename) as fd:
+            return [line.rstrip('\n') for line in fd if line.strip()]
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+def _hash_file(filename):
+    """Return the SHA1 hash of the content of 'filename'.
+    """
+    hasher = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        while True:
+            data = fd.read(1024*1024)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+def _copy_file(from_path, mode, to_path):
+    """Copy 'from_path' to (new file) 'to_path', as a reflink if we can.
+    """
+    with open(from_path, 'rb') as src:
+        with open(to_path, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (IOError, OSError):
+                # The filesystem can't do it, so do it ourselves
+                shutil.copyfileobj(src, dst, 1024*1024)
+    os.chmod(to_path, mode)
+
+def _remove(path):
+    """Remove 'path', whatever it is, if it exists.
+    """
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+class ArtifactCache(object):
+    """
+    A cache of the files produced by building packages.
+
+    Each entry is a list of files (and symbolic links and empty directories),
+    which belong either to the package's object directory or to its install
+    directory.
+    """
+
+    def __init__(self, cache_dir, max_size, hard_links=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hard_links = hard_links
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.stats_file = os.path.join(cache_dir, 'stats')
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def _entry_path(self, key):
+        return os.path.join(self.entries_dir, key)
+
+    def _ensure_dirs(self):
+        for path in (self.objects_dir, self.entries_dir):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def record(self, what, label):
+        """Record a hit, miss, store or eviction in our statistics.
+
+        Each is a single line appended to the stats file, so that several
+        muddles (or build jobs) can do this at the same time.
+        """
+        self._ensure_dirs()
+        with open(self.stats_file, 'a') as fd:
+            fd.write('%s %s\n'%(what, label))
+
+    def _read_entry(self, key):
+        """Return the items in entry 'key', or None if there is no such entry.
+
+        Each item is a tuple (area, kind, mode, value, relative path).
+        """
+        try:
+            with open(self._entry_path(key)) as fd:
+                lines = fd.readlines()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        items = []
+        for line in lines:
+            if line.startswith('#'):
+                continue
+            area, kind, mode, value, name = line.rstrip('\n').split('\t')
+            items.append((area, kind, int(mode, 8), value, name))
+        return items
+
+    def _forget_entry(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def has_entry(self, key):
+        """Do we have an entry for 'key'?
+        """
+        return os.path.exists(self._entry_path(key))
+
+    def restore(self, key, label, obj_path, install_path, record_miss=True):
+        """Restore the files for entry 'key' (for package 'label').
+
+        Everything in 'obj_path' is replaced by the object files from the
+        entry, and the entry's install files are put into 'install_path'.
+
+        Returns True if the entry was restored, False if there is no such
+        entry (or its files in the cache have gone astray). If 'record_miss'
+        is false, then the caller will record any miss itself.
+        """
+        items = self._read_entry(key)
+        if items is None:
+            if record_miss:
+                self.record('miss', label)
+            return False
+
+        # Check everything is present and correct before we change anything
+        for area, kind, mode, value, name in items:
+            if kind != 'f':
+                continue
+            path = self._object_path(value)
+            if not os.path.exists(path) or _hash_file(path) != value:
+                if os.path.exists(path):
+                    os.remove(path)
+                self._forget_entry(key)
+                if record_miss:
+                    self.record('miss', label)
+                return False
+
+        _remove(obj_path)
+        os.makedirs(obj_path)
+        linked = set()
+        for area, kind, mode, value, name in items:
+            if area == OBJ_AREA:
+                path = os.path.join(obj_path, name)
+            else:
+                path = os.path.join(install_path, name)
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                _remove(parent)
+                os.makedirs(parent)
+            if kind == 'd':
+                if not os.path.isdir(path):
+                    _remove(path)
+                    os.makedirs(path)
+                continue
+            _remove(path)
+            if kind == 'l':
+                os.symlink(value, path)
+            elif value in linked:
+                # Don't make two of our files links to the same thing
+                _copy_file(self._object_path(value), mode, path)
+            elif self._restore_file(self._object_path(value), mode, path):
+                linked.add(value)
+
+        # Remember this entry was used, for eviction
+        os.utime(self._entry_path(key), None)
+        self.record('hit', label)
+        return True
+
+    def _restore_file(self, object_path, mode, path):
+        """Restore a file from the cache.
+
+        Returns True if it was restored as a hard link.
+        """
+        if self.hard_links and os.stat(object_path).st_mode & 07777 == mode:
+            try:
+                os.link(object_path, path)
+                return True
+            except OSError as e:
+                # Presumably on another filesystem, or otherwise not allowed
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        _copy_file(object_path, mode, path)
+        return False
+
+    def _store_file(self, filename):
+        """Store the content of 'filename' in the cache, and return its hash.
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=self.objects_dir, prefix='.tmp-')
+        try:
+            hasher = hashlib.sha1()
+            with os.fdopen(fd, 'wb') as out:
+                with open(filename, 'rb') as src:
+                    while True:
+                        data = src.read(1024*1024)
+                        if not data:
+                            break
+                        hasher.update(data)
+                        out.write(data)
+            digest = hasher.hexdigest()
+            path = self._object_path(digest)
+            if os.path.exists(path):
+                # Make sure it doesn't get removed as an orphan just yet
+                os.utime(path, None)
+            else:
+                parent = os.path.dirname(path)
+                if not os.path.isdir(parent):
+                    try:
+                        os.mkdir(parent)
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                os.chmod(tmp_name, os.stat(filename).st_mode & 07777)
+                os.rename(tmp_name, path)
+                tmp_name = None
+            return digest
+        finally:
+            if tmp_name:
+                os.remove(tmp_name)
+
+    def _item(self, area, root, name):
+        """Store 'name' (relative to 'root'), and return its entry line.
+
+        Returns None if there is nothing (any more) to store.
+        """
+        path = os.path.join(root, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return None
+        mode = st.st_mode & 07777
+        if os.path.islink(path):
+            kind, value = 'l', os.readlink(path)
+        elif os.path.isdir(path):
+            kind, value = 'd', '-'
+        else:
+            kind, value = 'f', self._store_file(path)
+        return '%s\t%s\t%o\t%s\t%s\n'%(area, kind, mode, value, name)
+
+    def store(self, key, label, obj_path, install_path, install_files,
+              what='store'):
+        """Store a new entry 'key', for package 'label'.
+
+        The entry contains everything in 'obj_path', and the files named
+        (relative to 'install_path') in 'install_files'. 'what' is how we
+        record this in our statistics.
+
+        Returns True if the entry was stored, False if it could not be (because
+        some file names cannot be represented in an entry).
+        """
+        names = []
+        for dirpath, dirnames, filenames in os.walk(obj_path):
+            rel_dir = os.path.relpath(dirpath, obj_path)
+            for name in dirnames:
+                path = os.path.join(dirpath, name)
+                # Symbolic links are stored as such, and only empty
+                # directories need storing, since files imply their parents
+                if os.path.islink(path) or not os.listdir(path):
+                    names.append(os.path.normpath(os.path.join(rel_dir, name)))
+            for name in filenames:
+                names.append(os.path.normpath(os.path.join(rel_dir, name)))
+
+        for name in names + list(install_files):
+            if '\t' in name or '\n' in name:
+                return False
+
+        self._ensure_dirs()
+        lines = ['# %s\n'%label]
+        for area, root, area_names in ((OBJ_AREA, obj_path, names),
+                                       (INSTALL_AREA, install_path, install_files)):
+            for name in sorted(area_names):
+                line = self._item(area, root, name)
+                if line:
+                    lines.append(line)
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.entries_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as out:
+            out.writelines(lines)
+        os.rename(tmp_name, self._entry_path(key))
+        self.record(what, label)
+
+        self.evict(keep=key)
+        return True
+
+    def write_tarball(self, key, fileobj):
+        """Write entry 'key' to 'fileobj', as a gzipped tar file.
+
+        The object files are under obj/ in the tar file, and the install
+        files under install/.
+
+        Returns False if there is no such entry.
+        """
+        items = self._read_entry(key)
+        if items is None:
+            return False
+        with tarfile.open(fileobj=fileobj, mode='w|gz') as tar:
+            for area, kind, mode, value, name in items:
+                info = tarfile.TarInfo('%s/%s'%(area, name))
+                info.mode = mode
+                if kind == 'd':
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                elif kind == 'l':
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = value
+                    tar.addfile(info)
+                else:
+                    with open(self._object_path(value), 'rb') as fd:
+                        info.size = os.fstat(fd.fileno()).st_size
+                        tar.addfile(info, fd)
+        return True
+
+    def store_tarball(self, key, label, fileobj):
+        """Store entry 'key' (for package 'label') from a gzipped tar file.
+
+        The tar file is read as a stream, and should be as written by
+        write_tarball().
+
+        Returns True if the entry was stored.
+        """
+        self._ensure_dirs()
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix='.fetch-')
+        try:
+            real_staging = os.path.realpath(staging)
+            install_files = []
+            with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+                for info in tar:
+                    area, _, name = info.name.partition('/')
+                    # Don't write outside 'staging', even via a symbolic link
+                    path = os.path.join(staging, info.name.rstrip('/'))
+                    path = os.path.join(os.path.realpath(os.path.dirname(path)),
+                                        os.path.basename(path))
+                    if (area not in (OBJ_AREA, INSTALL_AREA) or
+                        not path.startswith(real_staging + os.sep) or
+                        not (info.isfile() or info.isdir() or info.issym())):
+                        raise GiveUp('Unexpected %s in cache entry %s'%(info.name,
+                                                                        key))
+                    tar.extract(info, staging)
+                    if area == INSTALL_AREA and not info.isdir():
+                        install_files.append(os.path.normpath(name))
+            obj_path = os.path.join(staging, OBJ_AREA)
+            if not os.path.isdir(obj_path):
+                os.mkdir(obj_path)
+            return self.store(key, label, obj_path,
+                              os.path.join(staging, INSTALL_AREA),
+                              install_files, what='fetch')
+        finally:
+            shutil.rmtree(staging)
+
+    def _entries(self):
+        """Return a list of (last used, key) for our entries, oldest first.
+        """
+        result = []
+        if not os.path.isdir(self.entries_dir):
+            return result
+        for key in os.listdir(self.entries_dir):
+            if key.startswith('.'):
+                continue
+            try:
+                st = os.stat(self._entry_path(key))
+            except OSError:
+                continue
+            result.append((st.st_mtime, key))
+        result.sort()
+        return result
+
+    def _objects(self):
+        """Return a dictionary of our objects, mapping hash -> (size, mtime).
+        """
+        objects = {}
+        if not os.path.isdir(self.objects_dir):
+            return objects
+        for subdir in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, subdir)
+            if subdir.startswith('.') or not os.path.isdir(path):
+                continue
+            for name in os.listdir(path):
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                objects[subdir + name] = (st.st_size, st.st_mtime)
+        return objects
+
+    def evict(self, keep=None):
+        """Discard least recently used entries until we are small enough.
+
+        Objects that no entry uses are also discarded. The entry 'keep' (if
+        given) is not discarded.
+        """
+        objects = self._objects()
+        entries = self._entries()
+        users = {}                      # object hash -> number of entries
+        entry_objects = {}              # entry key -> its object hashes
+        for last_used, key in entries:
+            items = self._read_entry(key) or []
+            digests = set(value for area, kind, mode, value, name in items
+                          if kind == 'f')
+            entry_objects[key] = digests
+            for digest in digests:
+                users[digest] = users.get(digest, 0) + 1
+
+        now = time.time()
+        size = 0
+        for digest, (obj_size, mtime) in objects.items():
+            if digest in users:
+                size += obj_size
+            elif now - mtime > ORPHAN_AGE:
+                self._remove_object(digest)
+            else:
+                size += obj_size
+
+        for last_used, key in entries:
+            if size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self._forget_entry(key)
+            self.record('evict', key)
+            for digest in entry_objects[key]:
+                users[digest] -= 1
+                if users[digest] == 0 and digest in objects:
+                    self._remove_object(digest)
+                    size -= objects[digest][0]
+
+    def _remove_object(self, digest):
+        try:
+            os.remove(self._object_path(digest))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def stats(self):
+        """Return a dictionary of statistics about the cache.
+        """
+        counts = {'hit':0, 'miss':0, 'store':0, 'fetch':0, 'evict':0}
+        try:
+            with open(self.stats_file) as fd:
+                for line in fd:
+                    what = line.split(' ', 1)[0]
+                    if what in counts:
+                        counts[what] += 1
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        objects = self._objects()
+        counts['entries'] = len(self._entries())
+        counts['objects'] = len(objects)
+        counts['size'] = sum(obj_size for obj_size, mtime in objects.values())
+        return counts
+
+# -----------------------------------------------------------------------------
+# Remote artifact caches
+# -----------------------------------------------------------------------------
+#
+# If $MUDDLE_REMOTE_CACHE is set (as well as $MUDDLE_CACHE), it is the base
+# URL of a remote cache, shared by several build hosts. The protocol is
+# simply:
+#
+# * GET <base>/<key>.tar.gz returns the entry for <key>, as written by
+#   ArtifactCache.write_tarball(), or 404 if there is no such entry.
+# * PUT <base>/<key>.tar.gz stores the entry for <key>.
+#
+# When a package is not in the local cache, we look for it in the remote
+# cache, and if it is there we add it to the local cache and restore it from
+# there. When we store a package in the local cache, we also upload it.
+#
+# muddle_cache_server.py (at the top level of muddle) is a minimal server
+# for this protocol.
+
+remote_cache_backends = {}
+
+def register_remote_cache_backend(scheme, backend_class):
+    """Register the class to use for remote caches with URLs of this scheme.
+
+    The class is called with the base URL, and must provide 'get' and 'put'
+    methods, as HTTPCacheBackend does.
+    """
+    remote_cache_backends[scheme] = backend_class
+
+def remote_cache():
+    """Return a backend for the remote cache named by $MUDDLE_REMOTE_CACHE.
+
+    Returns None if it is not set.
+    """
+    url = os.environ.get('MUDDLE_REMOTE_CACHE')
+    if not url:
+        return None
+    scheme = urlparse.urlsplit(url).scheme
+    try:
+        backend_class = remote_cache_backends[scheme]
+    except KeyError:
+        raise GiveUp("Cannot use remote artifact cache %s: no backend for"
+                     " '%s' URLs"%(url, scheme))
+    return backend_class(url)
+
+def _httplib():
+    """Return the httplib module.
+
+    httplib takes a while to import, and most muddle commands never talk to
+    a remote cache, so we only import it when we need it.
+    """
+    import httplib
+    return httplib
+
+class HTTPCacheBackend(object):
+    """
+    Talk to a remote artifact cache with HTTP GET and PUT.
+    """
+
+    # How long to wait (in seconds) for the server to respond
+    timeout = 60
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        parts = urlparse.urlsplit(self.base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path
+
+    def _connection(self):
+        httplib = _httplib()
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+        else:
+            return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _path_for(self, key):
+        return '%s/%s.tar.gz'%(self.path, key)
+
+    def get(self, key):
+        """Return a file-like object to read the entry for 'key' from.
+
+        Returns None if there is no such entry. The caller should close the
+        object when it has finished with it.
+        """
+        conn = self._connection()
+        try:
+            conn.request('GET', self._path_for(key))
+            response = conn.getresponse()
+        except (socket.error, _httplib().HTTPException) as e:
+            conn.close()
+            raise GiveUp('Cannot get %s from %s: %s'%(key, self.base_url, e))
+        if response.status == 404:
+            conn.close()
+            return None
+        elif response.status != 200:
+            conn.close()
+            raise GiveUp('Cannot get %s from %s: %d %s'%(key, self.base_url,
+                         response.status, response.reason))
+        return response
+
+    def put(self, key, fileobj, size):
+        """Store the entry for 'key', reading its 'size' bytes from 'fileobj'.
+        """
+        conn = self._connection()
+        try:
+            conn.request('PUT', self._path_for(key), fileobj,
+                         {'Content-Length':str(size),
+                          'Content-Type':'application/gzip'})
+            response = conn.getresponse()
+            response.read()
+        except (socket.error, _httplib().HTTPException) as e:
+            raise GiveUp('Cannot put %s to %s: %s'%(key, self.base_url, e))
+        finally:
+            conn.close()
+        if response.status not in (200, 201, 204):
+            raise GiveUp('Cannot put %s to %s: %d %s'%(key, self.base_url,
+                         response.status, response.reason))
+
+register_remote_cache_backend('http', HTTPCacheBackend)
+register_remote_cache_backend('https', HTTPCacheBackend)
+
+def fetch_entry(backend, cache, key, label):
+    """Fetch entry 'key' (for package 'label') from 'backend' into 'cache'.
+
+    Returns True if it was fetched, False if the remote cache doesn't have it.
+
+    Raises GiveUp if it cannot be fetched - including if the entry is
+    corrupt, or the connection fails (or times out) part way through.
+    """
+    try:
+        response = backend.get(key)
+        if response is None:
+            return False
+        try:
+            return cache.store_tarball(key, label, response)
+        finally:
+            response.close()
+    except (tarfile.TarError, zlib.error, EOFError, socket.error,
+            _httplib().HTTPException) as e:
+        # socket.error includes socket.timeout
+        raise GiveUp('Cannot fetch %s for %s from the remote cache: %s: %s'%(
+                     key, label, e.__class__.__name__, e))
+
+def upload_entry(backend, cache, key):
+    """Upload entry 'key' from 'cache' to 'backend'.
+
+    Returns True if it was uploaded.
+    """
+    with tempfile.TemporaryFile(dir=cache.cache_dir) as fd:
+        if not cache.write_tarball(key, fd):
+            return False
+        size = fd.tell()
+        fd.seek(0)
+        backend.put(key, fd, size)
+    return True
+
+class RemoteTransfers(object):
+    """
+    Run transfers to or from a remote cache, each in a forked process.
+
+    No more than 'max_running' transfers run at once - any more are queued,
+    and started (without waiting) when we notice that earlier ones have
+    finished, which is whenever start() or finish() is called.
+    """
+
+    def __init__(self, max_running):
+        self.max_running = max_running
+        self.running = {}               # pid -> key
+        self.queued = deque()           # (key, function, args)
+        self.results = {}               # key -> did it succeed?
+
+    def start(self, key, function, *args):
+        """Start a new transfer for 'key', which calls 'function(*args)'.
+
+        If 'max_running' transfers are already running, it is queued instead.
+
+        The transfer succeeds if 'function' returns true. If it raises
+        GiveUp, we report that as a warning.
+        """
+        self.queued.append((key, function, args))
+        self._reap()
+        self._start_queued()
+
+    def _start_queued(self):
+        """Start as many of our queued transfers as we are allowed.
+        """
+        while self.queued and len(self.running) < self.max_running:
+            key, function, args = self.queued.popleft()
+            self._fork(key, function, args)
+
+    def _fork(self, key, function, args):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.running[pid] = key
+            return
+
+        # We are the transfer process - we must not return from here
+        status = 2
+        try:
+            try:
+                if function(*args):
+                    status = 0
+                else:
+                    status = 1
+            except GiveUp as e:
+                print 'Warning: %s'%e
+            except:
+                traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _reap(self):
+        """Collect any of our transfers that have finished, without waiting.
+
+        We ask about each of them in turn, so that we don't collect any other
+        process (a build job, for instance).
+        """
+        for pid in self.running.keys():
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+            if wpid:
+                key = self.running.pop(pid)
+                self.results[key] = (status == 0)
+
+    def finish(self):
+        """Wait for all of our transfers (including those queued) to finish.
+
+        Returns a dictionary mapping each key to whether its transfer
+        succeeded.
+        """
+        while self.running or self.queued:
+            self._reap()
+            self._start_queued()
+            if self.running:
+                time.sleep(0.05)
+        return self.results
+
+# End file.
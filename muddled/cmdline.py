@@ -11,8 +11,11 @@ for help on how to use it.
 import errno
 import os
 import subprocess
+import time
 
 import muddled.commands as commands
+import muddled.profiling as profiling
+import muddled.trace as trace
 import muddled.utils as utils
 import muddled.mechanics as mechanics
 
@@ -78,9 +81,10 @@ def find_and_load(specified_root, muddle_binary):
     try:
         (build_root, build_domain) = utils.find_root_and_domain(specified_root)
         if build_root:
-            builder = mechanics.load_builder(build_root, muddle_binary,
-                                             #default_domain = build_domain)
-                                             default_domain = None) # 'cos it's the toplevel
+            with trace.span('load_builder', 'load', root=build_root):
+                builder = mechanics.load_builder(build_root, muddle_binary,
+                                                 #default_domain = build_domain)
+                                                 default_domain = None) # 'cos it's the toplevel
         else:
             builder = None
         return builder
@@ -195,6 +199,8 @@ def _cmdline(args, current_dir, original_env, muddle_binary):
     The actual command line, with no safety net...
     """
 
+    started = time.time()
+
     guess_what_to_do = False
     command_name = ""
 
@@ -210,6 +216,19 @@ def _cmdline(args, current_dir, original_env, muddle_binary):
         elif word == '--tree':
             args = args[1:]
             specified_root = args[0]
+        elif word == '--trace':
+            args = args[1:]
+            if not args:
+                raise utils.GiveUp('--trace must be followed by a file name')
+            trace.start_tracing(args[0])
+            trace.add_span('import', 'load', trace.IMPORT_START, started)
+        elif word == '--profile' or word.startswith('--profile='):
+            sort_by = word[len('--profile='):] or 'cumulative'
+            if sort_by not in profiling.SORT_KEYS:
+                raise utils.GiveUp('Unexpected sort order for --profile, "%s" -'
+                                   ' it should be one of: %s'%(sort_by,
+                                   ', '.join(profiling.SORT_KEYS)))
+            profiling.start_profiling(sort_by)
         elif word == '--version':
             show_version()
             return
@@ -247,14 +266,21 @@ def _cmdline(args, current_dir, original_env, muddle_binary):
     command.set_old_env(original_env)
 
     # And armed with that, we can try to obey it
-    if builder:
-        if builder.is_release_build() and not command.allowed_in_release_build():
-            raise utils.GiveUp("Command %s is not allowed in a release build"%command_name)
-        command.with_build_tree(builder, current_dir, args)
-    else:
-        if command.requires_build_tree():
-            raise utils.GiveUp("Command %s requires a build tree."%(command_name))
-        command.without_build_tree(muddle_binary, current_dir, args)
+    with trace.span('muddle %s'%command.cmd_name, 'command', args=' '.join(args)):
+        if builder:
+            if builder.is_release_build() and not command.allowed_in_release_build():
+                raise utils.GiveUp("Command %s is not allowed in a release build"%command_name)
+            try:
+                command.with_build_tree(builder, current_dir, args)
+            finally:
+                # Make sure any tags we have set are written out, and that we
+                # have finished uploading to any remote artifact cache
+                builder.db.sync_tags()
+                builder.finish_uploads()
+        else:
+            if command.requires_build_tree():
+                raise utils.GiveUp("Command %s requires a build tree."%(command_name))
+            command.without_build_tree(muddle_binary, current_dir, args)
 
 def cmdline(args, muddle_binary=None):
     """
@@ -290,4 +316,6 @@ def cmdline(args, muddle_binary=None):
     finally:
         os.chdir(original_dir)          # Should not really be necessary...
         os.environ = original_env
+        trace.finish_tracing()
+        profiling.finish_profiling()
 
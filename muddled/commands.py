@@ -20,7 +20,6 @@ import difflib
 import errno
 import os
 import posixpath
-import pydoc
 import shutil
 import subprocess
 import sys
@@ -28,7 +27,6 @@ import tarfile
 import tempfile
 import textwrap
 import time
-import urllib
 import xml.dom.minidom
 from urlparse import urlparse
 
@@ -40,15 +38,18 @@ import muddled.pkg as pkg
 import muddled.subst as subst
 import muddled.utils as utils
 import muddled.version_control as version_control
-import muddled.docreport
 
-from muddled.db import Database, InstructionFile
+from muddled.cache import artifact_cache, format_size
+from muddled.mirrors import git_mirrors, DEFAULT_PRUNE_DAYS
+from muddled.db import Database, InstructionFile, DomainTags, domain_roots, \
+        TAG_STORES, TAG_STORE_FILES
 from muddled.depend import Label, label_list_to_string
 from muddled.utils import GiveUp, MuddleBug, Unsupported, \
         DirType, LabelTag, LabelType, find_label_dir, sort_domains
 from muddled.utils import split_vcs_url
 from muddled.version_control import checkout_from_repo
 from muddled.repository import Repository
+from muddled.server import QueryServer
 from muddled.version_stamp import VersionStamp, ReleaseStamp, ReleaseSpec
 from muddled.licenses import print_standard_licenses, get_gpl_checkouts, \
         get_not_licensed_checkouts, get_implicit_gpl_checkouts, \
@@ -56,6 +57,47 @@ from muddled.licenses import print_standard_licenses, get_gpl_checkouts, \
 from muddled.distribute import distribute, the_distributions, \
         get_distribution_names, get_used_distribution_names
 from muddled.withdir import Directory, NewDirectory
+from muddled.workers import run_in_workers
+
+class _LazyCommand(object):
+    """Stands in for a command class whose module has not been imported yet.
+    """
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+
+class CommandDict(dict):
+    """
+    A dictionary of <command name> : <command class>.
+
+    A command registered with lazy_command() is defined in another module,
+    which is only imported when the command is first looked up (for instance,
+    because it is being run, or help is wanted for it). Importing the module
+    registers the actual command class, replacing the stand-in.
+
+    Only "doc" is registered this way, because only its module (which
+    imports pydoc and friends) is slow to import - about 12ms. The other
+    modules we import are needed by muddled.mechanics, which nearly every
+    command uses, and measured on top of it they (server, snapshot, mirrors,
+    cache and workers) take less than 0.2ms between them, with this module's
+    own code about 3ms more. That isn't worth moving the commands out of
+    this module for.
+    """
+
+    def __getitem__(self, name):
+        value = dict.__getitem__(self, name)
+        if isinstance(value, _LazyCommand):
+            __import__(value.module_name)
+            value = dict.__getitem__(self, name)
+            if isinstance(value, _LazyCommand):
+                raise MuddleBug("Module %s does not define command"
+                                " '%s'"%(value.module_name, name))
+        return value
+
+    def is_lazy(self, name):
+        """Is 'name' a command whose module has not been imported yet?
+        """
+        return isinstance(dict.get(self, name), _LazyCommand)
 
 # Following Richard's naming conventions...
 # A dictionary of <command name> : <command class>
@@ -63,7 +105,7 @@ from muddled.withdir import Directory, NewDirectory
 # in the dictionary, with the same <command instance> as their value.
 # If a command has subcommands, then it will be entered in this dictionary,
 # but its <command instance> will be None.
-g_command_dict = {}
+g_command_dict = CommandDict()
 # A list of all of the known commands, by their "main" name
 # (so one name per command, only)
 g_command_names = []
@@ -100,7 +142,8 @@ def command(command_name, category, aliases=None):
 
     'category' indicates which type of command this is
     """
-    if command_name in g_command_dict:
+    was_lazy = g_command_dict.is_lazy(command_name)
+    if command_name in g_command_dict and not was_lazy:
         raise GiveUp("Command '%s' is already defined"%command_name)
     def rememberer(klass):
         g_command_dict[command_name] = klass
@@ -111,11 +154,30 @@ def command(command_name, category, aliases=None):
         klass.cmd_name = command_name
         return klass
 
-    g_command_names.append(command_name)
-    in_category(command_name, category)
+    if not was_lazy:
+        g_command_names.append(command_name)
+        in_category(command_name, category)
 
     return rememberer
 
+def lazy_command(command_name, category, module_name, aliases=None):
+    """Remember that a command is defined (with command()) in another module.
+
+    The module called 'module_name' is only imported when the command is
+    first looked up in g_command_dict. The 'category' and 'aliases' should
+    be the same as the module gives to command().
+    """
+    if command_name in g_command_dict:
+        raise GiveUp("Command '%s' is already defined"%command_name)
+    lazy = _LazyCommand(module_name)
+    g_command_dict[command_name] = lazy
+    if aliases:
+        for alias in aliases:
+            g_command_aliases[alias] = command_name
+            g_command_dict[alias] = lazy
+    g_command_names.append(command_name)
+    in_category(command_name, category)
+
 # A dictionary of the form <command_name> : <sub_command_dict>,
 # where each <sub_command_dict> is a dictionary of
 # <sub_command_name : <subcommand class>
@@ -154,6 +216,11 @@ def subcommand(main_command, sub_command, category, aliases=None):
         return klass
     return rememberer
 
+# Commands defined in other modules, which are only imported when needed
+# (mostly because they import things that take a while to import, which
+# other commands don't need)
+lazy_command('doc', CAT_QUERY, 'muddled.docreport')
+
 class Command(object):
     """
     Abstract base class for muddle commands. Stuffed with helpful functionality.
@@ -362,8 +429,17 @@ class CPDCommand(Command):
         labels.sort()
         return labels
 
+    # Subclasses that build things may set this to allow "-j <N>"
+    allows_jobs = False
+    jobs = None
+    # Subclasses that also use "-j" on its own as a switch set this
+    bare_j_allowed = False
+
     def with_build_tree(self, builder, current_dir, args):
 
+        if self.allows_jobs:
+            self.jobs, args = remove_jobs_switch(args, self.bare_j_allowed)
+
         args = self.remove_switches(args)
 
         self.original_labels = args[:]
@@ -838,12 +914,85 @@ def kill_labels(builder, to_kill):
     except GiveUp, e:
         raise GiveUp("Can't kill %s - %s"%(str(lbl), e))
 
-def build_labels(builder, to_build):
+def parse_jobs(value, where):
+    """
+    Interpret 'value' as a number of jobs to run at once.
+
+    'where' says where the value came from, for use in error messages.
+    """
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise GiveUp("%s must be a number of jobs, not '%s'"%(where, value))
+    if jobs < 1:
+        raise GiveUp("%s must be at least 1, not %d"%(where, jobs))
+    return jobs
+
+def default_jobs():
+    """
+    Return the number of jobs to run at once, if not told otherwise.
+
+    This is taken from $MUDDLE_JOBS, if it is set, and is otherwise 1.
+    """
+    value = os.environ.get('MUDDLE_JOBS')
+    if value:
+        return parse_jobs(value, '$MUDDLE_JOBS')
+    else:
+        return 1
+
+def remove_jobs_switch(args, bare_j_allowed=False):
+    """
+    Look for "-j <N>" (or "-j<N>") amongst the switches at the start of 'args'.
+
+    If 'bare_j_allowed' is true, then "-j" that is not followed by a number is
+    left alone, as a switch in its own right.
+
+    Returns a tuple (jobs, remaining_args), where 'jobs' is None if no such
+    switch was found.
+    """
+    jobs = None
+    remaining = []
+    while args:
+        word = args[0]
+        if word[0] != '-':
+            break
+        if word == '-j' and bare_j_allowed and not (len(args) > 1 and
+                                                    args[1].isdigit()):
+            remaining.append(word)
+            args = args[1:]
+        elif word == '-j':
+            if len(args) < 2:
+                raise GiveUp('-j must be followed by a number of jobs')
+            jobs = parse_jobs(args[1], '-j')
+            args = args[2:]
+        elif word.startswith('-j'):
+            jobs = parse_jobs(word[2:], '-j')
+            args = args[1:]
+        else:
+            remaining.append(word)
+            args = args[1:]
+    return jobs, remaining + args
+
+def build_labels(builder, to_build, jobs=None):
+    """
+    Build the labels in 'to_build'.
+
+    If 'jobs' is more than 1, then that many labels may be built at once.
+    If it is None, then the default from $MUDDLE_JOBS is used.
+    """
+    if jobs is None:
+        jobs = default_jobs()
+
     if len(to_build) == 1:
         print "Building %s"%to_build[0]
     else:
         print "Building %d labels"%len(to_build)
 
+    if jobs > 1:
+        print "Running up to %d jobs at once"%jobs
+        builder.build_labels_in_parallel(to_build, jobs)
+        return
+
     try:
         for lbl in to_build:
             builder.build_label(lbl)
@@ -896,6 +1045,17 @@ Available <options> are:
 
   --help, -h, -?      This help text
   --tree <dir>        Use the muddle build tree at <dir>.
+  --trace <file>      Write a trace of what muddle did, and how long each part
+                      took, to <file>. This is in the Chrome Trace Event
+                      Format, so can be loaded into (for instance) Chrome's
+                      chrome://tracing or https://ui.perfetto.dev/
+  --profile[=cumulative|tottime]
+                      Run muddle under the Python profiler, write the profile
+                      to muddle.prof in the current directory, and report on
+                      the functions that took most time (sorted by cumulative
+                      time, the default, or by the time spent in the function
+                      itself), and the time spent in each phase of the
+                      command.
   --just-print, -n    Just print what muddle would have done. For commands that
                       'do something', just print out the labels for which that
                       action would be performed. For commands that "enquire"
@@ -2607,6 +2767,58 @@ class QueryName(QueryCommand):
     def with_build_tree(self, builder, current_dir, args):
         print builder.build_name
 
+@subcommand('query', 'cache-stats', CAT_QUERY)
+class QueryCacheStats(QueryCommand):
+    """
+    :Syntax: muddle query cache-stats
+
+    Report on the artifact cache named by $MUDDLE_CACHE: how many entries it
+    has, how big it is, and how often packages have been restored from it
+    (hits), or built because they were not in it (misses).
+
+    If $MUDDLE_CACHE is set, then when a package is built, the files in its
+    object directory, and those it added to (or changed in) its install
+    directory, are stored in the cache. When the same package (built from
+    the same checkout revisions, with the same environment and the same
+    dependencies) is next to be built, in a build tree at the same path,
+    those files are restored from the cache instead. (Built files often
+    contain the paths they were built with, so they cannot be restored
+    anywhere else.) The cache is kept smaller than $MUDDLE_CACHE_SIZE
+    (default 5G) by discarding the entries that were least recently used.
+
+    If $MUDDLE_REMOTE_CACHE is also set, it is the URL of a remote cache
+    shared by several build hosts (for instance, one run with the
+    muddle_cache_server.py script). Packages that are not in the local cache
+    are fetched from it if it has them ("Fetched"), and packages that are
+    stored in the local cache are also uploaded to it.
+    """
+
+    def with_build_tree(self, builder, current_dir, args):
+        if args:
+            raise GiveUp("Syntax: muddle query cache-stats")
+        cache = artifact_cache()
+        if cache is None:
+            print 'There is no artifact cache, because $MUDDLE_CACHE is not set'
+            return
+
+        stats = cache.stats()
+        lookups = stats['hit'] + stats['miss']
+        if lookups:
+            hit_rate = '%.1f%%'%(100.0 * stats['hit'] / lookups)
+        else:
+            hit_rate = '-'
+        print 'Artifact cache:  %s'%cache.cache_dir
+        print 'Entries:         %d'%stats['entries']
+        print 'Files:           %d'%stats['objects']
+        print 'Size:            %s (limit %s)'%(format_size(stats['size']),
+                                               format_size(cache.max_size))
+        print 'Hits:            %d'%stats['hit']
+        print 'Misses:          %d'%stats['miss']
+        print 'Hit rate:        %s'%hit_rate
+        print 'Stored:          %d'%stats['store']
+        print 'Fetched:         %d'%stats['fetch']
+        print 'Evicted:         %d'%stats['evict']
+
 @subcommand('query', 'needed-by', CAT_QUERY)     # it used to be 'deps'
 class QueryNeededBy(QueryCommand):
     """
@@ -2628,6 +2840,180 @@ class QueryNeededBy(QueryCommand):
         else:
             print "Nothing else needs building to build %s"%label
 
+@subcommand('query', 'critical-path', CAT_QUERY)
+class QueryCriticalPath(QueryCommand):
+    """
+    :Syntax: muddle query critical-path <label>
+
+    Print the chain of labels that bounds how long it takes to build this
+    label - that is, of the labels we need to build to build it (see
+    "muddle query needed-by"), the chain of dependencies that takes longest
+    to build, however many build jobs we run at once.
+
+    How long each label takes to build is estimated from how long it took
+    the last few times it was built in this build tree. Labels that have
+    never been built (or that have nothing to do) count as taking no time.
+
+    <label> is a label or label fragment (see "muddle help labels"). The
+    default type is 'package:'.
+    """
+
+    def with_build_tree(self, builder, current_dir, args):
+        label = self.get_label_from_fragment(builder, args)
+        history = builder.db.build_history
+        unknown = set()
+
+        def cost(lbl):
+            estimate = history.estimate(lbl)
+            if estimate is None:
+                unknown.add(lbl)
+                return 0
+            return estimate
+
+        total, chain = depend.critical_path(builder.ruleset, label, cost,
+                                            useMatch=True)
+        if not chain:
+            print "Nothing needs building to build %s"%label
+            return
+
+        print "Critical path for %s (about %s):"%(label,
+                                                 utils.format_duration(total))
+        print
+        print '%10s %10s  %s'%('Time', 'Total', 'Label')
+        so_far = 0
+        for lbl in chain:
+            estimate = history.estimate(lbl)
+            if estimate is None:
+                time_text = '-'
+            else:
+                so_far += estimate
+                time_text = utils.format_duration(estimate)
+            print '%10s %10s  %s'%(time_text, utils.format_duration(so_far), lbl)
+        if unknown:
+            print
+            print '%d of the labels needed have no recorded build time'%len(unknown)
+
+@subcommand('query', 'timings', CAT_QUERY)
+class QueryTimings(QueryCommand):
+    """
+    :Syntax: muddle query timings [-sort time|name] [-top <n>] [<label> ...]
+
+    Report how long building labels took, the last time each was built.
+
+    Every time muddle runs the action for a label, it records (in
+    .muddle/_build_history) when it started and stopped, the class of the
+    action, whether it succeeded, and the CPU time and largest resident set
+    size ("max RSS") of the processes the action ran. Only the most recent
+    record for each label is used here.
+
+    This reports the time taken by the <n> slowest labels (default 10), and
+    then the total time taken for each label, for each package (whatever
+    its role), for each role and for each domain. Labels whose action
+    failed are marked as such.
+
+    With "-sort time" (the default), the totals are sorted slowest first,
+    with "-sort name" they are sorted by name.
+
+    If any <label>s are given, then only labels that match them are reported
+    on. Each <label> is a label or label fragment (see "muddle help labels").
+    The default type is 'package:'. A fragment that does not give a role or
+    a tag matches any role or tag, so "first" matches all of the labels for
+    package "first".
+    """
+
+    def with_build_tree(self, builder, current_dir, args):
+        sort_by = 'time'
+        top = 10
+        patterns = []
+        while args:
+            word = args.pop(0)
+            if word == '-sort' and args:
+                sort_by = args.pop(0)
+                if sort_by not in ('time', 'name'):
+                    raise GiveUp("-sort must be followed by 'time' or 'name',"
+                                 " not '%s'"%sort_by)
+            elif word == '-top' and args:
+                try:
+                    top = int(args.pop(0))
+                except ValueError:
+                    raise GiveUp('-top must be followed by a number')
+            elif word.startswith('-'):
+                raise GiveUp("Unexpected switch '%s' for 'query timings'"%word)
+            else:
+                patterns.append(self._timings_pattern(word))
+
+        records = []
+        for text, record in builder.db.build_history.latest().items():
+            label = Label.from_string(text)
+            if patterns and not any(p.match(label) is not None for p in patterns):
+                continue
+            records.append((label, record))
+
+        if not records:
+            print 'No build times have been recorded'
+            return
+
+        print 'The %d slowest labels:'%min(top, len(records))
+        print
+        print '%10s %10s %10s  %s'%('Time', 'CPU', 'Max RSS', 'Label')
+        by_time = sorted(records, key=lambda x: (-x[1]['duration'], str(x[0])))
+        for label, record in by_time[:top]:
+            cpu = record.get('cpu')
+            max_rss = record.get('max_rss')
+            if record.get('status', 0) != 0:
+                failed = ' (failed, status %s)'%record['status']
+            else:
+                failed = ''
+            print '%10s %10s %10s  %s%s'%(utils.format_duration(record['duration']),
+                                          '-' if cpu is None else utils.format_duration(cpu),
+                                          '-' if max_rss is None else format_size(max_rss*1024),
+                                          label, failed)
+
+        per_label = {}
+        per_package = {}
+        per_role = {}
+        per_domain = {}
+        for label, record in records:
+            duration = record['duration']
+            for totals, key in ((per_label, str(label)),
+                                (per_domain, label.domain or '(top level)')):
+                totals[key] = totals.get(key, 0) + duration
+            if label.type == LabelType.Package:
+                if label.domain:
+                    package = '(%s)%s'%(label.domain, label.name)
+                else:
+                    package = label.name
+                per_package[package] = per_package.get(package, 0) + duration
+                per_role[label.role] = per_role.get(label.role, 0) + duration
+
+        for title, totals in (('label', per_label), ('package', per_package),
+                              ('role', per_role), ('domain', per_domain)):
+            if not totals:
+                continue
+            if sort_by == 'time':
+                keys = sorted(totals, key=lambda k: (-totals[k], k))
+            else:
+                keys = sorted(totals)
+            print
+            print 'Total time per %s:'%title
+            print
+            for key in keys:
+                print '%10s  %s'%(utils.format_duration(totals[key]), key)
+
+        print
+        print 'Total time: %s'%utils.format_duration(sum(per_label.values()))
+
+    def _timings_pattern(self, fragment):
+        """Return a (wildcarded) label to match the labels 'fragment' means.
+        """
+        label = Label.from_fragment(fragment, default_type=LabelType.Package,
+                                    default_role='*')
+        if '/' not in fragment:
+            label = label.copy_with_tag('*')
+        if label.type != LabelType.Package:
+            label = label.copy_with_role(None)
+        return label
+
 @subcommand('query', 'checkout-id', CAT_QUERY)
 class QueryCheckoutId(QueryCommand):
     """
@@ -2928,27 +3314,22 @@ class QueryMakeEnv(QueryCommand):
             print 'Multiple rules for building %s'%label
             return
 
-        # Amend the environment as if we were about to build
-        old_env = os.environ
+        # Work out the environment as if we were about to build
+        env = builder._new_label_environment(label, {})
+        rule = list(rule_set)[0]
+        build_action = rule.action
+        tmp = Label(LabelType.Checkout, build_action.co, domain=label.domain)
+        co_path = builder.db.get_checkout_path(tmp)
         try:
-            os.environ = {}
-            rule = list(rule_set)[0]
-            builder._build_label_env(label, env_store)
-            build_action = rule.action
-            tmp = Label(LabelType.Checkout, build_action.co, domain=label.domain)
-            co_path = builder.db.get_checkout_path(tmp)
-            try:
-                build_action._amend_env(co_path)
-            except AttributeError:
-		# The kernel builder, for instance, does not have _amend_env
-		# Of course, it also doesn't use any of the make.py classes...
-                pass
-            keys = os.environ.keys()
-            keys.sort()
-            for key in keys:
-                print '%s=%s'%(key,os.environ[key])
-        finally:
-            os.environ = old_env
+            build_action._amend_env(co_path, env)
+        except AttributeError:
+            # The kernel builder, for instance, does not have _amend_env
+            # Of course, it also doesn't use any of the make.py classes...
+            pass
+        keys = env.keys()
+        keys.sort()
+        for key in keys:
+            print '%s=%s'%(key,env[key])
 
 @subcommand('query', 'objdir', CAT_QUERY)
 class QueryObjdir(QueryCommand):
@@ -3407,88 +3788,6 @@ class Whereami(Command):
             print "You are here. Here is not in a muddle build tree."
 
 
-@command('doc', CAT_QUERY)
-class Doc(Command):
-    """
-    :Syntax: muddle doc [<switch> ...] [<what>]
-
-    To get documentation on modules, classes, methods or functions in muddle,
-    use::
-
-        muddle doc <name>               for help on <name>
-        muddle doc -contains <what>     to list all names that contain <what>
-
-    There are also (mainly for use in debugging muddle itself - beware,
-    they all produce long output)::
-
-        muddle doc -duplicates     to list all duplicate (partial) names
-        muddle doc -list           to list all the "full" names we know
-        muddle doc -dump           to dump the internal map of names/values
-
-    <switch> may also be::
-
-        -p[ager] <pager>    to specify a pager through which the text will be
-                            piped. The default is $PAGER (if set) or else
-                            'more'.
-        -nop[ager]          don't use a pager, just print the text out.
-        -pydoc              Use pydoc's rendering to output the text about the
-                            item. This tends to produce more information. It
-                            is also (more or less) the format that the older
-                            "muddle doc" command used.
-
-    The plain "muddle doc <name>" can be used to find out about any muddle
-    module, class, method or function. Leading parts of the name can be
-    omitted ("Builder" and "mechanics.Builder" and "muddled.mechanics.Builder"
-    are all the same), provided that doesn't make <name> ambiguous, and if it
-    does, you will be given a list of the possible alternatives. So, for
-    instance::
-
-        $ muddle doc Builder
-
-    will report on muddled.mechanics.Builder, but::
-
-        $ muddle doc simple
-
-    will give a list of all the names that contain 'simple'.
-
-    If you're not sure of a name, then "-contains" can be used to look for all
-    the (full names - i.e., starting with "muddled.") that contain that string.
-    For instance::
-
-        $ muddle doc -contains absolute
-        The following names contain "absolute":
-          muddled.checkouts.multilevel.absolute
-          muddled.checkouts.simple.absolute
-          muddled.checkouts.twolevel.absolute
-
-    and one can then safely do::
-
-        $ muddle doc simple.absolute
-
-    For a module, the module docstring is reported, and then a list of the
-    names of all the classes and functions in that module.
-
-    For a class, the classes it inherits from, its docstring and its __init__
-    method are all reported, followed by a list of the methods in that class.
-
-    For a method or function, its argument list (signature) and docstring are
-    reported.
-
-    If "-pydoc" is specified, then the layout of various things will be
-    different, and also the full documentation of internal items (methods
-    inside classes, etc.) will be reported - this can lead to substantially
-    longer output.
-    """
-
-    def requires_build_tree(self):
-        return False
-
-    def with_build_tree(self, builder, current_dir, args):
-        muddled.docreport.report(args)
-
-    def without_build_tree(self, muddle_binary, current_dir, args):
-        muddled.docreport.report(args)
-
 # -----------------------------------------------------------------------------
 # Stamp commands
 # -----------------------------------------------------------------------------
@@ -3509,6 +3808,7 @@ class StampSave(Command):
     * -f, -force - "force" a revision id
     * -h, -head - use HEAD for all checkouts
     * -v <version>, -version <version>  - specify the version of stamp file
+    * -j <N> - ask about up to <N> checkouts at once
 
     These are explained more below. Switches may occur before or after
     <filename>.
@@ -3571,6 +3871,12 @@ class StampSave(Command):
     version of muddle or not). Note that the version 1 stamp file created
     by muddle 2.3 and above is not absolutely guaranteed to be correct.
 
+    If '-j <N>' is given, then the revisions (and branches) of up to <N>
+    checkouts are worked out at once, each in its own process. This is
+    worth doing if asking the VCS involves the network (as it does for
+    Subversion, for instance), or if there are many checkouts. The stamp
+    file is the same either way.
+
     See "muddle unstamp" for restoring from stamp files.
     """
 
@@ -3583,6 +3889,7 @@ class StampSave(Command):
         filename = None
         when = None
         version = 2
+        jobs = 1
 
         while args:
             word = args.pop(0)
@@ -3603,6 +3910,10 @@ class StampSave(Command):
                     raise GiveUp("-version must be followed by 1 or 2, not '%s'"%args[0])
                 if version not in (1, 2):
                     raise GiveUp("-version must be followed by 1 or 2, not '%s'"%args[0])
+            elif word == '-j':
+                if not args:
+                    raise GiveUp('-j must be followed by a number of jobs')
+                jobs = parse_jobs(args.pop(0), '-j')
             elif word.startswith('-'):
                 raise GiveUp("Unexpected switch '%s' for 'stamp save'"%word)
             elif filename is None:
@@ -3618,7 +3929,8 @@ class StampSave(Command):
         if self.no_op():
             return
 
-        stamp, problems = VersionStamp.from_builder(builder, force, just_use_head, before=when)
+        stamp, problems = VersionStamp.from_builder(builder, force, just_use_head,
+                                                    before=when, jobs=jobs)
 
         working_filename = '_temporary.stamp'
         print 'Writing to',working_filename
@@ -3659,7 +3971,7 @@ class StampSave(Command):
 @subcommand('stamp', 'version', CAT_EXPORT)
 class StampVersion(Command):
     """
-    :Syntax: muddle stamp version [-f[orce]|-v[ersion] <version>]
+    :Syntax: muddle stamp version [-f[orce]|-v[ersion] <version>] [-j <N>]
 
     This is similar to "stamp save", but using a pre-determined stamp filename.
 
@@ -3703,6 +4015,9 @@ class StampVersion(Command):
     particular version of muddle or not). Note that the version 1 stamp file
     created by muddle 2.3 and above is not absolutely guaranteed to be correct.
 
+    If '-j <N>' is given, then up to <N> checkouts are asked about at once,
+    as for "stamp save".
+
     See "muddle unstamp" for restoring from stamp files.
     """
 
@@ -3717,6 +4032,7 @@ class StampVersion(Command):
     def with_build_tree(self, builder, current_dir, args):
         force = False
         version = 2
+        jobs = 1
 
         while args:
             word = args[0]
@@ -3733,6 +4049,11 @@ class StampVersion(Command):
                 if version not in (1, 2):
                     raise GiveUp("-version must be followed by 1 or 2, not '%s'"%args[0])
                 args = args[1:]
+            elif word == '-j':
+                if not args:
+                    raise GiveUp('-j must be followed by a number of jobs')
+                jobs = parse_jobs(args[0], '-j')
+                args = args[1:]
             elif word.startswith('-'):
                 raise GiveUp("Unexpected switch '%s' for 'stamp version'"%word)
             else:
@@ -3745,7 +4066,8 @@ class StampVersion(Command):
             return
 
         stamp, problems = VersionStamp.from_builder(builder, force,
-                                                    just_use_head=False)
+                                                    just_use_head=False,
+                                                    jobs=jobs)
 
         if problems:
             print problems
@@ -3848,6 +4170,10 @@ class StampRelease(Command):
        This specifies how the archive will be compressed. The default is
        "gzip", and at the moment the only other alternative is "bzip2".
 
+    * -j <N>
+
+      Ask about up to <N> checkouts at once, as for "stamp save".
+
     See "muddle release" for using release files to build a release.
 
     Note that release files are also valid stamp files, so "muddle unstamp"
@@ -3869,6 +4195,7 @@ class StampRelease(Command):
         compression = None
         is_template = False
         guess_version = False
+        jobs = 1
 
         while args:
             word = args.pop(0)
@@ -3880,6 +4207,10 @@ class StampRelease(Command):
                 archive = args.pop(0)
             elif word == '-compression':
                 compression = args.pop(0)
+            elif word == '-j':
+                if not args:
+                    raise GiveUp('-j must be followed by a number of jobs')
+                jobs = parse_jobs(args.pop(0), '-j')
             elif word.startswith('-'):
                 raise GiveUp("Unexpected switch '%s' for 'stamp release'"%word)
             elif name is None:
@@ -3902,7 +4233,7 @@ class StampRelease(Command):
         release = ReleaseSpec(name, version, archive, compression)
         builder.release_spec = release
 
-        stamp, problems = ReleaseStamp.from_builder(builder)
+        stamp, problems = ReleaseStamp.from_builder(builder, jobs=jobs)
 
         if problems:
             print problems
@@ -4401,14 +4732,14 @@ class UnStamp(Command):
     """
     To create a build tree from a stamp file:
 
-    :Syntax: muddle unstamp <file>
-    :or:     muddle unstamp <url>
-    :or:     muddle unstamp <vcs>+<url>
-    :or:     muddle unstamp <vcs>+<repo_url> <version_desc>
+    :Syntax: muddle unstamp [-j <N>] <file>
+    :or:     muddle unstamp [-j <N>] <url>
+    :or:     muddle unstamp [-j <N>] <vcs>+<url>
+    :or:     muddle unstamp [-j <N>] <vcs>+<repo_url> <version_desc>
 
     To update a build tree from a stamp file:
 
-    :Syntax: muddle unstamp -u[pdate] <file>
+    :Syntax: muddle unstamp [-j <N>] -u[pdate] <file>
 
     Creating a build tree from a stamp file
     ---------------------------------------
@@ -4468,6 +4799,13 @@ class UnStamp(Command):
 
       and then unstamp the ProjectThing.stamp file therein.
 
+    If '-j <N>' is given, then up to <N> checkouts are checked out at once,
+    each in its own process. The build descriptions for any subdomains are
+    still checked out first, one at a time, as each subdomain needs the
+    domain that contains it. The output for each checkout is still reported
+    in order, and if any of them fail, the rest are still checked out, and
+    the problems are reported at the end.
+
     Updating a build tree from a stamp file
     ---------------------------------------
     The "-update" form ("unstamp -update" or "unstamp -u") also reads the
@@ -4493,6 +4831,9 @@ class UnStamp(Command):
     checkout". Newly cloned checkouts will not be represented in
     "_just_pulled".
 
+    If '-j <N>' is given, then it is passed on to "muddle pull", so that up
+    to <N> checkouts are updated at once.
+
     In the simplest case, the "unstamp -update" operation may just involve
     choosing different revisions on some checkouts.
 
@@ -4513,14 +4854,14 @@ class UnStamp(Command):
         print """
     To create a build tree:
 
-    :Syntax: muddle unstamp <file>
-    :or:     muddle unstamp <url>
-    :or:     muddle unstamp <vcs>+<url>
-    :or:     muddle unstamp <vcs>+<repo_url> <version_desc>
+    :Syntax: muddle unstamp [-j <N>] <file>
+    :or:     muddle unstamp [-j <N>] <url>
+    :or:     muddle unstamp [-j <N>] <vcs>+<url>
+    :or:     muddle unstamp [-j <N>] <vcs>+<repo_url> <version_desc>
 
     To update a build tree:
 
-    :Syntax: muddle unstamp -u[pdate] <file>
+    :Syntax: muddle unstamp [-j <N>] -u[pdate] <file>
 
     Try "muddle help unstamp" for more information."""
 
@@ -4529,6 +4870,8 @@ class UnStamp(Command):
             '-update' : 'update',
             }
 
+    jobs = None
+
     def requires_build_tree(self):
         return False
 
@@ -4537,6 +4880,7 @@ class UnStamp(Command):
 
     def with_build_tree(self, builder, current_dir, args):
 
+        self.jobs, args = remove_jobs_switch(args)
         args = self.remove_switches(args)
 
         if 'update' not in self.switches:
@@ -4551,6 +4895,7 @@ class UnStamp(Command):
 
     def without_build_tree(self, muddle_binary, current_dir, args):
 
+        self.jobs, args = remove_jobs_switch(args)
         args = self.remove_switches(args)
 
         if 'update' in self.switches:
@@ -4599,6 +4944,9 @@ class UnStamp(Command):
             parts = urlparse(thing)
             path, filename = os.path.split(parts.path)
             print 'Retrieving %s'%filename
+            # urllib takes a while to import, and is rarely needed, so we
+            # don't import it until we need it
+            import urllib
             data = urllib.urlretrieve(thing, filename)
 
         if self.no_op():
@@ -4702,25 +5050,57 @@ class UnStamp(Command):
 
         co_labels = checkouts.keys()
         co_labels.sort()
-        for label in co_labels:
-            co_dir, co_leaf, repo = checkouts[label]
-            if label.domain:
-                domain_root_path = self._domain_path(current_dir, label.domain)
-                print "Unstamping checkout (%s)%s"%(label.domain,label.name)
-                if co_dir:
-                    actual_co_dir = os.path.join(domain_root_path, 'src', co_dir)
-                else:
-                    actual_co_dir = os.path.join(domain_root_path, 'src')
-                checkout_from_repo(builder, label, repo, actual_co_dir, co_leaf)
-            else:
-                print "Unstamping checkout %s"%label.name
-                checkout_from_repo(builder, label, repo, co_dir, co_leaf)
+        if self.jobs > 1 and len(co_labels) > 1:
+            self.restore_checkouts_in_parallel(builder, current_dir,
+                                               co_labels, checkouts)
+            return
 
+        for label in co_labels:
+            self.add_stamp_checkout(builder, current_dir, label, checkouts[label])
 
             # Then need to mimic "muddle checkout" for it
             new_label = label.copy_with_tag(LabelTag.CheckedOut)
             builder.build_label(new_label, silent=False)
 
+    def add_stamp_checkout(self, builder, current_dir, label, checkout):
+        """
+        Tell 'builder' about a checkout from our stamp file.
+        """
+        co_dir, co_leaf, repo = checkout
+        if label.domain:
+            domain_root_path = self._domain_path(current_dir, label.domain)
+            print "Unstamping checkout (%s)%s"%(label.domain,label.name)
+            if co_dir:
+                actual_co_dir = os.path.join(domain_root_path, 'src', co_dir)
+            else:
+                actual_co_dir = os.path.join(domain_root_path, 'src')
+            checkout_from_repo(builder, label, repo, actual_co_dir, co_leaf)
+        else:
+            print "Unstamping checkout %s"%label.name
+            checkout_from_repo(builder, label, repo, co_dir, co_leaf)
+
+    def restore_checkouts_in_parallel(self, builder, current_dir,
+                                      co_labels, checkouts):
+        """
+        Check out the checkouts from our stamp file, up to self.jobs at once.
+
+        All of the checkouts must be known to 'builder' before we start any
+        workers, as each worker has its own copy of it.
+        """
+        for label in co_labels:
+            self.add_stamp_checkout(builder, current_dir, label, checkouts[label])
+
+        print 'Checking out up to %d checkouts at once'%self.jobs
+        labels = [label.copy_with_tag(LabelTag.CheckedOut) for label in co_labels]
+        results = run_in_workers(builder, labels, _check_out_checkout, self.jobs)
+        problems = [e for co, pulled, e in results if e is not None]
+        if problems:
+            print '\nThe following problems occurred:'
+            for e in problems:
+                print
+                print str(e).rstrip()
+            raise GiveUp()
+
     def update_from_stamp(self, builder, domains, checkouts):
         """
         Given the information from our stamp file, update the current build.
@@ -4823,7 +5203,10 @@ class UnStamp(Command):
                 # build description *and reload it* then we will lose the build
                 # tree we have lovingly created above, which rather defeats
                 # the purpose.
-                p.with_build_tree(builder, root_path, ['-noreload'] + changed_checkouts)
+                args = ['-noreload']
+                if self.jobs:
+                    args += ['-j', str(self.jobs)]
+                p.with_build_tree(builder, root_path, args + changed_checkouts)
             except GiveUp as e:
                 had_problems = True
 
@@ -5513,7 +5896,7 @@ class Reconfigure(PackageCommand):
 @command('build', CAT_PACKAGE)
 class Build(PackageCommand):
     """
-    :Syntax: muddle build [ <package> ... ]
+    :Syntax: muddle build [-j <N>] [ <package> ... ]
 
     Build packages.
 
@@ -5546,15 +5929,36 @@ class Build(PackageCommand):
     This sequence is why a dependency on a package should normally be made
     on package:<name>{<role>}/postinstalled - that is the final stage of
     building any package.
+
+    With "-j <N>" (or "-j<N>"), up to <N> packages are built at the same
+    time, as soon as everything they depend on has been built. If -j is not
+    given, the value of $MUDDLE_JOBS is used, and if that is not set then
+    packages are built one at a time. The output from each package is shown
+    when it finishes, so that output from different packages is not mixed
+    together. If a package fails to build, no more builds are started, but
+    those already under way are allowed to finish.
+
+    If $MUDDLE_FINGERPRINTS is set, then muddle remembers a "fingerprint" of
+    what went into each package step it builds: the revisions of the
+    checkouts it uses, its environment, and the fingerprints of the packages
+    it depends on. A step whose tag is set will still be built again if its
+    fingerprint has changed - so after "muddle pull", "muddle build" will
+    rebuild just those packages that are affected.
+
+    If $MUDDLE_CACHE is set, then packages are restored from (and stored in)
+    the artifact cache it names, whenever their checkouts have no local
+    changes. See "muddle help query cache-stats" for more information.
     """
 
+    allows_jobs = True
+
     def build_these_labels(self, builder, labels):
-        build_labels(builder, labels)
+        build_labels(builder, labels, self.jobs)
 
 @command('rebuild', CAT_PACKAGE)
 class Rebuild(PackageCommand):
     """
-    :Syntax: muddle rebuild [ <package> ... ]
+    :Syntax: muddle rebuild [-j <N>] [ <package> ... ]
 
     Rebuild packages. Just like build except that we clear any '/built' tags
     first (and their dependencies).
@@ -5572,19 +5976,23 @@ class Rebuild(PackageCommand):
        label with its '/installed' and '/postinstalled' tags.
     2. For each label, build its '/postinstalled' tag (so essentially, do
        the equivalent of "muddle build").
+
+    "-j <N>" is as for "muddle build".
     """
 
+    allows_jobs = True
+
     def build_these_labels(self, builder, labels):
         # OK. Now we have our labels, retag them, and kill them and their
         # consequents
         to_kill = depend.retag_label_list(labels, LabelTag.Built)
         kill_labels(builder, to_kill)
-        build_labels(builder, labels)
+        build_labels(builder, labels, self.jobs)
 
 @command('reinstall', CAT_PACKAGE)
 class Reinstall(PackageCommand):
     """
-    :Syntax: muddle reinstall [ <package> ... ]
+    :Syntax: muddle reinstall [-j <N>] [ <package> ... ]
 
     Reinstall packages (but don't rebuild them).
 
@@ -5601,19 +6009,23 @@ class Reinstall(PackageCommand):
        label with its '/postinstalled' tag.
     2. For each label, build its '/postinstalled' tag (so essentially, do
        the equivalent of "muddle build").
+
+    "-j <N>" is as for "muddle build".
     """
 
+    allows_jobs = True
+
     def build_these_labels(self, builder, labels):
         # OK. Now we have our labels, retag them, and kill them and their
         # consequents
         to_kill = depend.retag_label_list(labels, LabelTag.Installed)
         kill_labels(builder, to_kill)
-        build_labels(builder, labels)
+        build_labels(builder, labels, self.jobs)
 
 @command('distrebuild', CAT_PACKAGE)
 class Distrebuild(PackageCommand):
     """
-    :Syntax: muddle distrebuild [ <package> ... ]
+    :Syntax: muddle distrebuild [-j <N>] [ <package> ... ]
 
     A rebuild that does a distclean before attempting the rebuild.
 
@@ -5627,11 +6039,15 @@ class Distrebuild(PackageCommand):
 
     1. Do a "muddle distclean" for all the labels
     2. Do a "muddle build" for all the labels
+
+    "-j <N>" is as for "muddle build".
     """
 
+    allows_jobs = True
+
     def build_these_labels(self, builder, labels):
         build_a_kill_b(builder, labels, LabelTag.DistClean, LabelTag.PreConfig)
-        build_labels(builder, labels)
+        build_labels(builder, labels, self.jobs)
 
 @command('clean', CAT_PACKAGE)
 class Clean(PackageCommand):
@@ -5831,7 +6247,7 @@ class Push(CheckoutCommand):
 @command('pull', CAT_CHECKOUT, ['fetch', 'update'])   # we want to settle on one command
 class Pull(CheckoutCommand):
     """
-    :Syntax: muddle pull [-s[top]] [-noreload] [ <checkout> ... ]
+    :Syntax: muddle pull [-s[top]] [-noreload] [-j <N>] [ <checkout> ... ]
 
     Pull the specified checkouts from their remote repositories. Any problems
     will be (re)reported at the end.
@@ -5865,6 +6281,12 @@ class Pull(CheckoutCommand):
     re-reporting any problems at the end. If '-s' or '-stop' is given, then
     it will instead stop at the first problem.
 
+    If '-j <N>' is given, then up to <N> checkouts are pulled at once, each
+    in its own process. The output from each pull is still reported in
+    order, as each finishes. Build descriptions are always pulled first,
+    one at a time, as described below. With '-s', no more pulls are started
+    after a problem, but those already running are allowed to finish.
+
     How build descriptions are treated specially
     --------------------------------------------
     If the build description is in the list of checkouts that should be
@@ -5910,6 +6332,7 @@ class Pull(CheckoutCommand):
     allowed_switches = {'-s': 'stop',
                         '-stop':'stop',
                         '-noreload':'noreload'}
+    allows_jobs = True
 
     def build_these_labels(self, builder, labels):
 
@@ -5928,8 +6351,11 @@ class Pull(CheckoutCommand):
             if do_build_descriptions_first and len(labels) > 1:
                 builder, labels = self.handle_build_descriptions_first(builder, labels)
 
-            for co in labels:
-                self.pull(builder, co)
+            if self.jobs > 1 and len(labels) > 1:
+                self.pull_in_parallel(builder, sorted(labels))
+            else:
+                for co in sorted(labels):
+                    self.pull(builder, co)
         finally:
             # Remember to commit the 'just pulled' information, whatever happens
             builder.db.just_pulled.commit()
@@ -6082,6 +6508,24 @@ class Pull(CheckoutCommand):
                 print e
                 self.problems.append(e)
 
+    def pull_in_parallel(self, builder, labels):
+        """Pull the checkouts in 'labels', up to self.jobs at once.
+
+        If we are to stop on a problem, then no more pulls are started after
+        one fails, but (since others may have failed at the same time) the
+        problems are still all reported at the end.
+        """
+        print 'Pulling up to %d checkouts at once'%self.jobs
+        results = run_in_workers(builder, labels, _pull_checkout, self.jobs,
+                                 self.stop_on_problem)
+        for co, pulled, e in results:
+            if pulled:
+                builder.db.just_pulled.add(co)
+            if isinstance(e, Unsupported):
+                self.not_needed.append(e)
+            elif e is not None:
+                self.problems.append(e)
+
     def delete_pyc_files(self, builder, co_label):
         """Delete .pyc files in this checkout
         """
@@ -6096,6 +6540,24 @@ class Pull(CheckoutCommand):
                     print 'Deleting', path
                     os.remove(path)
 
+def _pull_checkout(builder, co_label):
+    """Pull checkout 'co_label', in a worker process.
+
+    Returns True if the pull changed the checkout.
+    """
+    builder.db.clear_tag(co_label)
+    builder.build_label(co_label)
+    return builder.db.just_pulled.is_pulled(co_label)
+
+def _check_out_checkout(builder, co_label):
+    """Check out checkout 'co_label', in a worker process.
+
+    Returns True if the checkout was checked out (rather than already
+    being there).
+    """
+    builder.build_label(co_label)
+    return builder.db.just_pulled.is_pulled(co_label)
+
 @command('merge', CAT_CHECKOUT)
 class Merge(CheckoutCommand):
     """
@@ -6176,7 +6638,7 @@ class Merge(CheckoutCommand):
 @command('status', CAT_CHECKOUT)
 class Status(CheckoutCommand):
     """
-    :Syntax: muddle status [-v] [-j] [-quick] [ <checkout> ... ]
+    :Syntax: muddle status [-v] [-j] [-quick] [-j <N>] [ <checkout> ... ]
 
     Report on the status of checkouts that need attention.
 
@@ -6216,6 +6678,11 @@ class Status(CheckoutCommand):
     can gives depends upon whatever was last fetched into the local repository.
     It can typically inform you if there are local updates to be pushed, but
     will not (cannot) warn you if there are commits to be pulled.
+
+    If '-j <N>' (or '-j<N>') is given, where <N> is a number, then up to <N>
+    checkouts are checked at once, each in its own process. The report for
+    each checkout is still printed in order. ('-j' on its own still means
+    "print the checkouts that need attention on one line".)
     """
 
     required_tag = LabelTag.CheckedOut
@@ -6223,6 +6690,8 @@ class Status(CheckoutCommand):
                         '-j': 'join',
                         '-quick' : 'quick'
                        }
+    allows_jobs = True
+    bare_j_allowed = True
 
     # This checkout command *is* allowed in a release build
     def allowed_in_release_build(self):
@@ -6240,33 +6709,19 @@ class Status(CheckoutCommand):
         quick = ('quick' in self.switches)
 
         something = []
-        for co in labels:
-            if not builder.db.is_tag(co):
-                print
-                print '%s is not checked out'%co
-                something.append(co)
-                continue
-
-            try:
-                vcs_handler = builder.db.get_checkout_vcs(co)
-            except GiveUp:
-                print "Rule for label '%s' has no VCS - cannot find its status"%co
-                something.append(co)
-                continue
-
-            try:
-                text = vcs_handler.status(builder, co, verbose, quick=quick)
-            except MuddleBug as err:
-                raise MuddleBug('Giving up in %s because:\n%s'%(co,err))
-            except GiveUp as err:
-                print err
-                something.append(co)
-                continue
-
-            if text:
-                print
-                print text.strip()
-                something.append(co)
+        if self.jobs > 1 and len(labels) > 1:
+            def check(builder, co):
+                return self.check_checkout(builder, co, verbose, quick)
+            results = run_in_workers(builder, labels, check, self.jobs)
+            for co, needs_attention, e in results:
+                if e is not None:
+                    raise e
+                if needs_attention:
+                    something.append(co)
+        else:
+            for co in labels:
+                if self.check_checkout(builder, co, verbose, quick):
+                    something.append(co)
 
         if something:
             if joined:
@@ -6278,6 +6733,36 @@ class Status(CheckoutCommand):
         else:
             print 'All checkouts seemed clean'
 
+    def check_checkout(self, builder, co, verbose, quick):
+        """Report on the status of checkout 'co'.
+
+        Returns True if it needs attention.
+        """
+        if not builder.db.is_tag(co):
+            print
+            print '%s is not checked out'%co
+            return True
+
+        try:
+            vcs_handler = builder.db.get_checkout_vcs(co)
+        except GiveUp:
+            print "Rule for label '%s' has no VCS - cannot find its status"%co
+            return True
+
+        try:
+            text = vcs_handler.status(builder, co, verbose, quick=quick)
+        except MuddleBug as err:
+            raise MuddleBug('Giving up in %s because:\n%s'%(co,err))
+        except GiveUp as err:
+            print err
+            return True
+
+        if text:
+            print
+            print text.strip()
+            return True
+        return False
+
 @command('reparent', CAT_CHECKOUT)
 class Reparent(CheckoutCommand):
     """
@@ -6442,7 +6927,7 @@ class Import(CheckoutCommand):
 @command('checkout', CAT_CHECKOUT)
 class Checkout(CheckoutCommand):
     """
-    :Syntax: muddle checkout [ <checkout> ... ]
+    :Syntax: muddle checkout [-j <N>] [ <checkout> ... ]
 
     Checks out the specified checkouts.
 
@@ -6466,12 +6951,40 @@ class Checkout(CheckoutCommand):
         (The value of _just_pulled is cleared at the start of "muddle pull"
         or "muddle checkout", and set at the end - the list of checkout labels
         is actually stored in the file .muddle/_just_pulled.)
+
+    If '-j <N>' is given, then up to <N> checkouts are checked out at once,
+    each in its own process. The output from each is still reported in
+    order, as each finishes. If any of them fail, the rest are still checked
+    out, and the problems are reported at the end.
     """
 
+    allows_jobs = True
+
     def build_these_labels(self, builder, labels):
         builder.db.just_pulled.clear()
-        for co in labels:
-            builder.build_label(co)
+        if self.jobs > 1 and len(labels) > 1:
+            self.check_out_in_parallel(builder, labels)
+        else:
+            for co in labels:
+                builder.build_label(co)
+
+    def check_out_in_parallel(self, builder, labels):
+        """Check out the checkouts in 'labels', up to self.jobs at once.
+        """
+        print 'Checking out up to %d checkouts at once'%self.jobs
+        results = run_in_workers(builder, labels, _check_out_checkout, self.jobs)
+        problems = []
+        for co, pulled, e in results:
+            if pulled:
+                builder.db.just_pulled.add(co)
+            if e is not None:
+                problems.append(e)
+        if problems:
+            print '\nThe following problems occurred:'
+            for e in problems:
+                print
+                print str(e).rstrip()
+            raise GiveUp()
 
 @command('sync', CAT_CHECKOUT)
 class Sync(CheckoutCommand):
@@ -7186,6 +7699,9 @@ class VeryClean(Command):
         $ rm -rf .muddle/tags/package
         $ rm -rf .muddle/tags/deployment
 
+    (and, if the tags are kept in a journal - see "muddle tagstore" - also
+    removing the package and deployment tags from the journal).
+
     It's a bit more complicated if there are any subdomains. If there is a
     'domains/' directory, then this command will recurse down into it and
     perform the same operation for each subdomain it finds. This does not
@@ -7239,6 +7755,17 @@ class VeryClean(Command):
                 for directory in ('package', 'deployment'):
                     delete_directory(os.path.join('.muddle', 'tags', directory))
 
+                if path in builder.db.domain_tags:
+                    tags = builder.db.domain_tags[path]
+                else:
+                    tags = DomainTags(path)
+                if tags.store() != TAG_STORE_FILES:
+                    if self.no_op():
+                        print 'Would forget package and deployment tags in %s'%tags.journal_file
+                    else:
+                        print 'Forgetting package and deployment tags in %s'%tags.journal_file
+                        tags.forget(('package', 'deployment'))
+
                 if os.path.exists('domains'):
                     subdomains = os.listdir('domains')
                     for name in subdomains:
@@ -7247,6 +7774,61 @@ class VeryClean(Command):
         # And our top level is, of course, the top domain
         tidy_domain(builder.db.root_path)
 
+@command('tagstore', CAT_MISC)
+class TagStore(Command):
+    """
+    :Syntax: muddle tagstore
+    :or:     muddle tagstore files|journal|compat
+
+    Report or change how muddle remembers which labels have been built
+    (that is, which tags are set).
+
+    With no argument, report how each domain in the build tree keeps its
+    tags. Otherwise, change every domain to keep its tags in the given way,
+    keeping all of the tags that are currently set:
+
+    * files - each tag is a file, .muddle/tags/<type>/<name>/<tag> (or
+      <role>-<tag> for packages). This is the default.
+
+    * journal - the tags are kept in .muddle/tags.journal. This is read once
+      by each muddle command, rather than muddle looking for a file for each
+      label it considers, which can be much faster for a large build tree
+      (especially on a networked filesystem). Tag files are no longer used,
+      and so touching or deleting them by hand will not work. Use "muddle
+      assert" and "muddle retract" instead.
+
+    * compat - tags are written to both the journal and as files. A label
+      counts as built if the journal says so, or if its tag file exists, so
+      touching a tag file by hand still works (but deleting one does not).
+
+    Each domain remembers this in its .muddle/TagStore file. A subdomain that
+    is added later will use the same method as the domain that includes it.
+    """
+
+    def requires_build_tree(self):
+        return True
+
+    def with_build_tree(self, builder, current_dir, args):
+        if not args:
+            for root in domain_roots(builder.db.root_path):
+                if root in builder.db.domain_tags:
+                    tags = builder.db.domain_tags[root]
+                else:
+                    tags = DomainTags(root)
+                print '%s: %s'%(root, tags.store())
+            return
+
+        if len(args) != 1 or args[0] not in TAG_STORES:
+            raise GiveUp("Syntax: muddle tagstore [%s]"%('|'.join(TAG_STORES)))
+
+        if self.no_op():
+            print 'Change tag store to %s for %s'%(args[0],
+                                                    builder.db.root_path)
+            return
+
+        builder.db.sync_tags()
+        builder.db.change_tag_store(args[0])
+
 @command('instruct', CAT_MISC)
 class Instruct(Command):
     """
@@ -7410,14 +7992,7 @@ class RunIn(Command):
                 dirs_done.add(dir)
                 if (os.path.exists(dir)):
                     # We want to run the command with our muddle environment
-                    # Start with a copy of the "normal" environment
-                    env = os.environ.copy()
-                    # Add the default environment variables for building this label
-                    local_store = env_store.Store()
-                    builder.set_default_variables(lbl, local_store)
-                    local_store.apply(env)
-                    # Add anything the rest of the system has put in.
-                    builder.setup_environment(lbl, env)
+                    env = builder.label_environment(lbl)
 
                     with Directory(dir):
                         subprocess.call(command, shell=True, env=env,
@@ -7742,4 +8317,125 @@ class Subst(Command):
             else:
                 raise GiveUp("%s\nWhilst processing %s"%(e, src))
 
+@command('server', CAT_MISC)
+class Server(Command):
+    """
+    :Syntax: muddle server
+
+    Keep the build tree loaded, and answer "muddle query" commands from
+    muddle Makefiles quickly.
+
+    Muddle Makefiles often use "$(MUDDLE) query ..." to find out where things
+    are. Each such command normally has to start muddle, and load the build
+    tree, all over again. Whilst "muddle server" is running, $(MUDDLE) is
+    instead set to a small client program, which asks the server to run
+    any "muddle query" commands (and runs muddle itself for anything else).
+
+    The server listens on the Unix domain socket .muddle/_server.sock, at the
+    top of the build tree. It keeps running until it is interrupted (with
+    Ctrl-C) or terminated (with "kill"), and removes its socket when it stops.
+
+    If the build description (or that of any subdomain) changes, for instance
+    because of "muddle pull", the server notices, and loads the build tree
+    again before answering the next query.
+    """
+
+    def requires_build_tree(self):
+        return True
+
+    def with_build_tree(self, builder, current_dir, args):
+        if args:
+            raise GiveUp("Syntax: muddle server")
+
+        if self.no_op():
+            print 'Serve queries for %s'%builder.db.root_path
+            return
+
+        QueryServer(builder, self.run_query).serve()
+
+    def run_query(self, builder, args, current_dir, env):
+        """
+        Run "muddle <args>" for the server, which must be a query command.
+        """
+        if not args or args[0] != 'query':
+            raise GiveUp('"muddle server" only runs "muddle query" commands')
+        if len(args) < 2:
+            raise GiveUp("Command 'query' needs a subcommand")
+        try:
+            command_class = g_subcommand_dict['query'][args[1]]
+        except KeyError:
+            raise GiveUp("There is no muddle command 'query %s'"%args[1])
+
+        command = command_class()
+        command.set_options({})
+        command.set_old_env(env)
+        if builder.is_release_build() and not command.allowed_in_release_build():
+            raise GiveUp("Command %s is not allowed in a release build"%command.cmd_name)
+        command.with_build_tree(builder, current_dir, args[2:])
+
+@subcommand('cache', 'prune', CAT_MISC)
+class CachePrune(Command):
+    """
+    :Syntax: muddle cache prune [-days <N>]
+
+    Remove the git mirrors in $MUDDLE_GIT_MIRRORS that have not been used
+    (to check out or pull a checkout, in any build tree) for <N> days. The
+    default is 30 days.
+
+    If $MUDDLE_GIT_MIRRORS is set, it names a directory in which muddle keeps
+    a bare mirror of each remote git repository it clones or pulls from.
+    Checkouts are cloned with "--reference <mirror> --dissociate", and fetch
+    from the mirror before fetching from their remote repository, so that
+    each remote repository is only downloaded once, however many build trees
+    there are. The directory may (and is meant to) be shared between build
+    trees, for instance per-user or per-host.
+
+    Removing a mirror does not affect any build tree, as the checkouts do
+    not depend on it. Mirrors that another muddle is using at the moment are
+    not removed.
+
+    With "muddle -n cache prune", just report what would be removed.
+
+    This command does not need to be run in a build tree.
+    """
+
+    def requires_build_tree(self):
+        return False
+
+    def with_build_tree(self, builder, current_dir, args):
+        self.prune(args)
+
+    def without_build_tree(self, muddle_binary, current_dir, args):
+        self.prune(args)
+
+    def prune(self, args):
+        days = DEFAULT_PRUNE_DAYS
+        while args:
+            word = args.pop(0)
+            if word == '-days':
+                if not args:
+                    raise GiveUp('-days must be followed by a number of days')
+                try:
+                    days = int(args.pop(0))
+                except ValueError:
+                    raise GiveUp('-days must be followed by a number of days')
+            else:
+                raise GiveUp("Unexpected argument '%s' for 'cache prune'"%word)
+
+        mirrors = git_mirrors()
+        if mirrors is None:
+            print 'There are no git mirrors, because $MUDDLE_GIT_MIRRORS is not set'
+            return
+
+        removed = mirrors.prune(days, dry_run=self.no_op())
+        if self.no_op():
+            verb = 'Would remove'
+        else:
+            verb = 'Removed'
+        for path, url in removed:
+            print '%s mirror %s\n    of %s'%(verb, path, url)
+        print '%s %d git mirror%s not used for %d days, from %s'%(verb,
+                len(removed), '' if len(removed) == 1 else 's', days,
+                mirrors.mirrors_dir)
+
 # End file.
@@ -4,8 +4,12 @@ held in root/.muddle
 """
 
 import errno
+import fcntl
+import json
 import os
 import re
+import shutil
+import time
 import xml.dom
 import xml.dom.minidom
 import traceback
@@ -18,6 +22,22 @@ from muddled.utils import domain_subpath, split_vcs_url
 from muddled.depend import normalise_checkout_label
 from muddled.repository import Repository
 
+# The ways we can keep the tags for a (sub)domain (see DomainTags)
+TAG_STORE_FILES = 'files'
+TAG_STORE_JOURNAL = 'journal'
+TAG_STORE_COMPAT = 'compat'
+TAG_STORES = (TAG_STORE_FILES, TAG_STORE_JOURNAL, TAG_STORE_COMPAT)
+
+# The names of the files, within a (sub)domain's .muddle directory, that say
+# which of those we are using, and that hold the tag journal
+TAG_STORE_FILE = 'TagStore'
+TAG_JOURNAL_FILE = 'tags.journal'
+
+# How many of the most recent builds of a label we use to estimate how long
+# it takes to build, and how many records of builds we keep altogether
+BUILD_ESTIMATE_COUNT = 5
+MAX_BUILD_HISTORY = 20000
+
 class CheckoutData(object):
     """
     * location - The directory the checkout is in, relative to the root of the
@@ -143,6 +163,10 @@ class Database(object):
       inside the Builder's "build_label()" mechanism, and is only intended
       for use within muddle itself.
 
+    * domain_tags - This maps the root directory of each (sub)domain to the
+      DomainTags instance that remembers which of its (non-transient) labels
+      are asserted. It is not intended for direct access.
+
     Also, a variety of dictionaries that take (mostly) checkout labels as keys.
     Note that:
 
@@ -268,6 +292,19 @@ class Database(object):
         # A set of "asserted" labels
         self.local_tags = set()
 
+        # And the (non-transient) asserted labels for each (sub)domain
+        self.domain_tags = {}
+
+        # The fingerprints of built package labels (see muddled.fingerprint)
+        self.fingerprints = FingerprintFile(os.path.join(self.root_path,
+                                                         '.muddle',
+                                                         '_fingerprints'))
+
+        # How long building labels has taken
+        self.build_history = BuildHistory(os.path.join(self.root_path,
+                                                       '.muddle',
+                                                       '_build_history'))
+
         # Upstream repositories
         self.upstream_repositories = {}
 
@@ -1076,6 +1113,12 @@ class Database(object):
         """
         return os.path.join(self.root_path, ".muddle", rel)
 
+    def query_server_socket_name(self):
+        """
+        The full path name of the socket that "muddle server" listens on.
+        """
+        return self.db_file_name("_server.sock")
+
     def set_instructions(self, label, instr_file):
         """
         Set the name of a file containing instructions for the deployment
@@ -1173,28 +1216,40 @@ class Database(object):
         return os.path.join(dir, leaf)
 
 
-    def tag_file_name(self, label):
+    def domain_root(self, domain):
         """
-        If this file exists, the given label is asserted.
+        Return the root directory of the given (sub)domain.
 
-        To make life a bit easier, we group labels.
+        The root directory is the one containing the domain's ``.muddle``
+        directory. For the top-level domain, 'domain' should be None.
         """
-
-        if label.domain:
-            root = os.path.join(self.root_path, domain_subpath(label.domain))
+        if domain:
+            return os.path.join(self.root_path, domain_subpath(domain))
         else:
-            root = self.root_path
+            return self.root_path
 
-        if (label.role is None):
-            leaf = label.tag
-        else:
-            leaf = "%s-%s"%(label.role, label.tag)
+    def tags_for_domain(self, domain):
+        """
+        Return the DomainTags instance for the given (sub)domain.
+        """
+        root = self.domain_root(domain)
+        try:
+            return self.domain_tags[root]
+        except KeyError:
+            tags = DomainTags(root)
+            self.domain_tags[root] = tags
+            return tags
+
+    def tag_file_name(self, label):
+        """
+        If this file exists, the given label is asserted.
 
-        return os.path.join(root,
-                            ".muddle",
-                            "tags",
-                            label.type,
-                            label.name, leaf)
+        To make life a bit easier, we group labels.
+
+        Note that if the label's domain keeps its tags in a journal (see
+        DomainTags), then this is the file that *would* be used.
+        """
+        return tag_file_name(self.domain_root(label.domain), label)
 
     def is_tag(self, label):
         """
@@ -1203,7 +1258,7 @@ class Database(object):
         if (label.transient):
             return (label in self.local_tags)
         else:
-            return (os.path.exists(self.tag_file_name(label)))
+            return self.tags_for_domain(label.domain).is_tag(label)
 
     def set_tag(self, label):
         """
@@ -1216,22 +1271,53 @@ class Database(object):
         if (label.transient):
             self.local_tags.add(label)
         else:
-            file_name = self.tag_file_name(label)
-            (dir,name) = os.path.split(file_name)
-            utils.ensure_dir(dir)
-            f = open(file_name, "w+")
-            f.write(utils.iso_time())
-            f.write("\n")
-            f.close()
+            self.tags_for_domain(label.domain).set_tag(label)
 
     def clear_tag(self, label):
         if (label.transient):
             self.local_tags.discard(label)
         else:
-            try:
-                os.remove(self.tag_file_name(label))
-            except:
-                pass
+            self.tags_for_domain(label.domain).clear_tag(label)
+
+    def tag_store(self):
+        """
+        Return how the top-level domain keeps its tags (see DomainTags).
+        """
+        return self.tags_for_domain(None).store()
+
+    def change_tag_store(self, new_store, verbose=True):
+        """
+        Change how every (sub)domain in the build tree keeps its tags.
+
+        'new_store' must be one of TAG_STORES (see DomainTags). Any labels
+        that are asserted stay asserted.
+
+        As with "muddle veryclean", this works on the subdomains that are
+        actually present in the build tree, whether or not the build
+        description mentions them.
+        """
+        for root in domain_roots(self.root_path):
+            tags = self.domain_tags.get(root)
+            if tags is None:
+                tags = DomainTags(root)
+            if verbose:
+                print 'Tags for %s: %s -> %s'%(root, tags.store(), new_store)
+            tags.change_store(new_store)
+
+    def sync_tags(self):
+        """
+        Write out any tags we have not yet written, and read any new ones.
+
+        Also writes out any new fingerprints for built labels.
+
+        Tags kept in a journal (see DomainTags) are only written out when
+        this is called, so call it before running anything that might want
+        to look at them (for instance, another muddle), and when muddle is
+        finished. It is also called by commit().
+        """
+        for tags in self.domain_tags.values():
+            tags.sync()
+        self.fingerprints.commit()
 
     def commit(self):
         """
@@ -1244,6 +1330,7 @@ class Database(object):
         self.Description_pathfile.commit()
         self.DescriptionBranch_pathfile.commit()
         self.VersionsRepository_pathfile.commit()
+        self.sync_tags()
 
 
 class PathFile(object):
@@ -1259,6 +1346,13 @@ class PathFile(object):
         self.value = None
         self.value_valid = False
 
+    def __getstate__(self):
+        # Don't remember our cached value, as the file may change
+        state = self.__dict__.copy()
+        state['value'] = None
+        state['value_valid'] = False
+        return state
+
     def get(self):
         """
         Retrieve the current value of the PathFile, or None if
@@ -1723,6 +1817,10 @@ class JustPulledFile(object):
         self.file_name = file_name
         self.labels = set()
 
+    def __getstate__(self):
+        # Our local memory only matters to the muddle that filled it in
+        return {'file_name' : self.file_name, 'labels' : set()}
+
     def get_from_disk(self):
         """Retrieve the contents of the _just_pulled file as a list of labels.
 
@@ -1787,6 +1885,623 @@ class JustPulledFile(object):
                 ##print 'XXX %s'%label
                 fd.write('%s\n'%label)
 
+class FingerprintFile(object):
+    """Our memory of the fingerprints of built labels.
+
+    See muddled.fingerprint for what a fingerprint is. The fingerprints are
+    kept in the .muddle/_fingerprints file, which has lines of the form::
+
+        <fingerprint> <label>
+
+    This is read when we are first asked for a fingerprint, and written out
+    (if we have changed any) when commit() is called.
+
+    Another muddle (for instance, one run by an action, or building in
+    parallel with us) may also have changed the file, so commit() reads it
+    again, with .muddle/_fingerprints.lock locked, and only replaces the
+    fingerprints that we have changed.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.fingerprints = None
+        self.changed = set()        # the labels whose fingerprints we set
+
+    def __getstate__(self):
+        # Our local memory only matters to the muddle that filled it in
+        return {'file_name' : self.file_name, 'fingerprints' : None,
+                'changed' : set()}
+
+    def _read_file(self):
+        """Return {label : fingerprint} from our file.
+        """
+        fingerprints = {}
+        try:
+            with open(self.file_name) as fd:
+                for line_no, line in enumerate(fd):
+                    words = line.split()
+                    if not words:
+                        continue
+                    try:
+                        if len(words) != 2:
+                            raise GiveUp('Expected "<fingerprint> <label>"')
+                        label = depend.Label.from_string(words[1])
+                    except GiveUp as e:
+                        raise GiveUp('Error reading line %d of %s:\n%s'%(line_no+1,
+                                     self.file_name, e))
+                    fingerprints[label] = words[0]
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return fingerprints
+
+    def _read(self):
+        if self.fingerprints is None:
+            self.fingerprints = self._read_file()
+        return self.fingerprints
+
+    def get(self, label):
+        """Return the fingerprint for 'label', or None if we don't have one.
+        """
+        return self._read().get(label)
+
+    def set(self, label, fingerprint):
+        """Remember the fingerprint for 'label'.
+        """
+        fingerprints = self._read()
+        if fingerprints.get(label) != fingerprint:
+            fingerprints[label] = fingerprint
+            self.changed.add(label)
+
+    def commit(self):
+        """Write our fingerprints out, if any have changed.
+        """
+        if not self.changed:
+            return
+        lock_fd = os.open('%s.lock'%self.file_name, os.O_CREAT|os.O_RDWR, 0666)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            fingerprints = self._read_file()
+            for label in self.changed:
+                fingerprints[label] = self.fingerprints[label]
+            temp_file = '%s.%d'%(self.file_name, os.getpid())
+            with open(temp_file, 'w') as fd:
+                for label in sorted(fingerprints):
+                    fd.write('%s %s\n'%(fingerprints[label], label))
+            os.rename(temp_file, self.file_name)
+        finally:
+            os.close(lock_fd)
+        self.fingerprints = fingerprints
+        self.changed = set()
+
+class BuildHistory(object):
+    """Our record of how long building labels has taken.
+
+    Each time an action builds a label, a line is appended to the
+    .muddle/_build_history file. Each line is a JSON object of the form::
+
+        {"label": "<label>", "start": <time>, "duration": <seconds>,
+         "action": "<class>", "status": <status>,
+         "cpu": <seconds>, "max_rss": <kilobytes>}
+
+    where <time> is in seconds since the epoch, <class> is the (module
+    qualified) class of the action, and <status> is 0 if the action succeeded,
+    otherwise the return code of the command that failed (or 1). "cpu" is the
+    user and system CPU time used by the processes the action ran, and
+    "max_rss" the largest resident set size of any of them, or null if we
+    cannot tell (see Builder._build_rule). Older records may only have the
+    first three values.
+
+    Since each record is a
+    single line, build jobs running at the same time can all add to the
+    history. When it gets too long, the oldest records are discarded.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._estimates = None
+
+    def __getstate__(self):
+        # Our estimates only matter to the muddle that worked them out
+        return {'file_name' : self.file_name, '_estimates' : None}
+
+    def record(self, label, start, duration, **details):
+        """Record that building 'label' took 'duration' seconds from 'start'.
+
+        Any other values (such as 'action' and 'status') are recorded as well.
+        """
+        record = {'label' : str(label), 'start' : start, 'duration' : duration}
+        record.update(details)
+        with open(self.file_name, 'a') as fd:
+            fd.write('%s\n'%json.dumps(record, sort_keys=True))
+
+    def records(self):
+        """Return our records, oldest first, as a list of dictionaries.
+
+        Lines that we cannot understand (perhaps because another muddle was
+        interrupted whilst writing them) are ignored.
+        """
+        records = []
+        try:
+            with open(self.file_name) as fd:
+                for line in fd:
+                    try:
+                        record = json.loads(line)
+                        record['label'] = str(record['label'])
+                    except (ValueError, KeyError):
+                        continue
+                    records.append(record)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        if len(records) > MAX_BUILD_HISTORY:
+            records = records[-MAX_BUILD_HISTORY//2:]
+            temp_file = '%s.%d'%(self.file_name, os.getpid())
+            with open(temp_file, 'w') as fd:
+                for record in records:
+                    fd.write('%s\n'%json.dumps(record, sort_keys=True))
+            os.rename(temp_file, self.file_name)
+        return records
+
+    def estimates(self):
+        """Return a dictionary of how long we expect labels to take to build.
+
+        Each label (as a string) maps to the average time, in seconds, that
+        its most recent successful builds took.
+        """
+        if self._estimates is not None:
+            return self._estimates
+        durations = {}
+        for record in self.records():
+            if record.get('status', 0) != 0:
+                continue
+            durations.setdefault(record['label'], []).append(record['duration'])
+        self._estimates = {}
+        for label, values in durations.items():
+            values = values[-BUILD_ESTIMATE_COUNT:]
+            self._estimates[label] = sum(values) / len(values)
+        return self._estimates
+
+    def estimate(self, label):
+        """Return how long we expect 'label' to take to build, or None.
+        """
+        return self.estimates().get(str(label))
+
+    def latest(self):
+        """Return a dictionary of the most recent record for each label.
+
+        Each label (as a string) maps to the record for the last time it was
+        built, whether that succeeded or not.
+        """
+        latest = {}
+        for record in self.records():
+            latest[record['label']] = record
+        return latest
+
+def domain_roots(root_path):
+    """Return the root directories of the domains in a build tree.
+
+    This is 'root_path' itself, followed by the roots of any subdomains
+    that are actually present (in 'domains/' directories), at any depth.
+    """
+    roots = [root_path]
+    domains_dir = os.path.join(root_path, 'domains')
+    if os.path.isdir(domains_dir):
+        for name in sorted(os.listdir(domains_dir)):
+            path = os.path.join(domains_dir, name)
+            if os.path.isdir(os.path.join(path, '.muddle')):
+                roots.extend(domain_roots(path))
+    return roots
+
+def tag_file_name(domain_root, label):
+    """Return the name of the tag file for 'label', in the given domain.
+
+    'domain_root' is the root directory of the label's domain.
+    """
+    if (label.role is None):
+        leaf = label.tag
+    else:
+        leaf = "%s-%s"%(label.role, label.tag)
+
+    return os.path.join(domain_root, ".muddle", "tags",
+                        label.type, label.name, leaf)
+
+def _tag_key(label):
+    """Return the key we use for 'label' in a DomainTags.
+
+    This does not include the domain (which is implied by the DomainTags),
+    or the label's flags (which do not matter for tags).
+    """
+    return (label.type, label.name, label.role, label.tag)
+
+def _tag_key_string(key):
+    type, name, role, tag = key
+    if role is None:
+        return '%s:%s/%s'%(type, name, tag)
+    else:
+        return '%s:%s{%s}/%s'%(type, name, role, tag)
+
+class DomainTags(object):
+    """The asserted (non-transient) labels for one (sub)domain.
+
+    How these are kept is determined by the domain's .muddle/TagStore file,
+    which may contain:
+
+    * "files" - each asserted label has a file, .muddle/tags/<type>/<name>/<leaf>
+      where <leaf> is <tag> or <role>-<tag>, containing the time it was
+      asserted. This is the default, if there is no TagStore file.
+
+      Rather than look for a label's file each time we are asked about it,
+      we list the whole of .muddle/tags when we are first asked, and
+      remember which files exist, and the modification time of each
+      .muddle/tags/<type>/<name> directory. Since anything run by an action
+      (another muddle, perhaps) might add or remove tag files, after sync()
+      we check the modification time of a directory the next time we are
+      asked about a label in it, and only list it again if that has changed.
+
+    * "journal" - the asserted labels are kept in the .muddle/tags.journal
+      file, which is only ever appended to, with lines of the form::
+
+          + 2012-03-04 12:34:56 package:busybox{x86}/built
+          - package:busybox{x86}/built
+
+      for a label being asserted (at the given time) and retracted. The
+      labels do not have a domain, since that is implied by the journal's
+      location. The journal is read (once) when we are first asked about
+      a tag, and new lines are only written when sync() is called, so a
+      muddle that does not build anything does not look at the filesystem
+      for each label, and does not write anything.
+
+    * "compat" - as "journal", but we also write (and delete) the tag files,
+      and if a label is not asserted in the journal, we look to see if its
+      tag file exists (for instance, because someone has used "touch" on it).
+
+    Use change_store() (or "muddle tagstore") to change from one to another.
+    """
+
+    def __init__(self, domain_root):
+        self.domain_root = domain_root
+        self.store_file = os.path.join(domain_root, '.muddle', TAG_STORE_FILE)
+        self.journal_file = os.path.join(domain_root, '.muddle', TAG_JOURNAL_FILE)
+        self._init_memory()
+
+    def _init_memory(self):
+        self._store = None      # the content of our TagStore file
+        self.tags = None        # {key : time asserted}, from the journal
+        self.offset = 0         # how much of the journal we have read
+        self.pending = []       # lines we have not yet written to it
+        self.files = None       # {(type, name, leaf)} for our tag files
+        self.dir_leaves = {}    # {(type, name) : set of leaf}, likewise
+        self.dir_mtimes = {}    # {(type, name) : (mtime, racy)} when listed
+        self.dirs_checked = None    # {(type, name)} checked since sync(),
+                                    # or None if we trust them all
+
+    def __getstate__(self):
+        # Our memory of the tags only matters to the muddle that filled it in
+        state = self.__dict__.copy()
+        state.update(_store=None, tags=None, offset=0, pending=[], files=None,
+                     dir_leaves={}, dir_mtimes={}, dirs_checked=None)
+        return state
+
+    def store(self):
+        """Return how we are keeping our tags - one of TAG_STORES.
+        """
+        if self._store is None:
+            value = PathFile(self.store_file).get_if_it_exists()
+            if value is None:
+                value = TAG_STORE_FILES
+            elif value not in TAG_STORES:
+                raise GiveUp('Unrecognised tag store "%s" in %s (expecting'
+                             ' one of %s)'%(value, self.store_file,
+                                            ', '.join(TAG_STORES)))
+            self._store = value
+        return self._store
+
+    def is_tag(self, label):
+        """Is this label asserted?
+        """
+        store = self.store()
+        if store == TAG_STORE_FILES:
+            return self._tag_file_exists(label)
+        if _tag_key(label) in self._journal_tags():
+            return True
+        return (store == TAG_STORE_COMPAT and self._tag_file_exists(label))
+
+    def _tag_file_exists(self, label):
+        file_name = tag_file_name(self.domain_root, label)
+        key = (label.type, label.name, os.path.basename(file_name))
+        files = self._tag_file_keys()
+        self._check_tag_dir(label.type, label.name)
+        return key in files
+
+    def _tag_file_keys(self):
+        """Return the set of (type, name, leaf) for our tag files.
+
+        The first time we're called, we list the .muddle/tags directory
+        to find them. We list each directory just once, and don't need to
+        look at each file.
+        """
+        if self.files is None:
+            self.files = set()
+            tags_dir = os.path.join(self.domain_root, '.muddle', 'tags')
+            for type in _listdir(tags_dir):
+                for name in _listdir(os.path.join(tags_dir, type)):
+                    self._list_tag_dir(type, name)
+        return self.files
+
+    def _check_tag_dir(self, type, name):
+        """List .muddle/tags/<type>/<name> again if it may have changed.
+
+        That is, if it has changed since we listed it, and we haven't
+        already checked it since the last sync().
+        """
+        if self.dirs_checked is None or (type, name) in self.dirs_checked:
+            return
+        self.dirs_checked.add((type, name))
+        mtime = _mtime(os.path.join(self.domain_root, '.muddle', 'tags',
+                                    type, name))
+        listed = self.dir_mtimes.get((type, name), (None, False))
+        if mtime != listed[0] or listed[1]:
+            self._list_tag_dir(type, name)
+
+    def _list_tag_dir(self, type, name):
+        """(Re)list .muddle/tags/<type>/<name>, and remember when it changed.
+
+        If it changed within a second of us listing it, it might change
+        again without its modification time doing so (on a filesystem that
+        only keeps whole seconds), so we call it "racy", and will list it
+        again whenever we check it.
+        """
+        dir_path = os.path.join(self.domain_root, '.muddle', 'tags', type, name)
+        now = time.time()
+        mtime = _mtime(dir_path)
+        for leaf in self.dir_leaves.pop((type, name), ()):
+            self.files.discard((type, name, leaf))
+        leaves = set(_listdir(dir_path))
+        for leaf in leaves:
+            self.files.add((type, name, leaf))
+        self.dir_leaves[(type, name)] = leaves
+        racy = mtime is not None and mtime >= now - 1.0
+        self.dir_mtimes[(type, name)] = (mtime, racy)
+
+    def set_tag(self, label):
+        """Assert this label.
+        """
+        store = self.store()
+        when = utils.iso_time()
+        if store != TAG_STORE_JOURNAL:
+            file_name = tag_file_name(self.domain_root, label)
+            _write_tag_file(file_name, when)
+            if self.files is not None:
+                leaf = os.path.basename(file_name)
+                self.files.add((label.type, label.name, leaf))
+                self.dir_leaves.setdefault((label.type, label.name),
+                                           set()).add(leaf)
+        if store != TAG_STORE_FILES:
+            key = _tag_key(label)
+            self._journal_tags()[key] = when
+            self.pending.append('+ %s %s\n'%(when, _tag_key_string(key)))
+
+    def clear_tag(self, label):
+        """Retract this label.
+        """
+        store = self.store()
+        if store != TAG_STORE_JOURNAL:
+            file_name = tag_file_name(self.domain_root, label)
+            try:
+                os.remove(file_name)
+            except:
+                pass
+            if self.files is not None:
+                leaf = os.path.basename(file_name)
+                self.files.discard((label.type, label.name, leaf))
+                self.dir_leaves.get((label.type, label.name), set()).discard(leaf)
+        if store != TAG_STORE_FILES:
+            key = _tag_key(label)
+            self._journal_tags().pop(key, None)
+            self.pending.append('- %s\n'%_tag_key_string(key))
+
+    def _journal_tags(self):
+        if self.tags is None:
+            self.tags = {}
+            self._read_journal()
+        return self.tags
+
+    def _read_journal(self):
+        """Read any lines in the journal that we have not yet read.
+        """
+        try:
+            fd = open(self.journal_file)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        with fd:
+            if os.fstat(fd.fileno()).st_size < self.offset:
+                # Someone has rewritten the journal, so start again
+                self.tags.clear()
+                self.offset = 0
+            fd.seek(self.offset)
+            data = fd.read()
+        # Don't read a line that someone else is still writing
+        data = data[:data.rfind('\n')+1]
+        self.offset += len(data)
+        for line in data.splitlines():
+            words = line.split()
+            if not words:
+                continue
+            try:
+                if words[0] not in ('+', '-'):
+                    raise GiveUp('Line does not start with "+" or "-"')
+                label = depend.Label.from_string(words[-1])
+            except GiveUp as e:
+                raise GiveUp('Error reading line "%s" in %s:\n%s'%(line,
+                             self.journal_file, e))
+            if words[0] == '+':
+                self.tags[_tag_key(label)] = ' '.join(words[1:-1])
+            else:
+                self.tags.pop(_tag_key(label), None)
+
+    def sync(self):
+        """Write any lines we have not yet written to the journal.
+
+        Then read any lines that have been added to it by someone else
+        (i.e., by another muddle). Also, since someone else may have added
+        or removed tag files, check each tag directory again (see
+        _check_tag_dir()) when we are next asked about a label in it.
+        """
+        self.dirs_checked = set()
+        if self.pending:
+            utils.ensure_dir(os.path.dirname(self.journal_file))
+            with open(self.journal_file, 'a') as fd:
+                fd.write(''.join(self.pending))
+            self.pending = []
+        if self.tags is not None:
+            self._read_journal()
+
+    def _tag_files(self):
+        """Return {key : time asserted} for all our tag files.
+        """
+        result = {}
+        tags_dir = os.path.join(self.domain_root, '.muddle', 'tags')
+        for dirpath, dirnames, filenames in os.walk(tags_dir):
+            rel = os.path.relpath(dirpath, tags_dir)
+            parts = rel.split(os.sep)
+            if len(parts) != 2:
+                continue
+            type, name = parts
+            for leaf in filenames:
+                # Only package labels normally have roles (and roles are
+                # more likely than tags to contain a "-")
+                if type == utils.LabelType.Package and '-' in leaf:
+                    role, tag = leaf.rsplit('-', 1)
+                else:
+                    role, tag = None, leaf
+                with open(os.path.join(dirpath, leaf)) as fd:
+                    when = fd.readline().strip()
+                result[(type, name, role, tag)] = when
+        return result
+
+    def all_tags(self):
+        """Return {key : time asserted} for all our asserted labels.
+
+        Each key is a tuple (type, name, role, tag).
+        """
+        self.sync()
+        store = self.store()
+        if store == TAG_STORE_FILES:
+            return self._tag_files()
+        result = dict(self._journal_tags())
+        if store == TAG_STORE_COMPAT:
+            for key, when in self._tag_files().items():
+                result.setdefault(key, when)
+        return result
+
+    def _rewrite_journal(self, tags):
+        """Replace our journal with one that asserts just 'tags'.
+        """
+        self.sync()
+        temp_file = '%s.%d'%(self.journal_file, os.getpid())
+        utils.ensure_dir(os.path.dirname(self.journal_file))
+        with open(temp_file, 'w') as fd:
+            for key in sorted(tags):
+                fd.write('+ %s %s\n'%(tags[key], _tag_key_string(key)))
+        os.rename(temp_file, self.journal_file)
+        self.tags = dict(tags)
+        self.offset = os.path.getsize(self.journal_file)
+
+    def change_store(self, new_store):
+        """Change how we keep our tags, keeping all the labels asserted.
+
+        'new_store' must be one of TAG_STORES.
+
+        Moving to "files" writes the tag files and removes the journal,
+        moving to "journal" writes the journal and removes the tag files,
+        and moving to "compat" makes sure that both have all the labels
+        that are asserted in either.
+        """
+        if new_store not in TAG_STORES:
+            raise GiveUp('Unrecognised tag store "%s" (expecting one of'
+                         ' %s)'%(new_store, ', '.join(TAG_STORES)))
+        tags = self.all_tags()
+        tags_dir = os.path.join(self.domain_root, '.muddle', 'tags')
+        if new_store == TAG_STORE_JOURNAL:
+            self._rewrite_journal(tags)
+            if os.path.exists(tags_dir):
+                shutil.rmtree(tags_dir)
+        else:
+            for (type, name, role, tag), when in tags.items():
+                label = depend.Label(type, name, role, tag)
+                _write_tag_file(tag_file_name(self.domain_root, label), when)
+            if new_store == TAG_STORE_FILES:
+                if os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+            else:
+                self._rewrite_journal(tags)
+
+        if new_store == TAG_STORE_FILES:
+            if os.path.exists(self.store_file):
+                os.remove(self.store_file)
+        else:
+            with open(self.store_file, 'w') as fd:
+                fd.write('%s\n'%new_store)
+        self._init_memory()
+
+    def copy_tag_files(self, target_root, type, name, wanted=None):
+        """Write tag files for our asserted labels with this type and name.
+
+        The tag files are written into the domain whose root directory is
+        'target_root', whether or not we are using tag files ourselves.
+
+        If 'wanted' is given, it is a list of the tag file leaf names
+        (<tag> or <role>-<tag>) to write - any others are ignored.
+        """
+        for key, when in self.all_tags().items():
+            if key[:2] != (type, name):
+                continue
+            label = depend.Label(*key)
+            file_name = tag_file_name(target_root, label)
+            if wanted is None or os.path.basename(file_name) in wanted:
+                _write_tag_file(file_name, when)
+
+    def forget(self, types):
+        """Retract all of our labels whose type is in 'types'.
+
+        Only affects the journal (if any) - it is up to the caller to delete
+        the .muddle/tags/<type> directories (as "muddle veryclean" does).
+        """
+        if self.store() == TAG_STORE_FILES:
+            return
+        tags = {}
+        for key, when in self._journal_tags().items():
+            if key[0] not in types:
+                tags[key] = when
+        self._rewrite_journal(tags)
+
+def _listdir(path):
+    """Return the names in directory 'path', or [] if we can't list it.
+    """
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def _mtime(path):
+    """Return the modification time of 'path', or None if it doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _write_tag_file(file_name, when):
+    (dir,name) = os.path.split(file_name)
+    utils.ensure_dir(dir)
+    f = open(file_name, "w+")
+    f.write(when)
+    f.write("\n")
+    f.close()
+
 # End file
 
 
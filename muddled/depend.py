@@ -3,10 +3,12 @@ Dependency sets and dependency management
 """
 
 import re
-import copy
+import collections
+
+import muddled.trace as trace
 
 from muddled.utils import GiveUp, MuddleBug, label_type_to_tag, LabelType, \
-        sort_domains, total_ordering
+        split_domain, total_ordering
 
 @total_ordering
 class Label(object):
@@ -81,8 +83,27 @@ class Label(object):
               domain name does not contribute to a label's hash value. Thus
               a label that whose domain name is changed will continue to
               work as the same key in a dictionary (for instance).
+
+    Since a build can have tens of thousands of labels, they are kept small
+    (using __slots__), and remember their hash value and sort key rather than
+    working them out each time. Definite labels made by the copy_with_xxx()
+    methods (or by intern()) are shared, so that asking for the same label
+    twice gives the same object.
     """
 
+    __slots__ = ('_type', '_domain', '_name', '_role', '_tag',
+                 'transient', 'system', '_unswept', '_hash', '_sort_key')
+
+    # The shared (interned) definite labels, keyed by their parts and flags.
+    # See NewLabelTable for when we start a new table.
+    _interned = {}
+
+    # The parts of the labels we have parsed, keyed by the string (and any
+    # defaults) they were parsed from. See from_string and from_fragment.
+    _parsed = {}
+    # and how many we remember before starting again
+    MAX_PARSED = 10000
+
     # Let's make a record of what conventional flag characters are
     FLAG_SYSTEM       = 'S'
     FLAG_TRANSIENT    = 'T'
@@ -234,6 +255,12 @@ class Label(object):
         if domain is not None:
             Label.split_domain(domain)
 
+        self._set_parts(type, domain, name, role, tag, transient, system)
+
+    def _set_parts(self, type, domain, name, role, tag, transient, system):
+        """
+        Set up our parts, which the caller has already checked.
+        """
         self._type = type
         self._domain = domain
         self._name = name
@@ -246,6 +273,73 @@ class Label(object):
         # The "unswept" flag is regarded as internal
         self._unswept = False
 
+        # The domain does not contribute to the hash (see the class docstring)
+        self._hash = hash((type, name, role, tag))
+        # Our sort key is worked out when it is first needed
+        self._sort_key = None
+
+    @staticmethod
+    def _new(type, domain, name, role, tag, transient, system):
+        """
+        Return a new Label, made from parts that have already been checked.
+        """
+        label = Label.__new__(Label)
+        label._set_parts(type, domain, name, role, tag, transient, system)
+        return label
+
+    @staticmethod
+    def _shared(type, domain, name, role, tag, transient, system):
+        """
+        Return a Label with the given (checked) parts, shared if it is definite.
+        """
+        if '*' in (type, domain, name, role, tag):
+            return Label._new(type, domain, name, role, tag, transient, system)
+        key = (type, domain, name, role, tag, bool(transient), bool(system))
+        try:
+            return Label._interned[key]
+        except KeyError:
+            label = Label._new(type, domain, name, role, tag, transient, system)
+            Label._interned[key] = label
+            return label
+
+    def intern(self):
+        """
+        Return the shared instance of this label.
+
+        If this label is definite, then the same object is returned for every
+        label with the same parts and flags. Wildcarded labels are not shared,
+        so we just return ourselves.
+
+        For instance:
+
+            >>> a = Label('package', 'busybox', 'rootfs', 'built')
+            >>> b = Label('package', 'busybox', 'rootfs', 'built')
+            >>> a is b
+            False
+            >>> a.intern() is b.intern()
+            True
+            >>> a.copy_with_tag('installed') is b.copy_with_tag('installed')
+            True
+            >>> c = Label('package', 'busybox', 'rootfs', 'built', system=True)
+            >>> c.intern() is a.intern()
+            False
+
+        Remember that shared labels *are* shared - do not change them!
+        """
+        if self.is_wildcard():
+            return self
+        key = (self._type, self._domain, self._name, self._role, self._tag,
+               bool(self.transient), bool(self.system))
+        return Label._interned.setdefault(key, self)
+
+    def __getstate__(self):
+        return (self._type, self._domain, self._name, self._role, self._tag,
+                self.transient, self.system, self._unswept)
+
+    def __setstate__(self, state):
+        self._set_parts(*state[:-1])
+        self._unswept = state[-1]
+
     @property
     def type(self):
         return self._type
@@ -273,47 +367,35 @@ class Label(object):
         All the non-wildcard parts of 'target' are copied, to overwrite
         the equivalent parts of the new label.
         """
-        new = self.copy()
-
         #print "unify src = %s"%self
-        if (target._type != "*"):
-            new._type = target._type
-
-        if (target._domain != "*"):
-            new._domain = target._domain
-
-        if (target._name != "*"):
-            new._name = target._name
-
-        if (target._role != "*"):
-            new._role = target._role
-
-        if (target._tag != "*"):
-            new._tag = target._tag
+        def unified(ours, theirs):
+            if theirs == "*":
+                return ours
+            else:
+                return theirs
 
-        new.system = target.system
-        new.transient = target.transient
-        return new
+        return Label._shared(unified(self._type, target._type),
+                             unified(self._domain, target._domain),
+                             unified(self._name, target._name),
+                             unified(self._role, target._role),
+                             unified(self._tag, target._tag),
+                             target.transient, target.system)
 
     def copy_with_tag(self, new_tag, system = None, transient = None):
         """
         Return a copy of self, with the tag changed to new_tag.
         """
         Label._check_part('tag', new_tag)
-        cp = self.copy()
-        cp._tag = new_tag
-        cp.system = system
-        cp.transient = transient
-        return cp
+        return Label._shared(self._type, self._domain, self._name, self._role,
+                             new_tag, transient, system)
 
     def copy_with_role(self, new_role):
         """
         Return a copy of self, with the role changed to new_role.
         """
         Label._check_part('role', new_role)
-        cp = self.copy()
-        cp._role = new_role
-        return cp
+        return Label._shared(self._type, self._domain, self._name, new_role,
+                             self._tag, self.transient, self.system)
 
     def copy_with_domain(self, new_domain):
         """
@@ -327,9 +409,8 @@ class Label(object):
         if new_domain is not None:
             # Check it looks like a valid domain name
             Label.split_domain(new_domain)
-        cp = self.copy()
-        cp._domain = new_domain
-        return cp
+        return Label._shared(self._type, new_domain, self._name, self._role,
+                             self._tag, self.transient, self.system)
 
     def is_definite(self):
         """
@@ -489,8 +570,11 @@ class Label(object):
     def copy(self):
         """
         Return a copy of this label.
+
+        The copy is a new object, which is not shared.
         """
-        return copy.copy(self)
+        return Label._new(self._type, self._domain, self._name, self._role,
+                          self._tag, self.transient, self.system)
 
     def __repr__(self):
         parts = [repr(self._type),
@@ -566,7 +650,11 @@ class Label(object):
 
         *Does* take the domains (if any) into account.
         """
-        if self._type != other._type:
+        if self is other:
+            return True
+        elif self._hash != other._hash:
+            return False
+        elif self._type != other._type:
             return False
         elif self._domain != other._domain:
             return False
@@ -590,37 +678,36 @@ class Label(object):
 
         *Does* take the domains (if any) into account.
         """
-        if self._type != other._type:
-            return self._type < other._type
+        return self.sort_key() < other.sort_key()
 
-        # Domain names are a little tricky to sort. Happily we already
-        # solved that problem...
-        if self._domain != other._domain:
-            dsorted = sort_domains([self._domain, other._domain])
-            if self.domain is None:
-                return dsorted[0] == ''
-            else:
-                return dsorted[0] == self.domain
+    def sort_key(self):
+        """
+        Return a key that sorts labels in the same order as '<' does.
 
-        # And the rest is simple...
-        if self._name != other._name:
-            return self._name < other._name
-        elif self._role != other._role:
-            return self._role < other._role
-        elif self._tag != other._tag:
-            return self._tag < other._tag
-        else:
-            return False
+        Domain names are a little tricky to sort, so we use the same trick
+        as utils.sort_domains. For instance:
+
+            >>> Label.from_string('package:(a(b))fred/*').sort_key()
+            ('package', 'a~b', 'fred', None, '*')
+
+        The key is only worked out once (or once after the domain is changed).
+        """
+        key = self._sort_key
+        if key is None:
+            key = self._sort_key = (self._type,
+                                    '~'.join(split_domain(self._domain)),
+                                    self._name, self._role, self._tag)
+        return key
 
     def __hash__(self):
         """
-        Calculate the hash for a label.
+        Return the hash for a label.
 
         Ignores the domain name (since that may be changed) and the
         transient and system flags (since they are defined to be, well,
         transient).
         """
-        return hash( (self._type, self._name, self._role, self._tag) )
+        return self._hash
 
     def _mark_unswept(self):
         """
@@ -634,7 +721,7 @@ class Label(object):
 
         And it works like:
 
-            >>> l = Label.from_string('a:b{c}/d')
+            >>> l = Label('a', 'b', 'c', 'd')
             >>> l._mark_unswept()
             >>> print l
             a:b{c}/d[D]
@@ -663,9 +750,12 @@ class Label(object):
         name of a lot of labels, so we're assuming it's best done once by them.
         So there.
 
-        And it should work like:
+        The label is changed in place. Since shared labels (see intern())
+        may be in use elsewhere, this must only be done when the whole table
+        of shared labels belongs to the subdomain (see NewLabelTable). It
+        should work like:
 
-            >>> l = Label.from_string('a:b{c}/d')
+            >>> l = Label('a', 'b', 'c', 'd')
             >>> print l
             a:b{c}/d
             >>> l._change_domain('e')   # label not marked unswept
@@ -692,6 +782,7 @@ class Label(object):
                 self._domain = '%s(%s)'%(domain, self._domain)
             else:
                 self._domain = domain
+            self._sort_key = None
             self._unswept = False
             if verbose: print str(self)
 
@@ -802,7 +893,9 @@ class Label(object):
         System. Any other flag characters will be ignored.
 
         If the label string is valid, a corresponding Label will be returned,
-        otherwise a utils.GiveUp exception will be raised.
+        otherwise a utils.GiveUp exception will be raised. Definite labels
+        are shared (see intern()), and we remember what we have parsed, so
+        parsing the same string again is quick.
 
             >>> Label.from_string('package:busybox/installed')
             Label('package', 'busybox', role=None, tag='installed')
@@ -836,6 +929,12 @@ class Label(object):
             GiveUp: Label string 'package:()busybox/*' is not a valid Label
 
         """
+        key = (label_string,)
+        try:
+            return Label._shared(*Label._parsed[key])
+        except KeyError:
+            pass
+
         m = Label.label_string_re.match(label_string)
         if m is None or m.end() != len(label_string):
             raise GiveUp('Label string %s is not a valid'
@@ -855,8 +954,9 @@ class Label(object):
             transient = Label.FLAG_TRANSIENT in flags
             system    = Label.FLAG_SYSTEM in flags
 
-        return Label(type, name, role=role, tag=tag, transient=transient,
-                     system=system, domain=domain)
+        label = Label(type, name, role=role, tag=tag, transient=transient,
+                      system=system, domain=domain)
+        return Label._remember_parsed(key, label)
 
     @staticmethod
     def from_fragment(fragment, default_type, default_role=None, default_domain=None):
@@ -875,7 +975,16 @@ class Label(object):
               <type> is chosen (checked_out, postinstalled or deployed)
 
         Any of the default_xx values may be None.
+
+        As with from_string, definite labels are shared, and we remember what
+        we have parsed.
         """
+        key = (fragment, default_type, default_role, default_domain)
+        try:
+            return Label._shared(*Label._parsed[key])
+        except KeyError:
+            pass
+
         m = Label.fragment_re.match(fragment)
         if m is None or m.end() != len(fragment):
             raise GiveUp("Label fragment '%s' is not allowed"%fragment)
@@ -901,7 +1010,23 @@ class Label(object):
         if domain is None:
             domain = default_domain     # which may be None as well
 
-        return Label(type, name, role, tag, domain=domain)
+        label = Label(type, name, role, tag, domain=domain)
+        return Label._remember_parsed(key, label)
+
+    @staticmethod
+    def _remember_parsed(key, label):
+        """
+        Remember the parts of a newly parsed label, and return it shared.
+
+        The next time we are asked to parse the same thing, we can just look
+        up the answer. We only remember so many answers before starting again.
+        """
+        if len(Label._parsed) >= Label.MAX_PARSED:
+            Label._parsed.clear()
+        Label._parsed[key] = (label._type, label._domain, label._name,
+                              label._role, label._tag, label.transient,
+                              label.system)
+        return label.intern()
 
     def split_domains(self):
         """
@@ -937,6 +1062,30 @@ class Label(object):
                 dom = dom[pos+1:-1]
         return rv
 
+class NewLabelTable(object):
+    """
+    Use a new table of shared (interned) labels, in a "with" statement.
+
+    When a subdomain is included, all of its labels have their domain changed
+    (see Label._change_domain). We must not share those labels with the
+    including build, so the subdomain is loaded using its own table::
+
+        with NewLabelTable():
+            ... load the subdomain and change the domain of its labels ...
+
+    Afterwards, the previous table is used again.
+    """
+
+    def __enter__(self):
+        self.previous = Label._interned
+        Label._interned = {}
+        return self
+
+    def __exit__(self, etype, value, tb):
+        Label._interned = self.previous
+        # Don't suppress any exception
+        return False
+
 def label_from_string(str):
     """Do not use this!!! Can you say "deprecated"?
 
@@ -952,8 +1101,21 @@ def label_from_string(str):
 class Action(object):
     """
     Represents an object you can call to "build" a tag.
+
+    The environment for building a label is available as a dictionary, from
+    builder.label_environment(label), and should be passed on to any commands
+    that are run (for instance, as the 'env' argument to utils.run0()).
+
+    An Action class whose build_label() method does this should set
+    'uses_label_environment' to True in its own class definition. Otherwise,
+    for the sake of older build descriptions, os.environ is set to the
+    label's environment whilst build_label() is called. Note that a subclass
+    that overrides build_label() must set 'uses_label_environment' again, as
+    it is not inherited.
     """
 
+    uses_label_environment = False
+
     def build_label(self, builder, label):
         """
         Build the given label. Your dependencies have been satisfied.
@@ -979,6 +1141,19 @@ class Action(object):
     #    which might not otherwise be moved to the new domain.
 
 
+def uses_label_environment(action):
+    """
+    Does the build_label() method of 'action' use builder.label_environment()?
+
+    We look at the class that actually provides build_label(), so that a
+    subclass that overrides it is not assumed to know about label environments
+    just because its parent class did.
+    """
+    for cls in type(action).__mro__:
+        if 'build_label' in cls.__dict__:
+            return cls.__dict__.get('uses_label_environment', False)
+    return False
+
 class SequentialAction(object):
     """
     Invoke two actions in turn
@@ -1032,6 +1207,8 @@ class Rule(object):
           `target_dep`.
         """
         self.deps = set()
+        # The RuleSets we belong to, which need telling about new dependencies
+        self._rulesets = []
         if (not isinstance(target_dep, Label)):
             raise MuddleBug("Attempt to create a rule without a label"
                             " as its target")
@@ -1042,6 +1219,16 @@ class Rule(object):
             raise MuddleBug("Attempt to create a rule with an object rule "
                             "which isn't an action but a %s."%(action.__class__.__name__))
 
+    def __getstate__(self):
+        # Our RuleSets remember us again when they are unpickled
+        state = self.__dict__.copy()
+        del state['_rulesets']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rulesets = []
+
     def replace_target(self, new_t):
         self.target = new_t
 
@@ -1092,6 +1279,8 @@ class Rule(object):
         Add a dependency on the given Label.
         """
         self.deps.add(label)
+        for ruleset in self._rulesets:
+            ruleset._index_dependency(label, self)
 
     def merge(self, deps):
         """
@@ -1225,7 +1414,10 @@ class RuleSet(object):
 
     Informally, we cache some of the label look-ups for a major
     improvement in build time; the half billion lookups were taking
-    over a hundred seconds to do!
+    over a hundred seconds to do! We also keep an index of our target
+    labels (by type, name, role and tag), so that a wildcarded look-up
+    only needs to compare against those targets that might match. Adding
+    a new target only forgets those cached look-ups that it would match.
 
     CAVEAT: Be aware that new rules (when added) can be merged into existing
     rules.  Since we don't *copy* rules when we add them, this could be a cause
@@ -1235,6 +1427,142 @@ class RuleSet(object):
     def __init__(self):
         self.map = { }
         self.cache = { }
+        # An index of our target labels, by type, name, role and tag, in
+        # that order. A wildcard in a target label is indexed under '*',
+        # just like any other value. We do not index on domain, since that
+        # can change "underneath us" (see Label._change_domain).
+        self.index = { }
+        # The reverse edges of our rules - a map from each dependency label
+        # to the set of Rules that have it as a dependency, and an index of
+        # those dependency labels (which may also be wildcarded), organised
+        # in the same way as our target index.
+        self.dependents = { }
+        self.dep_index = { }
+        # Memoised results for needed_to_build() - the rules and immediate
+        # dependencies of each label we have been asked to plan, and the
+        # (ordered) transitive closure of each label we have planned. Each
+        # closure is held as (plan, start, end), meaning plan[start:end], so
+        # that the labels planned on the way to another can share its list.
+        # These are forgotten whenever a target or dependency is added.
+        self.plan_edges = { }
+        self.plans = { }
+        # How many labels (and shared views) we're remembering in plans
+        self.plans_size = 0
+
+    # The most labels we'll remember in plans before starting afresh
+    # (since a plan may be as big as the whole rule set)
+    MAX_PLANS_SIZE = 1000000
+
+    def __getstate__(self):
+        # Our indices, cached look-ups and plans are all worked out from
+        # our map, so there is no point in pickling them
+        return {'map' : self.map}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.map = state['map']
+        self._reindex()
+
+    def _forget_plans(self):
+        if self.plans or self.plan_edges:
+            self.plan_edges = { }
+            self.plans = { }
+            self.plans_size = 0
+
+    @staticmethod
+    def _index_label(index, label):
+        """
+        Add 'label' to the type/name/role/tag 'index'.
+        """
+        names = index.setdefault(label._type, {})
+        roles = names.setdefault(label._name, {})
+        tags = roles.setdefault(label._role, {})
+        tags.setdefault(label._tag, set()).add(label)
+
+    def _index_target(self, target, rule):
+        """
+        Remember the (new) target 'target' and its Rule.
+
+        This adds 'target' to our index, and forgets any cached look-ups
+        that it would have matched (and only those). It also remembers the
+        Rule's dependencies.
+        """
+        self.map[target] = rule
+        self._index_label(self.index, target)
+        self._forget_plans()
+
+        if self.cache:
+            for key in [k for k in self.cache if k.just_match(target)]:
+                del self.cache[key]
+
+        if self not in rule._rulesets:
+            rule._rulesets.append(self)
+        for dep in rule.deps:
+            self._index_dependency(dep, rule)
+
+    def _index_dependency(self, dep, rule):
+        """
+        Remember that Rule 'rule' depends upon label 'dep'.
+        """
+        self._forget_plans()
+        rules = self.dependents.get(dep)
+        if rules is None:
+            self.dependents[dep] = set([rule])
+            self._index_label(self.dep_index, dep)
+        else:
+            rules.add(rule)
+
+    def _reindex(self):
+        """
+        Rebuild our indices (and empty our cache) from scratch.
+        """
+        self.index = { }
+        self.cache = { }
+        self.dependents = { }
+        self.dep_index = { }
+        self._forget_plans()
+        for target, rule in self.map.items():
+            self._index_target(target, rule)
+
+    @staticmethod
+    def _buckets(level, value):
+        """
+        Return the index buckets at 'level' that might match 'value'.
+
+        If 'value' is a wildcard, that is all of them, otherwise it is the
+        bucket for 'value' itself, and the bucket for wildcarded targets.
+        """
+        if value == '*':
+            return level.values()
+        buckets = []
+        bucket = level.get(value)
+        if bucket is not None:
+            buckets.append(bucket)
+        bucket = level.get('*')
+        if bucket is not None:
+            buckets.append(bucket)
+        return buckets
+
+    def _candidates(self, index, label):
+        """
+        Yield the labels in 'index' that might match 'label'.
+
+        Every label that 'label.just_match()' would accept is yielded,
+        but the domain is not checked.
+        """
+        for names in self._buckets(index, label._type):
+            for roles in self._buckets(names, label._name):
+                for tags in self._buckets(roles, label._role):
+                    for labels in self._buckets(tags, label._tag):
+                        for l in labels:
+                            yield l
+
+    def _matching_targets(self, label):
+        """
+        Return a list of the target labels that match 'label' (which may
+        contain wildcards).
+        """
+        return [k for k in self._candidates(self.index, label) if label.just_match(k)]
 
     def add(self, rule):
         """
@@ -1245,13 +1573,10 @@ class RuleSet(object):
 
         If this rule is for a new target, just remember it.
         """
-        # Invalidate our look-up cache
-        self.cache = { }
-
         # Do we have the same target?
         inst = self.map.get(rule.target, None)
         if (inst is None):
-            self.map[rule.target] = rule
+            self._index_target(rule.target, rule)
         else:
             inst.merge(rule)
 
@@ -1272,10 +1597,8 @@ class RuleSet(object):
         if (useMatch):
             cached = self.cache.get(label, None)
             if (cached is None):
-                for (k,v) in self.map.items():
-                    #if (label.match(k) is not None):
-                    if label.just_match(k):
-                        rules.add(v)
+                for k in self._matching_targets(label):
+                    rules.add(self.map[k])
                 self.cache[label] = rules
             else:
                 rules = cached
@@ -1284,9 +1607,11 @@ class RuleSet(object):
             if (rule is not None):
                 rules.add(rule)
         else:
-            for (k,v) in self.map.items():
-                if (k.match_without_tag(label)):
-                    rules.add(v)
+            tags = self.index.get(label._type, {}).get(label._name, {}).get(label._role, {})
+            for targets in tags.values():
+                for k in targets:
+                    if (k.match_without_tag(label)):
+                        rules.add(self.map[k])
 
 
         return rules
@@ -1309,10 +1634,8 @@ class RuleSet(object):
         result_set = set()
 
         if (useMatch):
-            for k in self.map.keys():
-                if (k.match(target) is not None):
-                    result_set.add(k)
-        elif target in self.map.keys():
+            result_set.update(self._matching_targets(target))
+        elif target in self.map:
             result_set.add(target)
 
         return result_set
@@ -1331,12 +1654,117 @@ class RuleSet(object):
         rv =  self.map.get(target, None)
         if (createIfNotPresent and (rv is None)):
             rv = Rule(target, None)
-            self.map[target] = rv
-            self.cache = { }
+            self._index_target(target, rv)
 
         return rv
 
 
+    def _plan_edges(self, label, useTags = True):
+        """
+        Return the rules for 'label', and a list of the labels they depend on.
+
+        Used by needed_to_build(), and remembered until we next change.
+        """
+        key = (label, useTags)
+        edges = self.plan_edges.get(key)
+        if edges is None:
+            rules = self.rules_for_target(label, useTags)
+            if len(rules) == 0:
+                raise MuddleBug("Rule list is empty for target %s"%label)
+            deps = set()
+            for rule in rules:
+                deps.update(rule.deps)
+            edges = (rules, list(deps))
+            self.plan_edges[key] = edges
+        return edges
+
+    def _plan(self, label, useTags = True, building = None):
+        """
+        Return the labels needed to build 'label', in the order to build them.
+
+        The list is the transitive closure of the dependencies of 'label'
+        (including 'label' itself, which comes last), topologically sorted
+        by a depth first search. It is remembered (until we next change), as
+        is the plan for each label we visit on the way whose closure is a
+        contiguous part of this one (which is all of them, unless they share
+        dependencies with labels visited before them). Remembered plans are
+        re-used when planning for labels that depend on them.
+
+        'building' is what we report as being built if we find a circular
+        dependency (in which case we raise GiveUp).
+        """
+        known = self.plans.get((label, useTags))
+        if known is not None:
+            plan, start, end = known
+            return plan[start:end]
+
+        plan = []
+        position = {}                   # label -> its index in plan
+        active = set([label])
+        # Each entry is [label, its dependencies, where its part of the plan
+        # starts, the earliest index in the plan that its closure uses]
+        stack = [[label, iter(self._plan_edges(label, useTags)[1]), 0, 0]]
+        visited = []                    # (label, start) for each we finish
+
+        def circular(dep):
+            chain = [entry[0] for entry in stack]
+            chain = chain[chain.index(dep):]
+            raise GiveUp("Dependency graph is circular or incomplete. \n" +
+                         "building = %s\n"%(building or label) +
+                         "targets = %s \n"%label_set_to_string(chain,
+                                                       start_with='[\n    ',
+                                                       end_with='\n]',
+                                                       join_with='\n    '))
+
+        while stack:
+            entry = stack[-1]
+            node, deps = entry[0], entry[1]
+            for dep in deps:
+                if dep in position:
+                    entry[3] = min(entry[3], position[dep])
+                    continue
+                if dep in active:
+                    circular(dep)
+                known = self.plans.get((dep, useTags))
+                if known is not None:
+                    # We already know how to build this - splice it in
+                    known_plan, start, end = known
+                    for index in xrange(start, end):
+                        other = known_plan[index]
+                        if other in active:
+                            circular(other)
+                        if other in position:
+                            entry[3] = min(entry[3], position[other])
+                        else:
+                            position[other] = len(plan)
+                            plan.append(other)
+                    continue
+                active.add(dep)
+                stack.append([dep, iter(self._plan_edges(dep, useTags)[1]),
+                              len(plan), len(plan)])
+                break
+            else:
+                # All of our dependencies are planned, so we can be built
+                stack.pop()
+                active.discard(node)
+                position[node] = len(plan)
+                plan.append(node)
+                start, earliest = entry[2], entry[3]
+                if stack:
+                    stack[-1][3] = min(stack[-1][3], earliest)
+                if earliest >= start:
+                    # Nothing before our part of the plan is needed to build
+                    # us, so that part is our plan
+                    visited.append((node, start))
+
+        if self.plans_size + len(plan) + len(visited) > self.MAX_PLANS_SIZE:
+            self.plans = { }
+            self.plans_size = 0
+        for node, start in visited:
+            self.plans[(node, useTags)] = (plan, start, position[node] + 1)
+        self.plans_size += len(plan) + len(visited)
+        return plan
+
     def rules_which_depend_on(self, label, useTags = True, useMatch = True):
         """
         Given a label, return a set of the rules which have it as one of
@@ -1353,21 +1781,18 @@ class RuleSet(object):
         """
         result_set = set()
 
-        for v in self.map.values():
-            if useMatch:
-                for dep in v.deps:
-                    if dep.match(label) is not None:
-                        result_set.add(v)
-                        break
-            elif useTags:
-                if (label in v.deps):
-                    result_set.add(v)
-            else:
-                for dep in v.deps:
+        if useMatch:
+            for dep in self._candidates(self.dep_index, label):
+                if dep.just_match(label):
+                    result_set.update(self.dependents[dep])
+        elif useTags:
+            result_set.update(self.dependents.get(label, ()))
+        else:
+            tags = self.dep_index.get(label._type, {}).get(label._name, {}).get(label._role, {})
+            for deps in tags.values():
+                for dep in deps:
                     if dep.match_without_tag(label):
-                        result_set.add(v)
-                        break
-
+                        result_set.update(self.dependents[dep])
 
         return result_set
 
@@ -1420,7 +1845,7 @@ class RuleSet(object):
 
         # .. and new_map is the new map.
         self.map = new_map
-        self.cache = { }
+        self._reindex()
 
 
     def to_string(self, matchLabel = None,
@@ -1585,11 +2010,52 @@ def retag_label_list(labels, new_tag):
 
     return result
 
+def build_plan(ruleset, target, useTags = True, useMatch = False):
+    """
+    Given a rule set and a target, return a plan for building the target.
+
+    This is what needed_to_build() uses to decide which rules are needed,
+    but it also says *why* they are needed. It returns a list of tuples of
+    the form (label, rules, deps), where:
+
+        * 'label' is a label that must be asserted to build 'target',
+        * 'rules' is the set of rules for 'label' (there may be more than
+          one in the presence of wildcarded targets), and
+        * 'deps' is a list of the labels that those rules depend upon (each
+          of which occurs earlier in the plan).
+
+    The labels are in build order. The arguments are as for needed_to_build().
+    """
+
+    # The set of labels we'd like to see asserted.
+    targets = ruleset.targets_match(target, useMatch=useMatch)
+    if len(targets) > 1:
+        targets = sorted(targets)
+
+    # Each label we need, in the order it must be built. The plan for each
+    # target already has its dependencies before it, so we just need to
+    # avoid repeating labels that more than one target needs.
+    plan = [ ]
+    seen = set()
+    for tgt in targets:
+        for label in ruleset._plan(tgt, useTags, target):
+            if label not in seen:
+                seen.add(label)
+                rules, deps = ruleset._plan_edges(label, useTags)
+                plan.append((label, rules, deps))
+
+    return plan
+
 def needed_to_build(ruleset, target, useTags = True, useMatch = False):
     """
     Given a rule set and a target, return a complete list of the rules needed
     to build the target.
 
+    The rules are in build order - every rule comes after the rules for the
+    labels it depends on. The plan for each label is remembered by the
+    rule set (until it next changes), so asking about several targets that
+    share dependencies does not repeat the work.
+
         * If useTags is true, then we should take account of tags when
           looking for the rules for this 'target', otherwise we should ignore
           them.
@@ -1600,119 +2066,78 @@ def needed_to_build(ruleset, target, useTags = True, useMatch = False):
     Returns a list of rules.
     """
 
-    # rule_list stores the list of rules we're about to return.
+    # This is slightly icky. Technically, in the presence of wildcard
+    # rules, there can be several rules which build a target.
+    #
+    # Since we use wildcard rules to add extra rules to targets,
+    # we need to satisfy every rule that builds this target.
     rule_list = [ ]
-    # rule_target_set stores the set of targets resulting from rule_list
-    # (i.e. if you'd obeyed rule_list, you'd have asserted all these labels)
-    rule_target_set = set()
+    with trace.span('needed_to_build', 'plan', target=target):
+        for label, rules, deps in build_plan(ruleset, target, useTags, useMatch):
+            rule_list.extend(rules)
 
-    # The set of labels we'd like to see asserted.
-    targets = set()
-    targets.update(ruleset.targets_match(target, useMatch=useMatch))
-
-    done_something = True
-    trace = False
-
-    while done_something:
-        done_something = False
-
-        if trace:
-            print "\n> Loop"
-
-        # Remove anything we've already satisfied from our list of targets.
-        targets = targets - rule_target_set
-
-        # Have we succeeded?
-        if len(targets) == 0:
-            # Yep!
-            if trace:
-                print
-                print "To build %s we need:"%target
-                for r in rule_list:
-                    print '    %s'%r
-                print
-            return rule_list
-
-        # In that case, we need to go through all the dependencies of the
-        # targets, adding each either to the target list or the rule_list.
-        new_targets = set()
-
-        for tgt in targets:
-            if trace:
-                print "\nLooking at target %s"%tgt
-            rules = ruleset.rules_for_target(tgt, useTags)
-            if rules is None:
-                raise MuddleBug("No rule found for target %s"%tgt)
-
-            # This is slightly icky. Technically, in the presence of wildcard
-            # rules, there can be several rules which build a target.
-            #
-            # Since we use wildcard rules to add extra rules to targets,
-            # we need to satisfy every rule that builds this target.
-
-            # Every dependency has either already been satisfied or
-            # needs to be.
-            can_build_target = True
+    return rule_list
 
-            if len(rules) == 0:
-                raise MuddleBug("Rule list is empty for target %s"%tgt)
 
-            if trace:
-                print "Rules for %s:"%tgt
-                for r in rules:
-                    print '    %s'%r
+def critical_path(ruleset, target, cost, useTags = True, useMatch = True):
+    """
+    Return the most costly chain of labels needed to build 'target'.
 
-            rule = None
-            for rule in rules:
-                if trace:
-                    print "Looking at rule %s"%rule
-                for dep in rule.deps:
-                    if dep not in rule_target_set:
-                        if trace:
-                            print "  Cannot build %s because it needs %s"%(tgt, dep)
-                            # .. and we can't build this target until we have.
-
-                        # We need to satisfy this dependency, so add it
-                        # to targets. The test here is purely so we can
-                        # detect circular dependencies.
-                        if dep not in new_targets and dep not in targets:
-                            if trace:
-                                print "  Add new target %s"%str(dep)
-                            new_targets.add(dep)
-                            done_something = True
-                        elif trace:
-                            if dep in targets: print "  ..already in targets"
-                            if dep in new_targets: print "  ..already in new_targets"
-
-                        can_build_target = False
-
-            if can_build_target:
-                # All dependencies are already satisfied, so we can ..
-                if trace:
-                    print "Add build rule: target %s"%tgt
-                    for rule in rules:
-                        print "                rule %s"%rule
-                for rule in rules:
-                    rule_list.append(rule)
-                rule_target_set.add(tgt)
-                done_something = True
-            else:
-                # Can't satisfy our dependencies. Still a target.
-                new_targets.add(tgt)
-
-        targets = new_targets
-
-    # If we get here, we can never satisfy the remaining set of
-    # targets because the graph is circular or incomplete.
-    targets = list(targets)
-    targets.sort()
-    raise GiveUp("Dependency graph is circular or incomplete. \n" +
-                 "building = %s\n"%target +
-                 "targets = %s \n"%label_set_to_string(targets,
-                                                       start_with='[\n    ',
-                                                       end_with='\n]',
-                                                       join_with='\n    '))
+    The labels are those that needed_to_build() would give rules for (in
+    fact, they come from build_plan()). 'cost' is called for each of them,
+    and should return how long (for instance) it takes to build that label.
+    The cost of a chain is the sum of the costs of its labels.
+
+    Returns a tuple (total, chain), where 'chain' is a list of the labels in
+    the chain, in build order (so it ends with the label for 'target').
 
+        >>> l = Label.from_string('package:fred{bob}/initial')
+        >>> r = RuleSet()
+        >>> depend_chain(None, l, ['built', 'installed'], r)
+        >>> other = Rule(Label.from_string('package:jim{bob}/built'), None)
+        >>> other.add(l)
+        >>> r.add(other)
+        >>> everything = Rule(Label.from_string('package:all{bob}/built'), None)
+        >>> everything.add(Label.from_string('package:fred{bob}/installed'))
+        >>> everything.add(Label.from_string('package:jim{bob}/built'))
+        >>> r.add(everything)
+        >>> costs = {'package:fred{bob}/built':3, 'package:jim{bob}/built':5}
+        >>> total, chain = critical_path(r, Label.from_string('package:all{bob}/built'),
+        ...                              lambda label: costs.get(str(label), 1))
+        >>> total
+        7
+        >>> for label in chain:
+        ...     print label
+        package:fred{bob}/initial
+        package:jim{bob}/built
+        package:all{bob}/built
+    """
+    finish = {}                 # label -> total cost of its costliest chain
+    previous = {}               # label -> the label before it in that chain
+    for label, rules, deps in build_plan(ruleset, target, useTags, useMatch):
+        before = None
+        for dep in sorted(deps):
+            if dep in finish and (before is None or finish[dep] > finish[before]):
+                before = dep
+        previous[label] = before
+        finish[label] = cost(label)
+        if before is not None:
+            finish[label] += finish[before]
+
+    if not finish:
+        return 0, []
+
+    last = None
+    for label in sorted(finish):
+        if last is None or finish[label] > finish[last]:
+            last = label
+    chain = []
+    label = last
+    while label is not None:
+        chain.append(label)
+        label = previous[label]
+    chain.reverse()
+    return finish[last], chain
 
 def required_by(ruleset, label, useTags = True, useMatch = True):
     """
@@ -1732,7 +2157,6 @@ def required_by(ruleset, label, useTags = True, useMatch = True):
     """
 
     depends = set()
-    return_val = [ ]
 
     # Grab the initial dependency set.
     rules = ruleset.rules_for_target(label, useMatch = useMatch)
@@ -1744,26 +2168,19 @@ def required_by(ruleset, label, useTags = True, useMatch = True):
     for r in rules:
         depends.add(r.target)
 
+    # And then do a breadth first search along the reverse dependency
+    # edges, looking at each label once
+    pending = collections.deque(depends)
+    while pending:
+        dep = pending.popleft()
+        # Everything that depends on dep depends on us ..
+        for rule in ruleset.rules_which_depend_on(dep, useTags, useMatch = useMatch):
+            # If we're not already in the depends set, add us ..
+            if rule.target not in depends:
+                depends.add(rule.target)
+                pending.append(rule.target)
 
-    while True:
-        extra = set()
-
-        for dep in depends:
-            # Merge in everything that depends on dep
-            new_rules = ruleset.rules_which_depend_on(dep, useTags, useMatch = useMatch)
-
-            # Each target depends on us ..
-            for rule in new_rules:
-                # If we're not already in the depends set, add us ..
-                if (not (rule.target in depends)):
-                    return_val.append(rule.target)
-                    extra.add(rule.target)
-
-        # Anything to add?
-        if len(extra) > 0:
-            depends = depends.union(extra)
-        else:
-            return depends
+    return depends
 
 
 def rule_with_least_dependencies(rules):
@@ -1821,9 +2238,9 @@ def normalise_checkout_label(label, tag='*'):
             not label.system and not label.transient:
         return label
     else:
-        new = label.copy_with_tag(tag)
-        new._role = None    # a bit naughty, but the simplest way
-        return new
+        Label._check_part('tag', tag)
+        return Label._shared(label.type, label.domain, label.name, None, tag,
+                             None, None)
 
 # Some simple ways of constructing labels
 def checkout(name, tag='*', domain=None):
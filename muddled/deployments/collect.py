@@ -169,6 +169,8 @@ class CollectDeploymentBuilder(Action):
             labels.append(assembly.from_label)
         return labels
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Actually do the copies ..
@@ -187,6 +189,7 @@ class CollectDeploymentBuilder(Action):
                          " in label %s"%(label))
 
     def deploy(self, builder, label, target_base):
+        env = builder.label_environment(label)
         for asm in self.assemblies:
             src = os.path.join(asm.get_source_dir(builder), asm.from_rel)
             dst = os.path.join(target_base, asm.to_name)
@@ -200,7 +203,7 @@ class CollectDeploymentBuilder(Action):
                 # If this is a file, just copy it.
                 if (not os.path.isdir(src)):
                     if (asm.using_rsync):
-                        utils.shell("rsync -avz \"%s\" \"%s\""%(src,dst))
+                        utils.shell("rsync -avz \"%s\" \"%s\""%(src,dst), env=env)
                     else:
                         utils.copy_file(src,dst,object_exactly=asm.copy_exactly)
                 elif asm.using_rsync: # Rsync for great speed!
@@ -213,7 +216,7 @@ class CollectDeploymentBuilder(Action):
                     if xdst[-1] != "/":
                         xdst = xdst + "/"
 
-                    utils.run0("rsync -avz \"%s/.\" \"%s\""%(src,xdst))
+                    utils.run0("rsync -avz \"%s/.\" \"%s\""%(src,xdst), env=env)
                 elif asm.recursive:
                     utils.recursively_copy(src, dst, object_exactly=asm.copy_exactly)
                 else:
@@ -259,11 +262,12 @@ class CollectDeploymentBuilder(Action):
                                   domain = label.domain)
 
         cmd = [builder.muddle_binary, "buildlabel", str(permissions_label)]
+        env = builder.label_environment(label)
         if need_root_for:
             print "I need root to do %s - sorry! - running sudo .."%(', '.join(sorted(need_root_for)))
-            utils.run0(["sudo"] + cmd)
+            utils.run0(["sudo"] + cmd, env=env)
         else:
-            utils.run0(cmd)
+            utils.run0(cmd, env=env)
 
     def apply_instructions(self, builder, label, prepare, deploy_path):
 
@@ -105,6 +105,8 @@ class CpioDeploymentBuilder(Action):
 
 
 
+    uses_label_environment = True
+
     def build_label(self,builder, label):
         """
         Actually cpio everything up, following instructions appropriately.
@@ -202,9 +204,11 @@ class CpioDeploymentBuilder(Action):
 
         if (self.compression_method is not None):
             if (self.compression_method == "gzip"):
-                utils.run0(["gzip", "-f", deploy_file])
+                utils.run0(["gzip", "-f", deploy_file],
+                           env=builder.label_environment(label))
             elif (self.compression_method == "bzip2"):
-                utils.run0(["bzip2", "-f", deploy_file])
+                utils.run0(["bzip2", "-f", deploy_file],
+                           env=builder.label_environment(label))
             else:
                 raise GiveUp("Invalid compression method %s"%self.compression_method +
                              "specified for cpio deployment. Pick gzip or bzip2.")
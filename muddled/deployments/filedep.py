@@ -99,6 +99,8 @@ class FileDeploymentBuilder(Action):
             env.set_type("MUDDLE_TARGET_LOCATION", muddled.env_store.EnvType.SimpleValue)
             env.set("MUDDLE_TARGET_LOCATION", self.target_dir)
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Performs the actual build.
@@ -166,13 +168,14 @@ class FileDeploymentBuilder(Action):
                                          utils.LabelTag.InstructionsApplied,
                                          domain = label.domain)
 
+        env = builder.label_environment(label)
         if need_root_for:
             print "I need root to do %s - sorry! - running sudo .."%(', '.join(sorted(need_root_for)))
             utils.run0("sudo %s buildlabel '%s'"%(builder.muddle_binary,
-                                                  permissions_label))
+                                                  permissions_label), env=env)
         else:
             utils.run0("%s buildlabel '%s'"%(builder.muddle_binary,
-                                             permissions_label))
+                                             permissions_label), env=env)
 
     def apply_instructions(self, builder, label):
 
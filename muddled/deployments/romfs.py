@@ -100,7 +100,9 @@ class RomFSDeploymentBuilder(CollectDeploymentBuilder):
         if (self.alignment is not None):
             cmd = cmd + " -a %d"%(int(self.alignment))
         cmd = cmd + " -d \"%s\""%(my_tmp)
-        utils.run0(cmd)
+        utils.run0(cmd, env=builder.label_environment(label))
+
+    uses_label_environment = True
 
     def build_label(self, builder, label):
         """
@@ -34,6 +34,7 @@ from muddled.depend import Action, Rule, Label, needed_to_build, label_list_to_s
 from muddled.utils import GiveUp, MuddleBug, LabelTag, LabelType, \
         copy_without, normalise_dir, find_local_relative_root, \
         copy_file, domain_subpath, sort_domains
+from muddled.db import TAG_STORE_FILES
 from muddled.version_control import get_vcs_instance, vcs_special_files
 from muddled.mechanics import build_co_and_path_from_str
 from muddled.pkgs.make import MakeBuilder, deduce_makefile_name
@@ -845,6 +846,14 @@ def _set_checkout_tags(builder, label, target_dir):
     if DEBUG:
         print '..copying %s'%src_tags_dir
         print '       to %s'%tgt_tags_dir
+
+    tags = builder.db.tags_for_domain(label.domain)
+    if tags.store() != TAG_STORE_FILES:
+        # Our tags are (at least) in a journal, but the target has tag files
+        tags.copy_tag_files(os.path.join(target_dir, local_root),
+                            LabelType.Checkout, label.name)
+        return
+
     copy_without(src_tags_dir, tgt_tags_dir, preserve=True, verbose=VERBOSE)
 
 def _set_package_tags(builder, label, target_dir, which_tags):
@@ -867,6 +876,14 @@ def _set_package_tags(builder, label, target_dir, which_tags):
 
     # We only want to copy tags for this particular role,
     # and only tags up to having built our obj/ hierarchy
+    tags = builder.db.tags_for_domain(label.domain)
+    if tags.store() != TAG_STORE_FILES:
+        # Our tags are (at least) in a journal, but the target has tag files
+        wanted = ['%s-%s'%(label.role, tag) for tag in which_tags]
+        tags.copy_tag_files(os.path.join(target_dir, local_root),
+                            LabelType.Package, label.name, wanted)
+        return
+
     if not os.path.exists(tgt_tags_dir):
         os.makedirs(tgt_tags_dir)
     for tag in which_tags:
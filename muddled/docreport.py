@@ -17,6 +17,7 @@ from inspect import getmembers, isfunction, isclass, ismethod, ismodule, \
 
 import utils
 
+from muddled.commands import command, Command, CAT_QUERY
 from muddled.utils import GiveUp, page_text
 from muddled.withdir import Directory
 
@@ -369,6 +370,90 @@ def report(args):
         else:
             page(pager, report_on_multiple_results(what, results))
 
+# The "muddle doc" command lives here, so that we (and pydoc) are only
+# imported when it is used - see muddled.commands.lazy_command()
+@command('doc', CAT_QUERY)
+class Doc(Command):
+    """
+    :Syntax: muddle doc [<switch> ...] [<what>]
+
+    To get documentation on modules, classes, methods or functions in muddle,
+    use::
+
+        muddle doc <name>               for help on <name>
+        muddle doc -contains <what>     to list all names that contain <what>
+
+    There are also (mainly for use in debugging muddle itself - beware,
+    they all produce long output)::
+
+        muddle doc -duplicates     to list all duplicate (partial) names
+        muddle doc -list           to list all the "full" names we know
+        muddle doc -dump           to dump the internal map of names/values
+
+    <switch> may also be::
+
+        -p[ager] <pager>    to specify a pager through which the text will be
+                            piped. The default is $PAGER (if set) or else
+                            'more'.
+        -nop[ager]          don't use a pager, just print the text out.
+        -pydoc              Use pydoc's rendering to output the text about the
+                            item. This tends to produce more information. It
+                            is also (more or less) the format that the older
+                            "muddle doc" command used.
+
+    The plain "muddle doc <name>" can be used to find out about any muddle
+    module, class, method or function. Leading parts of the name can be
+    omitted ("Builder" and "mechanics.Builder" and "muddled.mechanics.Builder"
+    are all the same), provided that doesn't make <name> ambiguous, and if it
+    does, you will be given a list of the possible alternatives. So, for
+    instance::
+
+        $ muddle doc Builder
+
+    will report on muddled.mechanics.Builder, but::
+
+        $ muddle doc simple
+
+    will give a list of all the names that contain 'simple'.
+
+    If you're not sure of a name, then "-contains" can be used to look for all
+    the (full names - i.e., starting with "muddled.") that contain that string.
+    For instance::
+
+        $ muddle doc -contains absolute
+        The following names contain "absolute":
+          muddled.checkouts.multilevel.absolute
+          muddled.checkouts.simple.absolute
+          muddled.checkouts.twolevel.absolute
+
+    and one can then safely do::
+
+        $ muddle doc simple.absolute
+
+    For a module, the module docstring is reported, and then a list of the
+    names of all the classes and functions in that module.
+
+    For a class, the classes it inherits from, its docstring and its __init__
+    method are all reported, followed by a list of the methods in that class.
+
+    For a method or function, its argument list (signature) and docstring are
+    reported.
+
+    If "-pydoc" is specified, then the layout of various things will be
+    different, and also the full documentation of internal items (methods
+    inside classes, etc.) will be reported - this can lead to substantially
+    longer output.
+    """
+
+    def requires_build_tree(self):
+        return False
+
+    def with_build_tree(self, builder, current_dir, args):
+        report(args)
+
+    def without_build_tree(self, muddle_binary, current_dir, args):
+        report(args)
+
 if __name__ == '__main__':
     args = sys.argv[1:]
     try:
@@ -547,6 +547,9 @@ class Store(object):
 
     def __init__(self):
         self.vars = { }
+        # Incremented whenever we (may) change, so that anyone remembering
+        # things worked out from us can tell when they are out of date
+        self.generation = 0
 
     def copy(self):
         # We need to do quite a deep copy here ..
@@ -574,7 +577,11 @@ class Store(object):
         """
         Return a builder for the given variable, inventing one if
         there isn't already one
+
+        Since the builder may then be changed, we count this as changing
+        the store.
         """
+        self.generation += 1
         if (name in self.vars):
             return self.vars[name]
         else:
@@ -0,0 +1,215 @@
+"""
+Fingerprints of what went into building package labels.
+
+Normally, a package label is only built if its tag is not set, which means
+that after (for instance) "muddle pull", we must either know which packages
+to rebuild, or rebuild everything.
+
+If $MUDDLE_FINGERPRINTS is set, then whenever the tag for a package label
+is set, we also remember a fingerprint of its inputs, in .muddle/_fingerprints.
+This is a hash of:
+
+* the label itself, and the class (and simple settings) of its action,
+* the effective environment for the label (see
+  Builder.effective_environment_for()),
+* for each checkout it depends on, the checkout's revision (or, if its VCS
+  can't tell us that, the names, sizes and modification times of its files),
+* and the fingerprints of the package labels it depends on.
+
+Then a package label whose tag is set is only regarded as built if its
+fingerprint has not changed. Since a label's fingerprint includes those of
+the labels it depends upon, changing a checkout means that everything that
+is built from it (directly or indirectly) will be built again.
+
+If a built label does not yet have a fingerprint (for instance, because it
+was built before $MUDDLE_FINGERPRINTS was set), then we trust its tag, and
+remember its current fingerprint.
+"""
+
+import hashlib
+import os
+
+import muddled.depend as depend
+from muddled.utils import GiveUp, LabelType
+
+def fingerprints_enabled():
+    """Should we use fingerprints to decide if package labels are built?
+    """
+    return bool(os.environ.get('MUDDLE_FINGERPRINTS'))
+
+class Fingerprinter(object):
+    """
+    Work out (and remember) the fingerprints of labels, for a Builder.
+
+    Checkout revisions, label fingerprints and whether labels are "clean"
+    are remembered until forget() is called for something they depend on,
+    which the Builder does whenever it builds anything other than a package
+    label (since checking out or pulling a checkout, for instance, may
+    change its revision).
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.checkouts = {}         # checkout label -> fingerprint
+        self.labels = {}            # package label -> fingerprint
+        self.clean = {}             # label -> no local changes?
+
+    def forget(self, label=None):
+        """Forget what we have worked out about 'label' and what depends on it.
+
+        We ignore tags in doing this, so that (for instance) pulling a
+        checkout forgets about everything built from any of its labels.
+        If 'label' is None, forget everything.
+        """
+        if label is None:
+            self.checkouts.clear()
+            self.labels.clear()
+            self.clean.clear()
+            return
+
+        key = label.copy_with_tag('*')
+        self.checkouts.pop(key, None)
+        for known in [l for l in self.clean if l.copy_with_tag('*') == key]:
+            del self.clean[known]
+        for dep in depend.required_by(self.builder.ruleset, label,
+                                      useTags=False, useMatch=False):
+            self.labels.pop(dep, None)
+            self.clean.pop(dep, None)
+
+    def checkout_fingerprint(self, co_label):
+        """Return a fingerprint for the given checkout.
+
+        Returns None if the checkout's directory does not exist.
+        """
+        key = co_label.copy_with_tag('*')
+        if key in self.checkouts:
+            return self.checkouts[key]
+
+        db = self.builder.db
+        co_dir = db.get_checkout_path(co_label)
+        if not os.path.isdir(co_dir):
+            return None
+
+        vcs_handler = db.get_checkout_vcs(co_label)
+        try:
+            revision = vcs_handler.revision_to_checkout(self.builder, co_label,
+                                                        force=True,
+                                                        show_pushd=False)
+        except GiveUp:
+            revision = None
+        if revision and revision != '0':
+            fingerprint = 'revision %s'%revision
+        else:
+            fingerprint = 'tree %s'%_tree_hash(co_dir,
+                                               vcs_handler.get_vcs_special_files())
+        self.checkouts[key] = fingerprint
+        return fingerprint
+
+    def label_fingerprint(self, label):
+        """Return the fingerprint for the given package label.
+        """
+        if label in self.labels:
+            return self.labels[label]
+
+        builder = self.builder
+        hasher = hashlib.md5()
+        hasher.update('%s\0'%label)
+
+        actions, deps = self._actions_and_deps(label)
+        for text in sorted(_action_description(action) for action in actions):
+            hasher.update(text)
+
+        store = builder.effective_environment_for(label)
+        for name in sorted(store.vars):
+            env = store.vars[name]
+            hasher.update('env %s %s %s %s\0'%(name, env.env_type,
+                                               env.external, env))
+
+        for dep in sorted(deps):
+            if dep.type == LabelType.Checkout:
+                value = self.checkout_fingerprint(dep)
+            elif dep.type == LabelType.Package:
+                value = self.label_fingerprint(dep)
+            else:
+                value = ''
+            hasher.update('dep %s %s\0'%(dep, value))
+
+        fingerprint = hasher.hexdigest()
+        self.labels[label] = fingerprint
+        return fingerprint
+
+    def is_clean(self, label):
+        """Are the checkouts that 'label' is built from free of local changes?
+
+        That is, can we trust the revisions of all the checkouts that 'label'
+        depends upon (directly or indirectly) to describe their content? If
+        a checkout's VCS can't tell us, we assume that it is not clean.
+        """
+        if label in self.clean:
+            return self.clean[label]
+
+        if label.type == LabelType.Checkout:
+            vcs_handler = self.builder.db.get_checkout_vcs(label)
+            try:
+                clean = not vcs_handler.has_local_changes(self.builder, label)
+            except GiveUp:
+                clean = False
+        else:
+            actions, deps = self._actions_and_deps(label)
+            clean = True
+            for dep in sorted(deps):
+                if dep.type in (LabelType.Checkout, LabelType.Package):
+                    if not self.is_clean(dep):
+                        clean = False
+                        break
+
+        self.clean[label] = clean
+        return clean
+
+    def _actions_and_deps(self, label):
+        """Return the actions for 'label', and the set of labels it needs.
+        """
+        actions = []
+        deps = set()
+        for rule in self.builder.ruleset.rules_for_target(label, useTags=True,
+                                                          useMatch=False):
+            if rule.action is not None:
+                actions.append(rule.action)
+            deps.update(rule.deps)
+        return actions, deps
+
+def _action_description(action):
+    """Return a string describing the class and simple settings of 'action'.
+
+    The settings are those of its attributes whose values are strings,
+    numbers, booleans or None - the ways a build description typically
+    configures an action.
+    """
+    action_class = action.__class__
+    parts = ['action %s.%s\0'%(action_class.__module__, action_class.__name__)]
+    for name, value in sorted(getattr(action, '__dict__', {}).items()):
+        if value is None or isinstance(value, (basestring, int, long, float)):
+            parts.append('setting %s %r\0'%(name, value))
+    return ''.join(parts)
+
+def _tree_hash(path, ignore):
+    """Return a hash of the names, sizes and modification times under 'path'.
+
+    Files and directories whose names are in 'ignore' are not included.
+    """
+    hasher = hashlib.md5()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in ignore)
+        for name in sorted(filenames):
+            if name in ignore:
+                continue
+            filename = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(filename)
+            except OSError:
+                continue
+            hasher.update('%s\0%d\0%d\0'%(os.path.relpath(filename, path),
+                                          st.st_size, int(st.st_mtime)))
+    return hasher.hexdigest()
+
+# End file.
@@ -2,25 +2,98 @@
 Contains the mechanics of muddle.
 """
 
+import fcntl
+import hashlib
 import os
 import re
+import resource
+import select
 import sys
+import tempfile
+import time
 import traceback
 
 import muddled.db as db
 import muddled.depend as depend
 import muddled.pkg as pkg
+import muddled.snapshot as snapshot
+import muddled.trace as trace
 import muddled.utils as utils
 import muddled.env_store as env_store
 import muddled.instr as instr
 
+from muddled.cache import artifact_cache, tree_state, changed_files, \
+        write_file_list, read_file_list, remote_cache, fetch_entry, \
+        upload_entry, RemoteTransfers
 from muddled.depend import Label, Action, normalise_checkout_label, label_list_to_string
+from muddled.fingerprint import Fingerprinter, fingerprints_enabled
 from muddled.utils import domain_subpath, GiveUp, MuddleBug, LabelType, LabelTag
 from muddled.repository import Repository
 from muddled.utils import split_vcs_url, sort_domains
 from muddled.version_control import checkout_from_repo
 from muddled.version_stamp import ReleaseSpec
 
+# The package steps that the artifact cache can save us from building
+CACHED_PACKAGE_TAGS = (LabelTag.PreConfig, LabelTag.Configured, LabelTag.Built,
+                       LabelTag.Installed, LabelTag.PostInstalled)
+
+# How many uploads to the remote artifact cache may be under way at once -
+# storing another package queues its upload until one of them has finished
+MAX_UPLOADS = 2
+
+class BuildProgress(object):
+    """
+    Keep track of what is left to build, and how long it is likely to take.
+
+    The estimate comes from how long each label took the last few times it
+    was built (see muddled.db.BuildHistory).
+    """
+
+    def __init__(self, builder, rules, jobs=1):
+        self.jobs = jobs
+        # The rules with actions, whose targets are not yet built, and how
+        # long each is likely to take (None if we don't know)
+        history = builder.db.build_history
+        self.remaining = {}
+        for r in rules:
+            if r.action is not None and not builder.db.is_tag(r.target):
+                self.remaining[r] = history.estimate(r.target)
+        self.total = len(self.remaining)
+        # The sum of the estimates we do know, and how many we don't
+        self.seconds = 0.0
+        self.unknown = 0
+        for estimate in self.remaining.values():
+            if estimate is None:
+                self.unknown += 1
+            else:
+                self.seconds += estimate
+
+    def done(self, r):
+        """
+        Note that rule 'r' has been dealt with.
+
+        Returns a line reporting how long the rest of the build should take,
+        or None if we don't have anything useful to say.
+        """
+        if r not in self.remaining:
+            return None
+        estimate = self.remaining.pop(r)
+        if estimate is None:
+            self.unknown -= 1
+        else:
+            self.seconds -= estimate
+        if not self.remaining or self.unknown == len(self.remaining):
+            return None
+
+        # Don't let rounding errors take us below zero
+        seconds = max(self.seconds, 0.0) / min(self.jobs, len(self.remaining))
+        text = '> About %s left (%d of %d labels built'%(utils.format_duration(seconds),
+                                                      self.total - len(self.remaining),
+                                                      self.total)
+        if self.unknown:
+            text += ', %d not built before'%self.unknown
+        return text + ')'
+
 class ErrorInBuildDescription(GiveUp):
     """We want to be able to distinguish this exception *in this module*
 
@@ -28,6 +101,44 @@ class ErrorInBuildDescription(GiveUp):
     """
     pass
 
+class EnvironmentMap(dict):
+    """
+    A dictionary of label to environment store, as used for Builder.env
+
+    It remembers how many times it has been changed, so that the Builder
+    can tell when anything it has worked out from it is out of date.
+    """
+
+    generation = 0
+
+    def __setitem__(self, key, value):
+        self.generation += 1
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.generation += 1
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self.generation += 1
+        dict.clear(self)
+
+    def pop(self, *args):
+        self.generation += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.generation += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self.generation += 1
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self.generation += 1
+        dict.update(self, *args, **kwargs)
+
 build_name_re = re.compile(r"[A-Za-z0-9_-]+")
 
 def check_build_name(name):
@@ -128,7 +239,23 @@ class Builder(object):
         # XXX What used to be in the Invocation constructor
         self.db = db.Database(root_path)
         self.ruleset = depend.RuleSet()
-        self.env = {}
+        self.env = EnvironmentMap()
+        # The environments in self.env, indexed by type and name, and what
+        # we have worked out from them for particular labels
+        self._env_index = None
+        self._env_lists = {}
+        self._env_merged = {}
+        # The environments for the labels we are currently building
+        self.label_environments = {}
+        # Our Fingerprinter, if we are using fingerprints
+        self._fingerprinter = None
+        # Which packages we have restored from the artifact cache (True) or
+        # looked for in vain (False)
+        self._cache_results = {}
+        # The keys that the remote artifact cache does not have, and our
+        # uploads to it
+        self._remote_misses = set()
+        self._uploads = None
         self.default_roles = []
         self.default_deployment_labels = []
         self.banned_roles = []
@@ -411,6 +538,22 @@ class Builder(object):
         return return_set
 
 
+    def muddle_command(self):
+        """
+        Return the command that $(MUDDLE) should run in muddle Makefiles.
+
+        This is normally just our muddle binary. However, if "muddle server"
+        is running for this build tree, then it is our muddle_client.py
+        resource, which asks the server to answer "muddle query" commands,
+        and runs our muddle binary for anything else.
+        """
+        if self.muddle_binary is not None and \
+           os.path.exists(self.db.query_server_socket_name()):
+            client = os.path.join(self.muddled_dir, 'resources',
+                                  'muddle_client.py')
+            return '%s %s %s'%(sys.executable, client, self.muddle_binary)
+        return self.muddle_binary
+
     def set_default_variables(self, label, store):
         """
         Muddle defines a variety of environment variables which are available
@@ -429,6 +572,10 @@ class Builder(object):
 
                 fred_objdir = $(shell $(MUDDLE) query objdir package:fred{base})
 
+            If "muddle server" is running for this build tree, then this will
+            run a small client that asks the server to answer "muddle query"
+            commands (see muddle_command()).
+
         ``MUDDLE_ROOT``
             The absolute path to the root of the build tree (where the
             '.muddle' and 'src' directories are).
@@ -552,7 +699,7 @@ class Builder(object):
         store.set("MUDDLE_LABEL", label.__str__())
         store.set("MUDDLE_KIND", label.type)
         store.set("MUDDLE_NAME", label.name)
-        store.set("MUDDLE", self.muddle_binary)
+        store.set("MUDDLE", self.muddle_command())
         if (label.role is None):
             store.erase("MUDDLE_ROLE")
         else:
@@ -692,26 +839,343 @@ class Builder(object):
                 self.db.clear_tag(r)
 
 
-    def _build_label_env(self, label, env_store):
+    def _new_label_environment(self, label, base_env):
         """
-        Amend the environment, ready for building a label.
-
-        'r' is the rule for how to build the label.
+        Return a new environment dictionary, ready for building a label.
 
-        'env_store' is the environment store holding (most of) the environment
-        we want to use.
-
-        It is the caller's responsibility to put the environment BACK when
-        finished with it...
+        The environment starts as a copy of 'base_env'. We then add the
+        default environment variables for 'label', and anything the build
+        description has asked for.
         """
+        env = dict(base_env)
         local_store = env_store.Store()
 
         # Add the default environment variables for building this label
         self.set_default_variables(label, local_store)
-        local_store.apply(os.environ)
+        local_store.apply(env)
 
         # Add anything the rest of the system has put in.
-        self.setup_environment(label, os.environ)
+        self.setup_environment(label, env)
+        return env
+
+    def label_environment(self, label):
+        """
+        Return the environment to use when building 'label', as a dictionary.
+
+        If 'label' is being built, this is the environment that was set up
+        for it (so changes made to it by its action are kept until the action
+        is finished). Otherwise, it is a new environment based on that of the
+        muddle process.
+
+        Actions should pass this to utils.run0() and friends (as their 'env'
+        argument), rather than relying on os.environ.
+        """
+        env = self.label_environments.get(label)
+        if env is None:
+            env = self._new_label_environment(label, os.environ)
+        return env
+
+    def _build_rule(self, r):
+        """
+        Run the action for rule 'r', in the environment for its target.
+
+        Does not set the tag for the target - that is up to the caller.
+        """
+        if not r.action:
+            return
+
+        # Anything the action runs (another muddle, perhaps) should see the
+        # tags as they are now, and we want to see any it sets
+        self.db.sync_tags()
+
+        label = r.target
+        self.label_environments[label] = self._new_label_environment(label,
+                                                                     os.environ)
+        # If we have an artifact cache, it wants to know what installing
+        # a package changes in its install directory
+        watch_install = (label.type == LabelType.Package and
+                         label.tag == LabelTag.Installed and
+                         not label.transient)
+        if watch_install:
+            install_record = self._install_record_path(label)
+            if os.path.exists(install_record):
+                os.remove(install_record)
+            watch_install = artifact_cache() is not None
+        if watch_install:
+            install_path = self.package_install_path(label)
+            before = tree_state(install_path)
+        start = time.time()
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        status = 1
+        try:
+            try:
+                if depend.uses_label_environment(r.action):
+                    r.action.build_label(self, label)
+                else:
+                    # The action expects to find its environment in os.environ
+                    old_env = os.environ
+                    try:
+                        os.environ = self.label_environments[label]
+                        r.action.build_label(self, label)
+                    finally:
+                        os.environ = old_env
+                status = 0
+            except utils.ShellError as e:
+                status = e.retcode
+                raise
+            finally:
+                self._record_build_time(label, r.action, start, usage, status)
+            if watch_install:
+                utils.ensure_dir(os.path.dirname(install_record), verbose=False)
+                write_file_list(install_record,
+                                changed_files(before, tree_state(install_path)))
+        finally:
+            del self.label_environments[label]
+            self.db.sync_tags()
+
+    def _record_build_time(self, label, action, start, usage, status):
+        """
+        Add a record of building 'label' to our build history (and to any
+        trace, see muddled.trace).
+
+        'usage' is the resource usage of our child processes from before
+        'action' was run, and 'status' is how it ended.
+
+        The CPU time used by the action's processes is the difference in
+        our child processes' CPU time. The largest resident set size of our
+        child processes, on the other hand, is a maximum over all the child
+        processes we have ever run - so if it did not increase, all we know
+        is that it was no bigger than before, and we record that we don't
+        know. In a parallel build, each label is built in its own process,
+        so this is only a problem when building one label at a time.
+        """
+        now = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = ((now.ru_utime - usage.ru_utime) +
+               (now.ru_stime - usage.ru_stime))
+        if now.ru_maxrss > usage.ru_maxrss or usage.ru_maxrss == 0:
+            max_rss = now.ru_maxrss
+        else:
+            max_rss = None
+        end = time.time()
+        action_class = '%s.%s'%(action.__class__.__module__,
+                                action.__class__.__name__)
+        self.db.build_history.record(label, start, end - start,
+                                     action=action_class, status=status,
+                                     cpu=round(cpu, 3), max_rss=max_rss)
+        trace.add_span(str(label), 'build', start, end, action=action_class,
+                       status=status)
+
+    def is_built(self, label):
+        """
+        Is 'label' already built?
+
+        That is, is its tag set? If we are using fingerprints (see
+        muddled.fingerprint), then a package label also needs the same
+        fingerprint as when it was built.
+        """
+        if not self.db.is_tag(label):
+            return False
+        if label.type != LabelType.Package or not fingerprints_enabled():
+            return True
+
+        current = self.fingerprinter().label_fingerprint(label)
+        recorded = self.db.fingerprints.get(label)
+        if recorded is None:
+            # Built before we were using fingerprints, so trust it
+            self.db.fingerprints.set(label, current)
+            return True
+        return recorded == current
+
+    def set_built(self, label):
+        """
+        Record that 'label' has been built, by setting its tag.
+
+        If we are using fingerprints, also remember the fingerprint of a
+        package label.
+        """
+        self.db.set_tag(label)
+        if fingerprints_enabled():
+            if label.type == LabelType.Package:
+                self.db.fingerprints.set(label,
+                                 self.fingerprinter().label_fingerprint(label))
+        if label.type != LabelType.Package:
+            # Building a checkout (for instance) may change its revision
+            if self._fingerprinter:
+                self._fingerprinter.forget(label)
+            self._cache_results.clear()
+        elif label.tag == LabelTag.PostInstalled and not label.transient:
+            self._store_in_cache(label)
+
+    def fingerprinter(self):
+        """
+        Return our Fingerprinter (see muddled.fingerprint).
+        """
+        if self._fingerprinter is None:
+            self._fingerprinter = Fingerprinter(self)
+        return self._fingerprinter
+
+    def _install_record_path(self, label):
+        """
+        Where we remember what installing package 'label' changed.
+        """
+        name = hashlib.md5(str(label.copy_with_tag(LabelTag.Installed)))
+        return os.path.join(self.db.root_path, '.muddle', '_installed',
+                            name.hexdigest())
+
+    def _cache_key(self, label):
+        """
+        Return the artifact cache key for package 'label', or None.
+
+        There is no key if the checkouts it is built from have local changes.
+
+        What is built often records where it was built and installed (in
+        libtool .la files, pkg-config .pc files, Makefiles written by
+        configure, and so on), so the key also includes the package's object
+        and install directories - an entry is only used by a build tree in
+        the same place as the one that stored it.
+        """
+        fingerprinter = self.fingerprinter()
+        if not fingerprinter.is_clean(label):
+            return None
+        hasher = hashlib.md5(fingerprinter.label_fingerprint(label))
+        hasher.update('\0%s\0%s'%(self.package_obj_path(label),
+                                   self.package_install_path(label)))
+        return hasher.hexdigest()
+
+    def restore_from_cache(self, label, silent=False):
+        """
+        Try to restore package 'label' from the artifact cache.
+
+        If $MUDDLE_CACHE is set (see muddled.cache), and the cache has an
+        entry for the package as it would now be built, then restore its
+        object and install files from the cache (if we have not already
+        done so). If the cache does not have such an entry, but the remote
+        cache named by $MUDDLE_REMOTE_CACHE does, then fetch it first.
+
+        Returns True if 'label' does not now need building, False otherwise.
+        """
+        if (label.type != LabelType.Package or label.transient or
+            label.tag not in CACHED_PACKAGE_TAGS):
+            return False
+        cache = artifact_cache()
+        if cache is None:
+            return False
+
+        package = label.copy_with_tag(LabelTag.PostInstalled)
+        if package in self._cache_results:
+            return self._cache_results[package]
+
+        restored = False
+        key = self._cache_key(package)
+        if key is not None:
+            remote = remote_cache()
+            restored = cache.restore(key, package,
+                                     self.package_obj_path(package),
+                                     self.package_install_path(package),
+                                     record_miss=(remote is None))
+            if not restored and remote is not None:
+                if self._fetch_from_remote_cache(remote, cache, key, package):
+                    restored = cache.restore(key, package,
+                                             self.package_obj_path(package),
+                                             self.package_install_path(package),
+                                             record_miss=False)
+                if not restored:
+                    cache.record('miss', package)
+            if restored and not silent:
+                print "> Restored %s from the cache"%package.copy_with_tag('*')
+        self._cache_results[package] = restored
+        return restored
+
+    def _store_in_cache(self, label):
+        """
+        Store the results of building package 'label' in the artifact cache.
+
+        We can only do so if we know what installing it changed.
+        """
+        cache = artifact_cache()
+        if cache is None or self._cache_results.get(label):
+            return
+        install_files = read_file_list(self._install_record_path(label))
+        if install_files is None:
+            return
+        key = self._cache_key(label)
+        if key is None:
+            return
+        stored = cache.store(key, label, self.package_obj_path(label),
+                             self.package_install_path(label), install_files)
+        remote = remote_cache()
+        if stored and remote is not None:
+            if self._uploads is None:
+                self._uploads = RemoteTransfers(MAX_UPLOADS)
+            self._uploads.start(key, upload_entry, remote, cache, key)
+
+    def _fetch_from_remote_cache(self, remote, cache, key, label):
+        """
+        Fetch the entry 'key' (for package 'label') from the remote cache.
+
+        Returns True if we fetched it. If the remote cache does not have it,
+        or it could not be fetched (perhaps because the entry was corrupt,
+        or the connection timed out - see fetch_entry()), we remember that,
+        and don't ask again.
+        """
+        if key in self._remote_misses:
+            return False
+        try:
+            if fetch_entry(remote, cache, key, label):
+                return True
+        except GiveUp as e:
+            print 'Warning: %s'%e
+        self._remote_misses.add(key)
+        return False
+
+    def _prefetch_from_remote_cache(self, rules, jobs):
+        """
+        Fetch what we can of the packages for 'rules' from the remote cache.
+
+        Up to 'jobs' (but at least two) entries are fetched at once, into the
+        local artifact cache, ready for restore_from_cache(). We can only do
+        this for packages whose checkouts are already checked out - any
+        others are fetched (if they can be) when they are to be built.
+        """
+        cache = artifact_cache()
+        if cache is None:
+            return
+        remote = remote_cache()
+        if remote is None:
+            return
+
+        wanted = {}                     # package label -> key
+        for r in rules:
+            label = r.target
+            if (label.type != LabelType.Package or label.transient or
+                label.tag not in CACHED_PACKAGE_TAGS):
+                continue
+            package = label.copy_with_tag(LabelTag.PostInstalled)
+            if (package in wanted or package in self._cache_results or
+                self.db.is_tag(package)):
+                continue
+            key = self._cache_key(package)
+            if key is None or key in self._remote_misses or cache.has_entry(key):
+                continue
+            wanted[package] = key
+
+        if not wanted:
+            return
+        fetches = RemoteTransfers(max(jobs, 2))
+        for package in sorted(wanted):
+            key = wanted[package]
+            fetches.start(key, fetch_entry, remote, cache, key, package)
+        for key, fetched in fetches.finish().items():
+            if not fetched:
+                self._remote_misses.add(key)
+
+    def finish_uploads(self):
+        """
+        Wait for any uploads to the remote artifact cache to finish.
+        """
+        if self._uploads is not None:
+            self._uploads.finish()
+            self._uploads = None
 
     def build_label(self, label, silent=False):
         """
@@ -725,25 +1189,23 @@ class Builder(object):
             print "There is no rule to build label %s"%label
             return
 
+        progress = BuildProgress(self, rule_list)
         for r in rule_list:
-            if self.db.is_tag(r.target):
+            if self.is_built(r.target):
                 # Don't build stuff that's already built ..
-                pass
+                progress.done(r)
+            elif self.restore_from_cache(r.target, silent):
+                self.set_built(r.target)
+                progress.done(r)
             else:
                 if not silent:
                     print "> Building %s"%(r.target)
 
-                # Set up the environment for building this label
-                old_env = os.environ.copy()
-                try:
-                    self._build_label_env(r.target, env_store)
-
-                    if r.action:
-                        r.action.build_label(self, r.target)
-                finally:
-                    os.environ = old_env
-
-                self.db.set_tag(r.target)
+                self._build_rule(r)
+                self.set_built(r.target)
+                report = progress.done(r)
+                if report and not silent:
+                    print report
 
     def build_label_with_options(self, label, useDepends = True, useTags = True, silent = False):
         """
@@ -765,22 +1227,240 @@ class Builder(object):
 
         for r in rule_list:
             # Build it.
-            if (not self.db.is_tag(r.target)):
+            if (not self.is_built(r.target)):
                 # Don't build stuff that's already built ..
                 if (not silent):
                     print "> Building %s"%(r.target)
 
-                # Set up the environment for building this label
-                old_env = os.environ.copy()
-                try:
-                    self._build_label_env(r.target, env_store)
+                self._build_rule(r)
+                self.set_built(r.target)
+
+    def _build_in_worker(self, r):
+        """
+        Should rule 'r' be built in a separate worker process?
 
-                    if r.action:
-                        r.action.build_label(self, r.target)
-                finally:
-                    os.environ = old_env
+        Only package labels are built in workers. Checking out, deploying
+        and so on may change what the builder knows (for instance, checking
+        out a build description adds new rules), which would be lost if it
+        happened in another process.
+        """
+        return (r.action is not None and
+                r.target.type == LabelType.Package and
+                not r.target.transient)
+
+    def _start_worker(self, r):
+        """
+        Build rule 'r' in a new (forked) worker process.
 
-                self.db.set_tag(r.target)
+        Everything the worker (and anything it runs) writes to stdout or
+        stderr goes to a temporary file, so that output from different
+        labels does not get mixed up.
+
+        Returns a tuple (pid, pipe_fd, output_filename), where 'pipe_fd' is
+        the read end of a pipe that gives end-of-file when the worker exits
+        (as for muddled.workers).
+        """
+        fd, output_filename = tempfile.mkstemp(prefix='muddle-build-')
+        pipe_fd, worker_pipe_fd = os.pipe()
+        # Write out our tags now, so that the worker doesn't write them too
+        self.db.sync_tags()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(fd)
+            os.close(worker_pipe_fd)
+            return pid, pipe_fd, output_filename
+
+        # We are the worker - we must not return from here
+        status = 1
+        try:
+            try:
+                # Don't let the commands we run keep our end of the pipe open
+                os.close(pipe_fd)
+                fcntl.fcntl(worker_pipe_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                os.dup2(fd, 1)
+                os.dup2(fd, 2)
+                os.close(fd)
+                self._build_rule(r)
+                status = 0
+            except GiveUp as e:
+                print e
+            except:
+                traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _finish_worker(self, r, output_filename, silent):
+        """
+        Report the output of the worker that built rule 'r'.
+        """
+        with open(output_filename) as fd:
+            output = fd.read()
+        os.remove(output_filename)
+        if not silent:
+            print "> Building %s"%(r.target)
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+    def _next_ready_rule(self, ready, running):
+        """
+        Remove and return the next rule in 'ready' that we may start.
+
+        'running' maps pipe fds to (pid, rule, output filename) for the rules
+        that are being built. If we have an artifact cache, we don't install
+        a package whilst another is being installed, so that we can tell
+        which package changed what in the install directory.
+
+        Returns None if we must wait before starting any of them.
+        """
+        installing = False
+        if artifact_cache() is not None:
+            for pid, r, output_filename in running.values():
+                if r.target.tag == LabelTag.Installed:
+                    installing = True
+                    break
+        for index, r in enumerate(ready):
+            if not (installing and r.target.tag == LabelTag.Installed and
+                    r.target.type == LabelType.Package):
+                return ready.pop(index)
+        return None
+
+    def build_labels_in_parallel(self, labels, jobs, silent=False):
+        """
+        Build the given labels, running up to 'jobs' builds at once.
+
+        The rules needed to build all of the labels are worked out from the
+        dependency graph, and each rule is built as soon as the rules for
+        everything it depends on have been built. Package labels are built
+        in worker processes, and the output from each is reported (in one
+        piece) when it finishes. Anything else is built in this process.
+
+        The tag for each label is set as soon as it has been built.
+
+        If a build fails, no more builds are started, but those already
+        running are allowed to finish. Then GiveUp is raised, naming the
+        first of 'labels' that could not be built (as building them one at
+        a time would), and what went wrong.
+        """
+        # Work out the rules to build, and which other rules (amongst them)
+        # each must wait for. Each rule waits for all the rules of the
+        # labels that the label it is first needed for depends on - since
+        # the plans are in build order, those have all been seen already.
+        labels = list(labels)
+        rules = []                      # in build order
+        waiting_for = {}                # rule -> number of rules to wait for
+        wanted_by = {}                  # rule -> rules waiting for it
+        label_rules = {}                # label -> its rules
+        requested_for = {}              # rule -> index of label it's built for
+        for index, label in enumerate(labels):
+            plan = depend.build_plan(self.ruleset, label,
+                                     useTags=True, useMatch=True)
+            if not plan:
+                print "There is no rule to build label %s"%label
+                continue
+            for lbl, lbl_rules, deps in plan:
+                if lbl in label_rules:
+                    continue
+                label_rules[lbl] = lbl_rules
+                needs = set()
+                for dep in deps:
+                    needs.update(label_rules[dep])
+                for r in sorted(lbl_rules, key=lambda r: r.target):
+                    if r in waiting_for:
+                        continue
+                    rules.append(r)
+                    requested_for[r] = index
+                    waiting_for[r] = len(needs)
+                    wanted_by[r] = []
+                    for n in needs:
+                        wanted_by[n].append(r)
+
+        self._prefetch_from_remote_cache(rules, jobs)
+        progress = BuildProgress(self, rules, jobs)
+
+        ready = [r for r in rules if waiting_for[r] == 0]
+        running = {}                    # pipe fd -> (pid, rule, output filename)
+        failed = []                     # the rules that failed
+        error = None
+
+        def done(r, report=False):
+            text = progress.done(r)
+            if report and text and not silent:
+                print text
+            for w in wanted_by[r]:
+                waiting_for[w] -= 1
+                if waiting_for[w] == 0:
+                    ready.append(w)
+
+        try:
+            while ready or running:
+                # Start everything we can, unless something has failed
+                while ready and not failed and len(running) < jobs:
+                    r = self._next_ready_rule(ready, running)
+                    if r is None:
+                        break
+                    if self.is_built(r.target):
+                        # Don't build stuff that's already built ..
+                        done(r)
+                    elif self.restore_from_cache(r.target, silent):
+                        self.set_built(r.target)
+                        done(r)
+                    elif self._build_in_worker(r):
+                        pid, pipe_fd, output_filename = self._start_worker(r)
+                        running[pipe_fd] = (pid, r, output_filename)
+                    else:
+                        if not silent:
+                            print "> Building %s"%(r.target)
+                        try:
+                            self._build_rule(r)
+                        except GiveUp as e:
+                            failed.append(r)
+                            error = e
+                            break
+                        self.set_built(r.target)
+                        done(r, report=True)
+
+                if failed:
+                    ready = []
+
+                if not running:
+                    continue
+
+                # Wait for one of our workers to finish. Each holds the write
+                # end of a pipe open until it exits, so we know it has
+                # finished when we get end-of-file on the read end.
+                readable, _, _ = select.select(running.keys(), [], [])
+                for pipe_fd in readable:
+                    if os.read(pipe_fd, 1):
+                        continue
+                    os.close(pipe_fd)
+                    pid, r, output_filename = running.pop(pipe_fd)
+                    wpid, status = os.waitpid(pid, 0)
+                    self._finish_worker(r, output_filename, silent)
+                    if status == 0:
+                        self.set_built(r.target)
+                        done(r, report=True)
+                    else:
+                        failed.append(r)
+        finally:
+            # If something unexpected went wrong, don't leave our workers
+            # (or their output) behind
+            for pipe_fd, (pid, r, output_filename) in running.items():
+                os.close(pipe_fd)
+                os.waitpid(pid, 0)
+                self._finish_worker(r, output_filename, silent)
+
+        if failed:
+            first = min(requested_for[r] for r in failed)
+            if len(failed) == 1 and error is not None:
+                why = error
+            else:
+                why = "Failed to build %s"%label_list_to_string(
+                                        [r.target for r in failed], join_with=', ')
+            raise GiveUp("Can't build %s - %s"%(labels[first], why))
 
     @property
     def build_name(self):
@@ -1488,40 +2168,77 @@ class Builder(object):
 
         self.default_deployment_labels.append(label)
 
+    def _environment_index(self):
+        """
+        Return our index of the environments in self.env.
+
+        This is a dictionary of label type -> label name -> list of tuples
+        (position, label, environment), where 'position' is the order in
+        which that label was found in self.env.
+
+        The index is rebuilt (and what we have remembered about particular
+        labels is forgotten) if self.env has changed.
+        """
+        generation = self.env.generation
+        if self._env_index is None or self._env_index[0] != generation:
+            index = {}
+            for position, (k, v) in enumerate(self.env.items()):
+                names = index.setdefault(k.type, {})
+                names.setdefault(k.name, []).append((position, k, v))
+            self._env_index = (generation, index)
+            self._env_lists = {}
+            self._env_merged = {}
+        return self._env_index[1]
+
     def list_environments_for(self, label):
         """
         Return a list of environments that contribute to the environment for
         the given label.
 
         Returns a list of triples (match level, label, environment), in order.
+
+        The answer is remembered until an environment is added to (or removed
+        from) self.env.
         """
-        to_apply = [ ]
+        index = self._environment_index()
 
-        for (k,v) in self.env.items():
+        if label in self._env_lists:
+            return list(self._env_lists[label])
+
+        candidates = []
+        for type in self._index_keys(index, label.type):
+            names = index[type]
+            for name in self._index_keys(names, label.name):
+                candidates.extend(names[name])
+
+        # Sort in order of match level, keeping environments at the same
+        # level in the order we found them in self.env
+        matched = []
+        for (position, k, v) in candidates:
             m = k.match(label)
             if (m is not None):
                 # We matched!
-                to_apply.append((m, k, v))
-
-        if len(to_apply) == 0:
-            # Nothing to do.
-            return [ ]
+                matched.append((m, position, k, v))
+        matched.sort()
 
-        # Now sort in order of first component
-        def bespoke_cmp(a,b):
-            (p,q,r) = a
-            (x,y,z) = b
-
-            if (p<x):
-                return -1
-            elif (p>x):
-                return 1
-            else:
-                return 0
-
-        to_apply.sort(bespoke_cmp)
-        return to_apply
+        to_apply = [(m, k, v) for (m, position, k, v) in matched]
+        # Remember a copy of the label, in case its domain gets changed
+        self._env_lists[label.copy()] = to_apply
+        return list(to_apply)
 
+    @staticmethod
+    def _index_keys(index, value):
+        """
+        Return the keys in 'index' that might match 'value'.
+        """
+        if value == '*':
+            return index.keys()
+        keys = []
+        if value in index:
+            keys.append(value)
+        if '*' in index:
+            keys.append('*')
+        return keys
 
     def get_environment_for(self, label):
         """
@@ -1541,15 +2258,25 @@ class Builder(object):
         Return an environment which embodies the settings that should be
         used for the given label. It's the in-order merge of the output
         of ``list_environments_for()``.
+
+        The merged environment is remembered until any of the environments
+        it was made from is changed, but the caller is given its own copy.
         """
         to_apply = self.list_environments_for(label)
+        stamp = [(env, env.generation) for (lvl, k, env) in to_apply]
+
+        if label in self._env_merged:
+            cached_stamp, a_store = self._env_merged[label]
+            if cached_stamp == stamp:
+                return a_store.copy()
 
         a_store = env_store.Store()
 
-        for (lvl, label, env) in to_apply:
+        for (lvl, k, env) in to_apply:
             a_store.merge(env)
 
-        return a_store
+        self._env_merged[label.copy()] = (stamp, a_store)
+        return a_store.copy()
 
 
     def setup_environment(self, label, src_env):
@@ -2011,6 +2738,7 @@ class BuildDescriptionAction(Action):
         checkout directory added to its start, so that the release_from()
         function itself can import things therefrom.
         """
+        start = time.time()
         setup = dynamic_load_build_desc(builder)
         checkout_dir = builder.db.get_checkout_path(builder.build_desc_label)
 
@@ -2026,6 +2754,9 @@ class BuildDescriptionAction(Action):
                          '  %s: %s'%(filename, a.__class__.__name__, a))
         finally:
             sys.path = old_path
+            trace.add_span('build description %s'%(builder.default_domain or
+                                                   '(top level)'),
+                           'load', start, time.time(), file=self.file_name)
 
 def run_release_from(builder, release_dir):
     """Run the build descriptions "release_from()" function.
@@ -2107,8 +2838,22 @@ def load_builder(root_path, muddle_binary, params=None, default_domain=None):
     * If given, 'default_domain' is the default domain name for this
       (sub) build tree. This is used by the "muddle unstamp" command,
       and the muddle_patch.py script.
+
+    When we are loading a top-level build tree (so neither 'params' nor
+    'default_domain' is given), we use the snapshot of the Builder in
+    .muddle/_builder_snapshot if it is still valid, and otherwise write a new
+    snapshot once we have loaded the build description. See
+    muddled.snapshot for more details.
     """
 
+    use_snapshot = (params is None and default_domain is None and
+                    snapshot.snapshots_enabled())
+    if use_snapshot:
+        muddled_dir = os.path.split(os.path.abspath(__file__))[0]
+        builder = snapshot.load_snapshot(root_path, muddle_binary, muddled_dir)
+        if builder is not None:
+            return builder
+
     builder = Builder(root_path, muddle_binary, params, default_domain=default_domain)
     can_load = builder._load_build_description()
     if not can_load:
@@ -2119,6 +2864,9 @@ def load_builder(root_path, muddle_binary, params=None, default_domain=None):
         release_spec_file = os.path.join(root_path, '.muddle', 'ReleaseSpec')
         builder.release_spec = ReleaseSpec.from_file(release_spec_file)
 
+    if use_snapshot:
+        snapshot.save_snapshot(builder)
+
     return builder
 
 
@@ -2249,6 +2997,10 @@ def _new_sub_domain(root_path, muddle_binary, domain_name, domain_repo, domain_b
         domain_builder = _init_without_build_tree(muddle_binary, domain_root_path,
                                                   domain_repo, domain_build_desc,
                                                   domain_params)
+        # A new subdomain keeps its tags in the same way as its parent
+        tag_store = parent_builder.db.tag_store()
+        if tag_store != domain_builder.db.tag_store():
+            domain_builder.db.change_tag_store(tag_store, verbose=False)
 
     # Then we need to tell all of the labels in that build that they're
     # actually in the new domain (this is the fun part(!))
@@ -2346,12 +3098,19 @@ def include_domain(builder, domain_name, domain_repo, domain_desc):
     ``include_domain()`` if necessary.
     """
 
-    domain_builder = _new_sub_domain(builder.db.root_path,
-                                     builder.muddle_binary,
-                                     domain_name,
-                                     domain_repo,
-                                     domain_desc,
-                                     parent_builder=builder)
+    # The subdomain's labels are about to have their domain changed, so they
+    # must not be shared with ours
+    with depend.NewLabelTable():
+        domain_builder = _new_sub_domain(builder.db.root_path,
+                                         builder.muddle_binary,
+                                         domain_name,
+                                         domain_repo,
+                                         domain_desc,
+                                         parent_builder=builder)
+
+    # From now on, we look after the subdomain's tags, so make sure that
+    # any it has set are written out
+    domain_builder.db.sync_tags()
 
     # And make sure we merge its rules into ours...
     builder.ruleset.merge(domain_builder.ruleset)
@@ -0,0 +1,237 @@
+"""
+Mirrors of remote git repositories, shared between build trees.
+
+If $MUDDLE_GIT_MIRRORS is set, it names a directory in which muddle keeps
+a bare mirror (as made by "git clone --mirror") of each remote git
+repository it clones or pulls from. The directory is typically per-user
+(for instance, ~/.muddle-git-mirrors) or per-host, and is shared by all
+the build trees (CI workspaces, developer sandboxes, and so on) on it.
+
+When a git checkout is checked out, its mirror is brought up to date
+first (creating it if necessary), and the checkout is then cloned with::
+
+    git clone --reference <mirror> --dissociate ...
+
+so that only the objects that are not already in the mirror are fetched
+from the remote repository. Because of "--dissociate", the new checkout
+does not depend on the mirror afterwards, so removing a mirror never
+breaks a build tree.
+
+When a git checkout is pulled, its mirror is brought up to date, and the
+checkout then fetches from the mirror before it fetches from the remote
+repository - which then has (almost) nothing left to send.
+
+Thus each remote repository is only downloaded once per mirror directory,
+however many build trees use it. Shallow checkouts do not use the mirrors,
+since the point of them is to avoid the history that a mirror would hold.
+
+If a mirror cannot be brought up to date (perhaps the remote repository
+cannot be reached), a warning is given, and muddle carries on without it.
+
+Mirrors that have not been used for a while can be removed with "muddle
+cache prune".
+
+The mirror directory contains, for each remote repository:
+
+* <name>-<hash>.git - the bare mirror, where <name> is the last part of
+  the repository URL, and <hash> is (part of) the SHA1 hash of the URL
+* <name>-<hash>.lock - used to stop two muddles changing the mirror at once.
+  This is left in place when the mirror is pruned.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import muddled.utils as utils
+from muddled.utils import GiveUp
+
+# The file (in each mirror) whose modification time says when it was last used
+LAST_USED_FILE = 'muddle-last-used'
+
+# By default, "muddle cache prune" removes mirrors not used for this many days
+DEFAULT_PRUNE_DAYS = 30
+
+def git_mirrors():
+    """Return the GitMirrors named by $MUDDLE_GIT_MIRRORS, or None.
+    """
+    mirrors_dir = os.environ.get('MUDDLE_GIT_MIRRORS')
+    if not mirrors_dir:
+        return None
+    return GitMirrors(os.path.abspath(os.path.expanduser(mirrors_dir)))
+
+def mirror_name(url):
+    """Return the name of the mirror directory for 'url'.
+
+    >>> mirror_name('https://example.com/git/linux.git')
+    'linux-93b2f85a4c14.git'
+    >>> mirror_name('file:///home/tibs/repos/busy box/')
+    'busy_box-3b5a1aaa4aaf.git'
+    """
+    leaf = url.rstrip('/').split('/')[-1]
+    if leaf.endswith('.git'):
+        leaf = leaf[:-4]
+    leaf = re.sub(r'[^A-Za-z0-9._-]', '_', leaf) or 'repo'
+    return '%s-%s.git'%(leaf, hashlib.sha1(url).hexdigest()[:12])
+
+class _Lock(object):
+    """An exclusive lock on a lock file, for use in a "with" statement.
+    """
+
+    def __init__(self, filename, wait=True):
+        self.filename = filename
+        self.wait = wait
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.filename, os.O_CREAT|os.O_RDWR, 0666)
+        flags = fcntl.LOCK_EX
+        if not self.wait:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.fd, flags)
+        except IOError as e:
+            os.close(self.fd)
+            self.fd = None
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    def __exit__(self, etype, value, tb):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class GitMirrors(object):
+    """
+    A directory of bare mirrors of remote git repositories.
+    """
+
+    def __init__(self, mirrors_dir):
+        self.mirrors_dir = mirrors_dir
+
+    def mirror_path(self, url):
+        """Return the path of the mirror for 'url' (which may not exist).
+        """
+        return os.path.join(self.mirrors_dir, mirror_name(url))
+
+    def _lock_path(self, path):
+        return '%s.lock'%os.path.splitext(path)[0]
+
+    def update(self, url, verbose=True):
+        """Bring the mirror for 'url' up to date, creating it if necessary.
+
+        Returns the path of the mirror, or None if it could not be updated
+        (in which case a warning has been printed).
+        """
+        path = self.mirror_path(url)
+        if not os.path.isdir(self.mirrors_dir):
+            try:
+                os.makedirs(self.mirrors_dir)
+            except OSError as e:
+                # Another muddle may have just made it
+                if not os.path.isdir(self.mirrors_dir):
+                    print 'Warning: cannot create git mirror directory %s: %s'%(
+                            self.mirrors_dir, e)
+                    return None
+
+        with _Lock(self._lock_path(path)):
+            if os.path.isdir(path):
+                cmd = ['git', '--git-dir=%s'%path, 'fetch', '--prune', 'origin']
+                rv, out = utils.run2(cmd, show_command=verbose)
+            else:
+                # Clone to a temporary name, so that an interrupted clone
+                # doesn't leave a partial mirror behind
+                tmp_path = tempfile.mkdtemp(dir=self.mirrors_dir, prefix='.tmp-')
+                cmd = ['git', 'clone', '--mirror', '--quiet', url, tmp_path]
+                rv, out = utils.run2(cmd, show_command=verbose)
+                if rv:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                else:
+                    os.rename(tmp_path, path)
+            if rv:
+                print 'Warning: cannot update git mirror of %s, so not using it\n%s'%(
+                        url, utils.indent(out.rstrip(), '    '))
+                return None
+            self._mark_used(path)
+        return path
+
+    def _mark_used(self, path):
+        with open(os.path.join(path, LAST_USED_FILE), 'w') as fd:
+            fd.write('%s\n'%time.ctime())
+
+    def _last_used(self, path):
+        """Return when the mirror at 'path' was last used, as a time.
+        """
+        try:
+            return os.stat(os.path.join(path, LAST_USED_FILE)).st_mtime
+        except OSError:
+            return os.stat(path).st_mtime
+
+    def _mirror_url(self, path):
+        rv, out = utils.run2(['git', '--git-dir=%s'%path, 'config',
+                              'remote.origin.url'], show_command=False)
+        if rv:
+            return '<unknown URL>'
+        return out.strip()
+
+    def mirrors(self):
+        """Return a list of (last used, path, url) for each of our mirrors.
+
+        The list is sorted by when each mirror was last used, oldest first.
+        """
+        if not os.path.isdir(self.mirrors_dir):
+            return []
+        result = []
+        for name in os.listdir(self.mirrors_dir):
+            path = os.path.join(self.mirrors_dir, name)
+            if name.endswith('.git') and os.path.isdir(path):
+                result.append((self._last_used(path), path, self._mirror_url(path)))
+        result.sort()
+        return result
+
+    def prune(self, days=DEFAULT_PRUNE_DAYS, dry_run=False):
+        """Remove the mirrors that have not been used for 'days' days.
+
+        Mirrors that another muddle is using at the moment are left alone.
+        If 'dry_run' is true, just report what would be removed.
+
+        Returns a list of (path, url) for the mirrors removed.
+        """
+        if days < 0:
+            raise GiveUp('Cannot prune mirrors not used for %s days'%days)
+        if not os.path.isdir(self.mirrors_dir):
+            # There is nothing to prune yet
+            return []
+        too_old = time.time() - days * 24 * 60 * 60
+        removed = []
+        for last_used, path, url in self.mirrors():
+            if last_used > too_old:
+                continue
+            lock_path = self._lock_path(path)
+            with _Lock(lock_path, wait=False) as locked:
+                if not locked:
+                    continue
+                if not dry_run:
+                    # Leave the lock file alone - another muddle may already
+                    # be waiting on it, and if we removed it, a third could
+                    # lock a new one at the same time
+                    shutil.rmtree(path)
+            removed.append((path, url))
+
+        if not dry_run:
+            # Tidy up after any clones that were interrupted
+            for name in os.listdir(self.mirrors_dir):
+                path = os.path.join(self.mirrors_dir, name)
+                if (name.startswith('.tmp-') and
+                        os.stat(path).st_mtime < too_old):
+                    shutil.rmtree(path, ignore_errors=True)
+        return removed
+
+# End file.
@@ -87,7 +87,7 @@ def extract_into_obj(inv, co_name, label, pkg_file):
     dpkg_cmd = ["dpkg-deb", "-X",
                 os.path.join(co_dir, pkg_file),
                 os.path.join(obj_dir, "obj")]
-    utils.run0(dpkg_cmd)
+    utils.run0(dpkg_cmd, env=inv.label_environment(label))
 
     # Now install any include or lib files ..
     installed_into = os.path.join(obj_dir, "obj")
@@ -146,6 +146,8 @@ class DebDevAction(PackageBuilder):
 
         utils.ensure_dir(os.path.join(inv.package_obj_path(label), "obj"))
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Actually install the dev package.
@@ -180,7 +182,8 @@ class DebDevAction(PackageBuilder):
                 co_path = inv.checkout_path(tmp)
                 with Directory(co_path):
                     utils.run0(["make", "-f", self.post_install_makefile,
-                                "%s-postinstall"%(label.name)])
+                                "%s-postinstall"%(label.name)],
+                               env=builder.label_environment(label))
 
             # .. and now we rewrite any pkgconfig etc. files left lying
             # about.
@@ -236,6 +239,8 @@ class DebAction(PackageBuilder):
         utils.ensure_dir(inv.package_install_path(label))
         utils.ensure_dir(inv.package_obj_path(label))
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Build the relevant label.
@@ -268,7 +273,7 @@ class DebAction(PackageBuilder):
             # Using dpkg doesn't work here for many reasons.
             dpkg_cmd = ["dpkg-deb", "-X", os.path.join(co_dir, self.pkg_file),
                         inst_dir]
-            utils.run0(dpkg_cmd)
+            utils.run0(dpkg_cmd, env=builder.label_environment(label))
 
             # Pick up any instructions that got left behind
             instr_file = self.instr_name
@@ -289,7 +294,8 @@ class DebAction(PackageBuilder):
                 co_path = inv.checkout_path(tmp)
                 with Directory(co_path):
                     utils.run0(["make", "-f", self.post_install_makefile,
-                                "%s-postinstall"%label.name])
+                                "%s-postinstall"%label.name],
+                               env=builder.label_environment(label))
         elif (tag == utils.LabelTag.Clean or tag == utils.LabelTag.DistClean):#
             inv = builder
             admin_dir = os.path.join(inv.package_obj_path(label))
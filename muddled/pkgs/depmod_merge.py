@@ -112,6 +112,8 @@ class MergeDepModBuilder(PackageBuilder):
         self.components.append( (label, subdir) )
 
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         our_dir = builder.package_obj_path(label)
 
@@ -159,7 +161,8 @@ class MergeDepModBuilder(PackageBuilder):
             for n in names:
                 if (our_re.match(n) is not None):
                     print "Found kernel version %s in %s .. "%(n, our_dir)
-                    utils.run0("%s -b %s %s"%(depmod, our_dir, n))
+                    utils.run0("%s -b %s %s"%(depmod, our_dir, n),
+                               env=builder.label_environment(label))
 
         elif (tag == utils.LabelTag.Installed):
             # Now we find all the modules.* files in our_dir and copy them over
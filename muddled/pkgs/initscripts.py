@@ -35,6 +35,8 @@ class InitScriptBuilder(pkg.PackageBuilder):
         self.write_setvars_sh = writeSetvarsSh
         self.write_setvars_py = writeSetvarsPy
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Install is the only one we care about ..
@@ -50,7 +52,8 @@ class InitScriptBuilder(pkg.PackageBuilder):
             utils.ensure_dir(tgt_dir)
             tgt_file = os.path.join(tgt_dir, self.script_name)
             print "> Writing %s .. "%(tgt_file)
-            subst.subst_file(src_file, tgt_file, None, os.environ)
+            subst.subst_file(src_file, tgt_file, None,
+                             builder.label_environment(label))
             os.chmod(tgt_file, 0755)
 
             # Write the setvars script
@@ -82,32 +82,35 @@ class MakeBuilder(PackageBuilder):
         utils.ensure_dir(builder.package_obj_path(co_label))
         utils.ensure_dir(builder.package_install_path(co_label))
 
-    def _amend_env(self, co_path):
-        """Amend the environment before building a label
+    def _amend_env(self, co_path, env):
+        """Amend the environment 'env' before building a label
         """
         # XXX Experimentally set MUDDLE_SRC for the "make" here, where we need it
-        os.environ["MUDDLE_SRC"] = co_path
+        env["MUDDLE_SRC"] = co_path
         # XXX
 
         # We really do want PKG_CONFIG_LIBDIR here - it prevents pkg-config
         # from finding system-installed packages.
         if (self.usesAutoconf):
-            #print "> setting PKG_CONFIG_LIBDIR to %s"%(os.environ['MUDDLE_PKGCONFIG_DIRS_AS_PATH'])
-            os.environ['PKG_CONFIG_LIBDIR'] = os.environ['MUDDLE_PKGCONFIG_DIRS_AS_PATH']
-        elif(os.environ.has_key('PKG_CONFIG_LIBDIR')):
+            #print "> setting PKG_CONFIG_LIBDIR to %s"%(env['MUDDLE_PKGCONFIG_DIRS_AS_PATH'])
+            env['PKG_CONFIG_LIBDIR'] = env['MUDDLE_PKGCONFIG_DIRS_AS_PATH']
+        elif(env.has_key('PKG_CONFIG_LIBDIR')):
             # Make sure that pkg-config uses default if we're not setting it.
             #print "> removing PKG_CONFIG_LIBDIR from environment"
-            del os.environ['PKG_CONFIG_LIBDIR']
+            del env['PKG_CONFIG_LIBDIR']
 
     def _make_command(self, builder, makefile_name):
         return ['make', '-f', makefile_name]
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """
         Build the relevant label. We'll assume that the
         checkout actually exists.
         """
         tag = label.tag
+        env = builder.label_environment(label)
 
         self.ensure_dirs(builder, label)
 
@@ -117,7 +120,7 @@ class MakeBuilder(PackageBuilder):
         tmp = Label(utils.LabelType.Checkout, self.co, domain=label.domain)
         co_path =  builder.db.get_checkout_path(tmp)
         with Directory(co_path):
-            self._amend_env(co_path)
+            self._amend_env(co_path, env)
 
             makefile_name = deduce_makefile_name(self.makefile_name,
                                                  self.per_role_makefiles,
@@ -131,11 +134,11 @@ class MakeBuilder(PackageBuilder):
             elif (tag == utils.LabelTag.Configured):
                 # We should probably do the configure thing ..
                 if (self.has_make_config):
-                    utils.run0(make_cmd + ["config"])
+                    utils.run0(make_cmd + ["config"], env=env)
             elif (tag == utils.LabelTag.Built):
-                utils.run0(make_cmd)
+                utils.run0(make_cmd, env=env)
             elif (tag == utils.LabelTag.Installed):
-                utils.run0(make_cmd + ["install"])
+                utils.run0(make_cmd + ["install"], env=env)
             elif (tag == utils.LabelTag.PostInstalled):
                 if (self.rewriteAutoconf):
                     #print "> Rewrite autoconf for label %s"%(label)
@@ -148,9 +151,9 @@ class MakeBuilder(PackageBuilder):
 
                     rewrite.fix_up_pkgconfig_and_la(builder, obj_path, execPrefix = sendExecPrefix)
             elif (tag == utils.LabelTag.Clean):
-                utils.run0(make_cmd + ["clean"])
+                utils.run0(make_cmd + ["clean"], env=env)
             elif (tag == utils.LabelTag.DistClean):
-                utils.run0(make_cmd + ["distclean"])
+                utils.run0(make_cmd + ["distclean"], env=env)
             else:
                 raise utils.MuddleBug("Invalid tag specified for "
                                   "MakePackage building %s"%(label))
@@ -374,6 +377,7 @@ class ExpandingMakeBuilder(MakeBuilder):
         # Since we're going to unpack into the obj/ directory, make sure we
         # have one
         self.ensure_dirs(builder, label)
+        env = builder.label_environment(label)
 
         try:
             # muddle 2
@@ -393,17 +397,19 @@ class ExpandingMakeBuilder(MakeBuilder):
         # Make sure to remove any previous unpacking of the archive
         dest_dir = os.path.join(obj_dir, self.archive_dir)
         if os.path.exists(dest_dir):
-            utils.run0(['rm', '-rf', dest_dir])
+            utils.run0(['rm', '-rf', dest_dir], env=env)
 
-        utils.run0(['tar', '-C', obj_dir, '-xf', archive_path])
+        utils.run0(['tar', '-C', obj_dir, '-xf', archive_path], env=env)
 
         # Ideally, we'd have unpacked the directory as obj/, so that we can
         # refer to it as $(MUDDLE_OBJ_OBJ). However, with a little cunning...
 
         with Directory(obj_dir):
-            utils.run0(['ln', '-sf', self.archive_dir, 'obj'],
+            utils.run0(['ln', '-sf', self.archive_dir, 'obj'], env=env,
                        show_command=True, show_output=True)
 
+    uses_label_environment = True
+
     def build_label(self, builder, label):
         """Build our label.
 
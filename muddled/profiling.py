@@ -0,0 +1,110 @@
+"""
+Profiling muddle itself.
+
+If muddle is run with "--profile" (or "--profile=cumulative" or
+"--profile=tottime"), then everything it does after reading its command
+line options is run under cProfile. When it finishes, the profile is
+written to muddle.prof in the current directory (for later inspection
+with the pstats module, or a tool such as snakeviz), and a summary is
+printed, giving:
+
+* the functions that took the most time, sorted by cumulative time (the
+  default) or by the time spent in the function itself ("tottime"), and
+* how much of the time was spent in each of the main phases of what
+  muddle does.
+
+Note that in a parallel build ("muddle build -j <n>"), the actions are run
+in separate processes, which are not profiled.
+"""
+
+import cProfile
+import os
+import pstats
+
+PROFILE_FILE = 'muddle.prof'
+
+# How many functions to report on
+PROFILE_TOP_N = 25
+
+SORT_KEYS = ('cumulative', 'tottime')
+
+_profiler = None
+_sort_by = None
+
+def start_profiling(sort_by='cumulative'):
+    """Start profiling.
+
+    'sort_by' says how the functions should be sorted in our report, and
+    must be one of SORT_KEYS.
+    """
+    global _profiler, _sort_by
+    _sort_by = sort_by
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+def finish_profiling():
+    """Stop profiling, write out the profile and report on it.
+
+    Does nothing if we are not profiling.
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.disable()
+    profiler, _profiler = _profiler, None
+
+    filename = os.path.join(os.getcwd(), PROFILE_FILE)
+    profiler.dump_stats(filename)
+
+    stats = pstats.Stats(profiler)
+    print
+    print 'Profile (sorted by %s) written to %s'%(_sort_by, filename)
+    print
+    stats.sort_stats(_sort_by).print_stats(PROFILE_TOP_N)
+    _report_phases(stats)
+
+def _phase_functions():
+    """Return a list of the phases we report on.
+
+    Each phase is a tuple of (description, functions), and the time for a
+    phase is the sum of the cumulative times of its functions. We import
+    the modules concerned here, rather than at the top of this module, so
+    that importing this module doesn't import (most of) muddle.
+    """
+    from muddled.depend import RuleSet, build_plan
+    from muddled.mechanics import Builder, BuildDescriptionAction
+    from muddled.snapshot import load_snapshot
+    from muddled.version_control import VersionControlHandler
+    # The VersionControlHandler operations are all wrapped by the same
+    # function (see muddled.version_control._traced_operation), so timing
+    # any one of them times them all
+    return [('Loading the builder snapshot', [load_snapshot]),
+            ('Loading build descriptions', [BuildDescriptionAction.build_label]),
+            ('Constructing the rule set', [RuleSet.add, RuleSet.unify]),
+            ('Planning what to build', [build_plan]),
+            ('Running actions', [Builder._build_rule]),
+            ('Version control operations', [VersionControlHandler.pull]),
+           ]
+
+def _report_phases(stats):
+    """Report on how long each of our phases took.
+    """
+    total = stats.total_tt
+    print 'Time spent in each phase (phases may be part of each other -'
+    print 'for instance, the build description constructs most of the rule set,'
+    print 'and is itself loaded by running an action):'
+    print
+    print '%10s %6s  %s'%('Seconds', '%', 'Phase')
+    for description, functions in _phase_functions():
+        seconds = 0.0
+        for fn in functions:
+            code = getattr(fn, 'im_func', fn).func_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if key in stats.stats:
+                primitive_calls, calls, tottime, cumtime, callers = stats.stats[key]
+                seconds += cumtime
+        percent = 100.0 * seconds / total if total else 0.0
+        print '%10.3f %5.1f%%  %s'%(seconds, percent, description)
+    print '%10.3f %5.1f%%  %s'%(total, 100.0, 'Total')
+
+# End file.
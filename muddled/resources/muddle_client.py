@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+"""A quick stand-in for muddle, for use as $(MUDDLE) in muddle Makefiles.
+
+    $ muddle_client.py <muddle> <muddle arguments> ...
+
+If the arguments are a "muddle query" command, and "muddle server" is
+running for the build tree we are in, then the server is asked to run the
+query, and we output whatever it says. Otherwise (or if the server cannot
+be reached) we just run <muddle> with the arguments.
+
+Muddle sets $(MUDDLE) to use this when "muddle server" is running. It
+deliberately only imports things from the Python standard library, so that
+it starts up as quickly as possible.
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+
+# Where "muddle server" listens, within .muddle/
+SOCKET_FILE = '_server.sock'
+
+def find_socket(dir):
+    """Return the server socket for the build tree containing 'dir'.
+
+    We look for the first directory (going upwards) with a .muddle/ directory
+    that is not a subdomain. Returns None if there is no such directory.
+    """
+    dir = os.path.normpath(dir)
+    while True:
+        dot_muddle = os.path.join(dir, '.muddle')
+        if os.path.isdir(dot_muddle) and \
+           not os.path.exists(os.path.join(dot_muddle, 'am_subdomain')):
+            return os.path.join(dot_muddle, SOCKET_FILE)
+        parent = os.path.dirname(dir)
+        if parent == dir:
+            return None
+        dir = parent
+
+def ask_server(socket_name, args):
+    """Ask the server to run "muddle <args>".
+
+    We send a JSON request, and the server replies with a line containing
+    the exit status, followed by whatever the command output.
+
+    Returns (status, output), or None if the server did not answer (or
+    replied "fallback", asking us to run muddle ourselves).
+    """
+    try:
+        request = json.dumps({'args' : args,
+                              'cwd' : os.getcwd(),
+                              'env' : dict(os.environ),
+                             })
+    except ValueError:          # for instance, not UTF-8
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_name)
+            sock.sendall(request.encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            parts = []
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                parts.append(data)
+        except socket.error as e:
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED, errno.ECONNRESET,
+                           errno.EPIPE):
+                return None
+            raise
+    finally:
+        sock.close()
+
+    response = b''.join(parts)
+    status, newline, output = response.partition(b'\n')
+    if not newline or not status.isdigit():
+        return None
+    return int(status), output
+
+def main(args):
+    if not args:
+        print(__doc__)
+        return 2
+    muddle, args = args[0], args[1:]
+
+    if args and args[0] == 'query':
+        socket_name = find_socket(os.getcwd())
+        if socket_name and os.path.exists(socket_name):
+            answer = ask_server(socket_name, args)
+            if answer is not None:
+                status, output = answer
+                stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+                stdout.write(output)
+                stdout.flush()
+                return status
+
+    os.execv(muddle, [muddle] + args)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
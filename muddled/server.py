@@ -0,0 +1,248 @@
+"""
+A server that keeps a loaded Builder, so that it can answer queries quickly.
+
+This is what "muddle server" runs. It listens on a Unix domain socket,
+.muddle/_server.sock, for requests from the muddle_client.py resource, which
+muddle Makefiles use as $(MUDDLE) whilst the server is running.
+
+Each request is a JSON object of the form::
+
+    {"args": [<word>, ...], "cwd": <directory>, "env": {<name>: <value>, ...}}
+
+which asks for "muddle <word> ..." to be run in that directory with that
+environment. The reply is a line containing the exit status, followed by the
+output of the command, or just a line saying "fallback", which asks the
+client to run muddle itself.
+
+Each request is run in a forked copy of the server, so that nothing a
+command does (changing directory, altering the Builder) affects the next.
+Before each request, we check whether the build descriptions have changed
+(using the same key as muddled.snapshot), and if they have we load the
+build tree again.
+"""
+
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+
+import muddled.mechanics as mechanics
+import muddled.snapshot as snapshot
+
+from muddled.utils import GiveUp, MuddleBug, ShellError
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+def _as_str(value):
+    """JSON gives us unicode strings, but muddle works with (UTF-8) str
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+class QueryServer(object):
+    """
+    Keep a loaded Builder, and use it to run commands sent by clients.
+
+    'run_command' is called (in a child process) to run each command, as::
+
+        run_command(builder, args, current_dir, env)
+
+    It should raise GiveUp if the command is not one the server should
+    be running.
+    """
+
+    def __init__(self, builder, run_command):
+        self.builder = builder
+        self.run_command = run_command
+        self.root_path = builder.db.root_path
+        self.muddle_binary = builder.muddle_binary
+        self.socket_name = builder.db.query_server_socket_name()
+        self.key = snapshot.builder_key(builder)
+
+    def _remove_stale_socket(self):
+        """
+        Remove our socket if it was left behind by a server that has gone.
+        """
+        if not os.path.exists(self.socket_name):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_name)
+        except socket.error:
+            os.remove(self.socket_name)
+            return
+        finally:
+            sock.close()
+        raise GiveUp('"muddle server" is already running for %s'%self.root_path)
+
+    def serve(self):
+        """
+        Answer requests until we are interrupted or terminated.
+        """
+        self._remove_stale_socket()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.socket_name)
+        except socket.error as e:
+            listener.close()
+            raise GiveUp('Cannot listen on %s\n%s'%(self.socket_name, e))
+
+        old_handler = signal.signal(signal.SIGTERM, _stop)
+        try:
+            listener.listen(socket.SOMAXCONN)
+            print 'Serving queries for %s'%self.root_path
+            print 'Use Ctrl-C (or kill %d) to stop'%os.getpid()
+            sys.stdout.flush()
+            while True:
+                try:
+                    conn, addr = listener.accept()
+                except socket.error as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self._answer(conn)
+                except socket.error as e:
+                    print 'Error talking to client: %s'%e
+                finally:
+                    conn.close()
+        except (KeyboardInterrupt, SystemExit):
+            print
+        finally:
+            signal.signal(signal.SIGTERM, old_handler)
+            listener.close()
+            os.remove(self.socket_name)
+        print 'Stopped serving queries for %s'%self.root_path
+
+    def _check_builder(self):
+        """
+        Load the build tree again if its build descriptions have changed.
+
+        If that fails, we have no Builder until the next change.
+        """
+        if self.builder is not None:
+            try:
+                key = snapshot.builder_key(self.builder)
+            except Exception:
+                key = None
+            if key == self.key:
+                return
+
+        print 'Loading the build description again'
+        sys.stdout.flush()
+        self.builder = None
+        try:
+            builder = mechanics.load_builder(self.root_path, self.muddle_binary)
+        except GiveUp as e:
+            print 'Unable to reload build description:\n%s'%e
+            return
+        if builder is None:
+            print 'Unable to reload build description'
+            return
+        self.builder = builder
+        self.key = snapshot.builder_key(builder)
+
+    def _answer(self, conn):
+        """
+        Read a request from 'conn', and send back our answer.
+        """
+        conn.settimeout(60)
+        parts = []
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            parts.append(data)
+        if not parts:
+            # Someone checking if we are still here
+            return
+        try:
+            request = json.loads(''.join(parts))
+            args = [_as_str(word) for word in request['args']]
+            current_dir = _as_str(request['cwd'])
+            env = dict((_as_str(k), _as_str(v)) for k, v in request['env'].items())
+        except (ValueError, KeyError, TypeError, AttributeError):
+            conn.sendall('fallback\n')
+            return
+
+        self._check_builder()
+        if self.builder is None:
+            # Let muddle itself report the problem
+            conn.sendall('fallback\n')
+            return
+
+        status, output = self._run(args, current_dir, env)
+        conn.sendall('%d\n%s'%(status, output))
+
+    def _run(self, args, current_dir, env):
+        """
+        Run the command given by 'args' in a child process.
+
+        Returns a tuple (status, output).
+        """
+        fd, output_filename = tempfile.mkstemp(prefix='muddle-query-')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(fd)
+            pid, status = os.waitpid(pid, 0)
+            with open(output_filename) as f:
+                output = f.read()
+            os.remove(output_filename)
+            if os.WIFEXITED(status):
+                return os.WEXITSTATUS(status), output
+            else:
+                return 1, output
+
+        # We are the child - we must not return from here
+        status = 1
+        try:
+            try:
+                null = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(null, 0)
+                os.close(null)
+                os.dup2(fd, 1)
+                os.dup2(fd, 2)
+                os.close(fd)
+
+                # As muddle itself does, believe $PWD if it is (a different
+                # name for) the directory we are in
+                shell_dir = env.get('PWD')
+                if shell_dir and shell_dir != current_dir and \
+                   os.path.isdir(shell_dir) and \
+                   os.path.samefile(shell_dir, current_dir):
+                    current_dir = shell_dir
+                os.chdir(current_dir)
+                os.environ = env
+
+                self.run_command(self.builder, args, current_dir, env.copy())
+                status = 0
+            except (MuddleBug, ShellError) as e:
+                # As in the muddle script, these give a full traceback
+                print
+                print e
+                traceback.print_exc()
+                status = e.retcode
+            except GiveUp as e:
+                text = str(e)
+                if text:
+                    print
+                    print text
+                status = e.retcode
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except:
+                traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+# End file.
@@ -0,0 +1,251 @@
+"""
+Snapshots of loaded Builders, so that muddle can start up quickly.
+
+Loading a build tree means running its build description (and those of all
+its subdomains), which can take a noticeable time. Since muddle Makefiles
+tend to do "$(MUDDLE) query" many times over, we remember the Builder as it
+was once it had been loaded, in .muddle/_builder_snapshot, and use that
+instead whilst it is still valid. We also remember the few things a build
+description can change outside the Builder (see MODULE_STATE).
+
+A snapshot is keyed by the content of:
+
+* the build description checkout of each domain (all of the files therein,
+  except those belonging to the VCS, so that anything imported by a build
+  description is included),
+* the files in each domain's .muddle directory that say which build
+  description to use, and whether this is a release build, and
+* muddle's own source files, so that a new muddle does not try to use a
+  Builder pickled by an old one.
+
+Note that this assumes a build description only depends upon the files in
+its checkout. A build description that (for instance) looks at environment
+variables should set $MUDDLE_NO_SNAPSHOT, which stops muddle using (or
+writing) snapshots.
+"""
+
+import cPickle
+import errno
+import hashlib
+import os
+import sys
+
+import muddled.utils as utils
+
+# The name of our snapshot file, within .muddle
+SNAPSHOT_FILE = '_builder_snapshot'
+
+# Increment this if the layout of the snapshot file changes
+SNAPSHOT_VERSION = 1
+
+# The files in a (sub)domain's .muddle directory that affect loading it
+DOMAIN_FILES = ('Description', 'RootRepository', 'DescriptionBranch',
+                'VersionsRepository', 'Release', 'ReleaseSpec', 'am_subdomain')
+
+# Directories that belong to a VCS, rather than to a build description
+VCS_DIRS = ('.git', '.hg', '.bzr', '.svn')
+
+# Dictionaries outside the Builder that a build description may change, as
+# (module name, attribute name). We update these in place when restoring
+# them, since other modules may have imported them by name.
+MODULE_STATE = (('muddled.distribute', 'the_distributions'),
+               )
+
+# What pickle raises for something it cannot pickle (a lambda, say, or an
+# open file), as well as the errors we may get writing the snapshot
+SAVE_ERRORS = (cPickle.PicklingError, TypeError, IOError, OSError)
+
+# What we may get reading a snapshot that is truncated or otherwise corrupt,
+# or that refers to a build description module that no longer loads
+LOAD_ERRORS = (cPickle.UnpicklingError, EOFError, ValueError, KeyError,
+               IndexError, ImportError, AttributeError, IOError, OSError,
+               utils.GiveUp)
+
+# The hash of muddle's own source files, worked out (at most) once
+_muddle_hash = None
+
+def snapshots_enabled():
+    """Should we use (and write) snapshots?
+    """
+    return not os.environ.get('MUDDLE_NO_SNAPSHOT')
+
+def snapshot_file_name(root_path):
+    return os.path.join(root_path, '.muddle', SNAPSHOT_FILE)
+
+def _hash_file(hasher, path):
+    """Add the name and content of file 'path' to 'hasher'.
+    """
+    hasher.update('%s\0'%path)
+    try:
+        with open(path, 'rb') as fd:
+            hasher.update(fd.read())
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        hasher.update('\0<no such file>')
+    hasher.update('\0')
+
+def _hash_tree(hasher, path, wanted=None):
+    """Add the names and content of the files under 'path' to 'hasher'.
+
+    If 'wanted' is given, only filenames that it returns true for are used.
+    Directories belonging to a VCS are ignored, as are compiled Python files.
+    """
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in VCS_DIRS)
+        for name in sorted(filenames):
+            if name.endswith('.pyc') or name.endswith('.pyo'):
+                continue
+            if wanted is None or wanted(name):
+                _hash_file(hasher, os.path.join(dirpath, name))
+
+def _muddle_version(muddled_dir):
+    """Return a hash of muddle's own source files.
+    """
+    global _muddle_hash
+    if _muddle_hash is None:
+        hasher = hashlib.md5()
+        _hash_tree(hasher, muddled_dir, lambda name: name.endswith('.py'))
+        _muddle_hash = hasher.hexdigest()
+    return _muddle_hash
+
+def _snapshot_key(root_path, muddle_binary, muddled_dir, domains):
+    """Work out the key for a snapshot.
+
+    'domains' is a sequence of (domain_name, build_desc_checkout_dir).
+    """
+    hasher = hashlib.md5()
+    hasher.update('%s\0%s\0%s\0'%(root_path, muddle_binary, muddled_dir))
+    hasher.update(_muddle_version(muddled_dir))
+    for domain_name, checkout_dir in domains:
+        domain_dir = os.path.join(root_path, utils.domain_subpath(domain_name),
+                                  '.muddle')
+        for name in DOMAIN_FILES:
+            _hash_file(hasher, os.path.join(domain_dir, name))
+        if not os.path.isdir(checkout_dir):
+            hasher.update('%s\0<no such directory>\0'%checkout_dir)
+        _hash_tree(hasher, checkout_dir)
+    return hasher.hexdigest()
+
+def _build_desc_modules(builder, domains):
+    """Return a dictionary of the modules for our build descriptions.
+
+    It maps the module name (as chosen by utils.dynamic_load) to the build
+    description's filename and checkout directory.
+    """
+    modules = {}
+    for domain_name, checkout_dir in domains:
+        domain_root = os.path.join(builder.db.root_path,
+                                   utils.domain_subpath(domain_name))
+        description = os.path.join(domain_root, '.muddle', 'Description')
+        with open(description) as fd:
+            filename = os.path.join(domain_root, 'src', fd.readline().strip())
+        with open(filename, 'rb') as fd:
+            module_name = hashlib.md5(fd.read()).hexdigest()
+        modules[module_name] = (filename, checkout_dir)
+    return modules
+
+def _module(name):
+    __import__(name)
+    return sys.modules[name]
+
+def _builder_domains(builder):
+    """Return a list of (domain_name, build_desc_checkout_dir) for 'builder'.
+    """
+    db = builder.db
+    domains = []
+    for domain_name, label in sorted(db.domain_build_desc_label.items()):
+        domains.append((domain_name, db.get_checkout_path(label)))
+    return domains
+
+def builder_key(builder):
+    """Return the key for a snapshot of the (loaded) Builder 'builder'.
+
+    If this changes, then loading the build tree again would (or at least
+    might) give a different Builder.
+    """
+    return _snapshot_key(builder.db.root_path, builder.muddle_binary,
+                         builder.muddled_dir, _builder_domains(builder))
+
+def save_snapshot(builder):
+    """Write a snapshot of the (just loaded) Builder 'builder'.
+
+    If the Builder cannot be pickled (for instance, because its build
+    description uses lambdas in its actions), we just don't write a snapshot.
+    """
+    db = builder.db
+    domains = _builder_domains(builder)
+
+    header = {'version' : SNAPSHOT_VERSION,
+              'key' : _snapshot_key(db.root_path, builder.muddle_binary,
+                                    builder.muddled_dir, domains),
+              'domains' : domains,
+              'modules' : _build_desc_modules(builder, domains),
+             }
+
+    # Write a new file and then rename it, so that a muddle running at the
+    # same time never sees a partial snapshot
+    filename = snapshot_file_name(db.root_path)
+    temp_filename = '%s.%d'%(filename, os.getpid())
+    try:
+        with open(temp_filename, 'wb') as fd:
+            cPickle.dump(header, fd, cPickle.HIGHEST_PROTOCOL)
+            module_state = [getattr(_module(module_name), name)
+                            for module_name, name in MODULE_STATE]
+            cPickle.dump((builder, module_state), fd, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_filename, filename)
+    except SAVE_ERRORS:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        # And make sure we don't leave an out-of-date snapshot behind
+        if os.path.exists(filename):
+            os.remove(filename)
+
+def load_snapshot(root_path, muddle_binary, muddled_dir):
+    """Return the Builder from our snapshot, if it is still valid.
+
+    Returns None if there is no snapshot, or it is out-of-date, or it cannot
+    be read.
+    """
+    try:
+        fd = open(snapshot_file_name(root_path), 'rb')
+    except IOError:
+        return None
+
+    with fd:
+        try:
+            header = cPickle.load(fd)
+            if header.get('version') != SNAPSHOT_VERSION:
+                return None
+            key = _snapshot_key(root_path, muddle_binary, muddled_dir,
+                                header['domains'])
+            if key != header['key']:
+                return None
+
+            # As loading the build descriptions would, make sure that they
+            # can import things from their checkouts
+            for domain_name, checkout_dir in header['domains']:
+                if checkout_dir not in sys.path:
+                    sys.path.insert(0, checkout_dir)
+
+            modules = header['modules']
+            def find_global(module_name, name):
+                # Classes (and so on) from a build description live in a
+                # module that only exists once the build description is read
+                if module_name not in sys.modules and module_name in modules:
+                    filename, checkout_dir = modules[module_name]
+                    utils.dynamic_load(filename)
+                return getattr(_module(module_name), name)
+
+            unpickler = cPickle.Unpickler(fd)
+            unpickler.find_global = find_global
+            builder, module_state = unpickler.load()
+            for (module_name, name), value in zip(MODULE_STATE, module_state):
+                current = getattr(_module(module_name), name)
+                current.clear()
+                current.update(value)
+            return builder
+        except LOAD_ERRORS:
+            return None
+
+# End file.
@@ -0,0 +1,134 @@
+"""
+Tracing what muddle spends its time doing.
+
+If muddle is run with "--trace <file>", then it writes a record of the
+phases of what it did, and how long each took, to <file>, in the Chrome
+Trace Event Format. This can be loaded into a trace viewer (for instance,
+chrome://tracing in Chrome, or https://ui.perfetto.dev/) to show what
+was happening when.
+
+The phases recorded include importing muddle itself, loading the builder,
+running the build description for each domain, working out what needs
+building, building each label, each command run via muddled.utils, and
+each VCS operation on a checkout.
+
+Each phase is written out as a "complete" event as soon as it ends, with
+one event per line, so that build processes forked by a parallel build can
+add to the same file (they appear as separate processes in the viewer). The
+file is a JSON array of events - if muddle is interrupted, the closing "]"
+will be missing, which trace viewers allow.
+"""
+
+import json
+import os
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+# When this module was first imported, which muddled/__init__.py arranges
+# is before the rest of muddle is imported
+IMPORT_START = time.time()
+
+_trace_fd = None                # the file we are writing to, if any
+_trace_pid = None               # the process that started tracing
+_named_pids = set()             # processes we have named in the trace
+
+def tracing():
+    """Are we writing out a trace?
+    """
+    return _trace_fd is not None
+
+def start_tracing(file_name, process_name='muddle'):
+    """Start writing a trace to 'file_name'.
+
+    'process_name' is how the trace viewer should describe this process.
+    """
+    global _trace_fd, _trace_pid
+    _trace_fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                                   os.O_APPEND, 0644)
+    _trace_pid = os.getpid()
+    _named_pids.clear()
+    _named_pids.add(_trace_pid)
+    os.write(_trace_fd, '[\n%s'%json.dumps(_process_name(_trace_pid,
+                                                          process_name)))
+
+def finish_tracing():
+    """Finish writing our trace.
+
+    Does nothing if we are not tracing, or if we are not the process that
+    started it (for instance, if we are a forked build process).
+    """
+    global _trace_fd
+    if _trace_fd is None or os.getpid() != _trace_pid:
+        return
+    os.write(_trace_fd, '\n]\n')
+    os.close(_trace_fd)
+    _trace_fd = None
+
+def add_span(name, category, start, end, **args):
+    """Add a phase called 'name' that ran from 'start' to 'end'.
+
+    'start' and 'end' are times as returned by time.time(). 'category' is
+    a short word describing what sort of phase this is (the trace viewer
+    can select phases by category), and any other keyword arguments are
+    shown as details of the phase.
+    """
+    if _trace_fd is None:
+        return
+    pid = os.getpid()
+    event = {'name' : name, 'cat' : category, 'ph' : 'X',
+             'ts' : int(start * 1000000), 'dur' : int((end - start) * 1000000),
+             'pid' : pid, 'tid' : 0}
+    if args:
+        event['args'] = dict((key, str(value)) for key, value in args.items())
+    text = ',\n%s'%json.dumps(event)
+    if pid not in _named_pids:
+        _named_pids.add(pid)
+        text = ',\n%s%s'%(json.dumps(_process_name(pid, 'muddle %d'%pid)), text)
+    # A single write, so that processes writing at the same time don't
+    # get mixed up
+    os.write(_trace_fd, text)
+
+@contextmanager
+def span(name, category, **args):
+    """Record the phase that runs inside a 'with' statement.
+
+    For instance::
+
+        with span('load_builder', 'load'):
+            builder = load_builder(...)
+
+    The arguments are as for add_span().
+    """
+    if _trace_fd is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, category, start, time.time(), **args)
+
+def traced(category, name=None):
+    """A decorator to record each call of a function as a phase.
+
+    The phase is called 'name', or by the function's name if that is not
+    given.
+    """
+    def decorator(fn):
+        phase_name = name or fn.__name__
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace_fd is None:
+                return fn(*args, **kwargs)
+            with span(phase_name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _process_name(pid, name):
+    return {'name' : 'process_name', 'ph' : 'M', 'pid' : pid, 'tid' : 0,
+            'args' : {'name' : name}}
+
+# End file.
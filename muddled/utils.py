@@ -3,6 +3,7 @@ Muddle utilities.
 """
 
 import errno
+import functools
 import hashlib
 import imp
 import os
@@ -27,6 +28,8 @@ from fnmatch import fnmatchcase
 from ConfigParser import RawConfigParser
 from StringIO import StringIO
 
+import muddled.trace as trace
+
 try:
     import curses
 except:
@@ -508,7 +511,12 @@ def ensure_dir(dir, verbose=True):
     else:
         if verbose:
             print "> Make directory %s"%dir
-        os.makedirs(dir)
+        try:
+            os.makedirs(dir)
+        except OSError as e:
+            # Another build job may have made it since we looked
+            if e.errno != errno.EEXIST or not os.path.isdir(dir):
+                raise
 
 def pad_to(str, val, pad_with = " "):
     """
@@ -548,6 +556,29 @@ def iso_time():
     """
     return time.strftime("%Y-%m-%d %H:%M:%S")
 
+def format_duration(seconds):
+    """
+    Return a duration, in seconds, in a form suitable for people to read.
+
+    >>> format_duration(0.25)
+    '0.2s'
+    >>> format_duration(75)
+    '1m 15s'
+    >>> format_duration(2*60*60 + 3*60 + 9)
+    '2h 3m'
+    """
+    if seconds < 10:
+        return '%.1fs'%seconds
+    seconds = int(round(seconds))
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%dh %dm'%(hours, minutes)
+    elif minutes:
+        return '%dm %ds'%(minutes, seconds)
+    else:
+        return '%ds'%seconds
+
 def current_user():
     """
     Return the identity of the current user, as an email address if possible,
@@ -620,6 +651,42 @@ def _rationalise_cmd(thing):
     return thing
 
 
+def _command_env(env):
+    """Return the environment to run a command with.
+
+    If 'env' is None, this is os.environ.
+
+    The current directory belongs to the whole process, and the Directory
+    classes keep os.environ['PWD'] up to date with it. An environment passed
+    to us was probably made before we changed directory, so if its PWD does
+    not agree, we return a copy with PWD put right.
+    """
+    if env is None: # so, for instance, an empty dictionary is allowed
+        return os.environ
+    pwd = os.environ.get('PWD')
+    if pwd is not None and env.get('PWD', pwd) != pwd:
+        env = dict(env)
+        env['PWD'] = pwd
+    return env
+
+def _traced_command(fn):
+    """A decorator to record the commands that 'fn' runs in any trace.
+
+    See muddled.trace. Each command is recorded as a phase named after the
+    program it runs.
+    """
+    @functools.wraps(fn)
+    def wrapper(thing, *args, **kwargs):
+        if not trace.tracing():
+            return fn(thing, *args, **kwargs)
+        words = thing.split() if isinstance(thing, basestring) else thing
+        name = os.path.basename(str(words[0])) if words else '(nothing)'
+        with trace.span(name, 'command', command=_stringify_cmd(thing),
+                        directory=os.getcwd(), via=fn.__name__):
+            return fn(thing, *args, **kwargs)
+    return wrapper
+
+@_traced_command
 def shell(thing, env=None, show_command=True):
     """Run the command 'thing' in the shell.
 
@@ -658,15 +725,15 @@ def shell(thing, env=None, show_command=True):
         thing = _stringify_cmd(thing)
     if show_command:
         sys.stdout.write('> %s\n'%thing)
-    if env is None: # so, for instance, an empty dictionary is allowed
-        env = os.environ
+    env = _command_env(env)
     try:
-        subprocess.check_call(thing, shell=True)
+        subprocess.check_call(thing, shell=True, env=env)
     except subprocess.CalledProcessError as e:
         # Unfortunately, e.output will actually be None, since it is only
         # populated for check_output.
         raise ShellError(thing, e.returncode, e.output)
 
+@_traced_command
 def get_cmd_data(thing, env=None, show_command=False):
     """Run the command 'thing', and return its output.
 
@@ -688,8 +755,7 @@ def get_cmd_data(thing, env=None, show_command=False):
     thing = _rationalise_cmd(thing)
     if show_command:
         sys.stdout.write('> %s\n'%_stringify_cmd(thing))
-    if env is None: # so, for instance, an empty dictionary is allowed
-        env = os.environ
+    env = _command_env(env)
     try:
         return subprocess.check_output(thing, env=env)
     except subprocess.CalledProcessError as e:
@@ -752,6 +818,7 @@ def run1(thing, env=None, show_command=True, show_output=False):
     else:
         raise ShellError(cmd=_stringify_cmd(thing), retcode=rc, output=output)
 
+@_traced_command
 def run2(thing, env=None, show_command=True, show_output=False):
     """Run the command 'thing', returning the return code and output.
 
@@ -779,8 +846,7 @@ def run2(thing, env=None, show_command=True, show_output=False):
     if show_command:
         sys.stdout.write('> %s\n'%_stringify_cmd(thing))
         sys.stdout.flush()
-    if env is None: # so, for instance, an empty dictionary is allowed
-        env = os.environ
+    env = _command_env(env)
     text = []
     proc = subprocess.Popen(thing, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     for data in proc.stdout:
@@ -793,6 +859,7 @@ def run2(thing, env=None, show_command=True, show_output=False):
     text = ''.join(text)
     return proc.returncode, text
 
+@_traced_command
 def run3(thing, env=None, show_command=True, show_output=False):
     """Run the command 'thing', returning the return code, stdout and stderr.
 
@@ -822,8 +889,7 @@ def run3(thing, env=None, show_command=True, show_output=False):
     thing = _rationalise_cmd(thing)
     if show_command:
         sys.stdout.write('> %s\n'%_stringify_cmd(thing))
-    if env is None: # so, for instance, an empty dictionary is allowed
-        env = os.environ
+    env = _command_env(env)
     all_stdout_text = []
     all_stderr_text = []
     proc = subprocess.Popen(thing, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -975,6 +1041,28 @@ def truncate(text, columns=None, less=0):
     return text
 
 
+def _load_module_source(name, filename, contents):
+    """Load module 'name' from the source text 'contents' of 'filename'.
+
+    This is what imp.load_source() does, except that we always compile the
+    source we were given. imp.load_source() uses a .pyc if its recorded
+    modification time matches that of the source, which it only does to the
+    nearest second - and since muddle can load a build tree more than once
+    a second (for instance, after pulling a new build description), that
+    .pyc may be out of date. This also means that we don't leave .pyc files
+    in the build description checkout.
+    """
+    code = compile(contents, filename, 'exec')
+    module = imp.new_module(name)
+    module.__file__ = filename
+    sys.modules[name] = module
+    try:
+        exec code in module.__dict__
+    except:
+        del sys.modules[name]
+        raise
+    return sys.modules[name]
+
 def dynamic_load(filename):
     try:
         try:
@@ -988,7 +1076,7 @@ def dynamic_load(filename):
         hasher = hashlib.md5()
         hasher.update(contents)
         md5_digest = hasher.hexdigest()
-        return imp.load_source(md5_digest, filename)
+        return _load_module_source(md5_digest, filename, contents)
     except GiveUp:
         raise
     except Exception:
@@ -1,10 +1,8 @@
 """
 VCS objects for the version control systems supported by muddle
-"""
 
-# Import things here so that they can register their VCS functionality
-import muddled.vcs.bazaar
-import muddled.vcs.file
-import muddled.vcs.git
-import muddled.vcs.svn
-import muddled.vcs.weld
+Each module here registers its VCS with muddled.version_control when it is
+imported. So that we don't import them all every time muddle starts,
+muddled.version_control imports each one when its VCS is first wanted (see
+vcs_modules in that module).
+"""
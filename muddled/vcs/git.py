@@ -24,6 +24,11 @@ TODO: The following needs rewriting after work for issue 225
 
   If a revision is requested, then ``git checkout`` is used to check it out.
 
+  If $MUDDLE_GIT_MIRRORS is set (and this is not a shallow checkout), then
+  the mirror of the repository in that directory is brought up to date first,
+  and ``--reference <mirror> --dissociate`` is added to the clone command, so
+  that only what the mirror lacks is fetched. See muddled.mirrors.
+
   If a branch *and* a revision are requested, then muddle checks to see if
   cloning the branch gave the correct revision, and only does the ``git
   checkout`` if it did not. This avoids unnecessary detached HEADs,
@@ -47,7 +52,8 @@ TODO: The following needs rewriting after work for issue 225
   we first go to "master".
 
   The command checks that the remote is configured as such, then does ``git
-  fetch``. If a revision was specified, it then checks out that revision,
+  fetch`` (first from the repository's mirror, if $MUDDLE_GIT_MIRRORS is set,
+  as for "muddle checkout"). If a revision was specified, it then checks out that revision,
   otherwise it does ``git merge --ff-only``, which will merge in the fetch if
   it doesn't require human interaction.
 
@@ -72,11 +78,15 @@ TODO: The following needs rewriting after work for issue 225
 
 * muddle status
 
-  This first does ``git status --porcelain``. If that does not return anything,
-  it then determines the SHA1 for the local HEAD, and the SHA1 for the
-  equivalent HEAD in the remote repository. If these are different (so
-  presumably the remote repository is ahead of the local one), then it reports
-  as much,
+  This first does ``git status --porcelain=v2 --branch``, which tells us about
+  any local changes, the current branch and the SHA1 of the local HEAD. If
+  there are no local changes, it then determines the SHA1 for the equivalent
+  HEAD in the remote repository. If these are different (so presumably the
+  remote repository is ahead of the local one), then it reports as much,
+
+  With "-quick", the remote repository is not asked. Instead, if the branch
+  has an upstream branch, it reports whether git's (local) record of that is
+  ahead of or behind the local branch.
 
   Note that a normal ``git status`` does not talk to the remote repository,
   and is thus fast. If this command does talk over the network, it can be
@@ -107,12 +117,18 @@ import os
 import re
 
 import muddled.utils as utils
+from muddled.mirrors import git_mirrors
 from muddled.version_control import register_vcs, VersionControlSystem
 from muddled.withdir import Directory
 from muddled.utils import GiveUp
 
 g_supports_ff_only = None
 
+# How "git status --porcelain=v2" marks a change that is not staged (or not
+# made in the working tree), and how --porcelain (v1) shows it
+_V2_UNCHANGED = '.'
+_V1_UNCHANGED = ' '
+
 def git_supports_ff_only():
     """
     Does my git support --ff-only?
@@ -131,6 +147,58 @@ def git_supports_ff_only():
 
     return g_supports_ff_only
 
+def _parse_status_v2(text):
+    """Parse the output of "git status --porcelain=v2 --branch".
+
+    Returns a tuple (headers, changes), where 'headers' is a dictionary of the
+    "# branch.<name> <value>" lines (for instance, 'branch.head' maps to the
+    branch name, or "(detached)"), and 'changes' is a list of the changed or
+    untracked files, each described as "git status --porcelain" would.
+    """
+    headers = {}
+    changes = []
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line.startswith('# '):
+            parts = line[2:].split(' ', 1)
+            if len(parts) == 2:
+                headers[parts[0]] = parts[1]
+            continue
+        kind = line[0]
+        if kind == '1':
+            # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            fields = line.split(' ', 8)
+            xy = fields[1].replace(_V2_UNCHANGED, _V1_UNCHANGED)
+            changes.append('%s %s'%(xy, fields[8]))
+        elif kind == '2':
+            # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>\t<orig>
+            fields = line.split(' ', 9)
+            xy = fields[1].replace(_V2_UNCHANGED, _V1_UNCHANGED)
+            path, orig_path = fields[9].split('\t', 1)
+            changes.append('%s %s -> %s'%(xy, orig_path, path))
+        elif kind == 'u':
+            # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+            fields = line.split(' ', 10)
+            changes.append('%s %s'%(fields[1], fields[10]))
+        elif kind == '?':
+            changes.append('?? %s'%line[2:])
+        elif kind == '!':
+            changes.append('!! %s'%line[2:])
+    return headers, changes
+
+def _update_mirror(repo, options, verbose=True):
+    """
+    If we are using git mirrors, bring the mirror for 'repo' up to date.
+
+    Returns the path of the mirror, or None if there isn't one (including if
+    this is a shallow checkout, which would not want all the history).
+    """
+    mirrors = git_mirrors()
+    if mirrors is None or options.get('shallow_checkout'):
+        return None
+    return mirrors.update(repo.url, verbose=verbose)
+
 def expand_revision(revision):
     """Given something that names a revision, return its full SHA1.
 
@@ -188,6 +256,11 @@ class Git(VersionControlSystem):
         if options.get('shallow_checkout'):
             args += ["--depth", "1"]
 
+        # If we have a mirror of the repository, only fetch what it lacks
+        mirror = _update_mirror(repo, options, verbose=verbose)
+        if mirror:
+            args += ["--reference", mirror, "--dissociate"]
+
         utils.shell(["git", "clone"] + args + [repo.url, str(co_leaf)],
                    show_command=verbose)
 
@@ -289,6 +362,20 @@ class Git(VersionControlSystem):
 
         self._setup_remote(upstream, repo, verbose=verbose)
 
+        # If we have a mirror of the repository, get what we can from it
+        # first (it was just updated from the same place, so it gives the
+        # same remote branches), so that the fetch from the remote repository
+        # has little or nothing left to do
+        mirror = _update_mirror(repo, options, verbose=verbose)
+        if mirror:
+            cmd = ['git', 'fetch', '--quiet', mirror,
+                   '+refs/heads/*:refs/remotes/%s/*'%upstream,
+                   'refs/tags/*:refs/tags/*']
+            rv, out = utils.run2(cmd, show_command=verbose)
+            if rv:
+                print 'Warning: cannot fetch from git mirror %s\n%s'%(mirror,
+                        utils.indent(out.rstrip(), '    '))
+
         # Retrieve changes from the remote repository to the local repository
         # We want to get the output from this so we can put it into any exception,
         # for instance if we try to fetch a branch that does not exist.
@@ -427,6 +514,64 @@ class Git(VersionControlSystem):
 
         Return status text or None if there is no interesting status.
         """
+        # Ask for everything we need to know locally in one go
+        retcode, text = utils.run2("git status --porcelain=v2 --branch",
+                                   show_command=False)
+        if retcode:
+            # Presumably our git is too old to support it (it needs 2.11)
+            return self._status_by_parts(quick)
+
+        headers, changes = _parse_status_v2(text)
+        detached_head = (headers.get('branch.head') == '(detached)')
+
+        text = '\n'.join(changes)
+        if detached_head:
+            # That's all the user really needs to know
+            note = '\n# Note that this checkout has a detached HEAD'
+            if text:
+                text = '%s\n#%s'%(text, note)
+            else:
+                text = note
+
+        if text:
+            return text
+
+        if detached_head:
+            head_name = 'HEAD'
+        else:
+            head_name = 'refs/heads/%s'%headers['branch.head']
+        local_head_ref = headers.get('branch.oid')
+
+        if quick:
+            upstream = headers.get('branch.upstream')
+            if upstream is None or 'branch.ab' not in headers:
+                # We have no upstream (or it has gone), so the best we can do
+                # is our idea of the remote's branch of the same name
+                return self._status_quick_by_branch(headers['branch.head'],
+                                                    head_name, local_head_ref)
+            ahead, behind = headers['branch.ab'].split()
+            if ahead == '+0' and behind == '-0':
+                return None
+            return '\n'.join(
+                ('After checking local HEAD against our local record of the remote HEAD',
+                 '# The local repository does not match the remote:',
+                 '#',
+                 '#  HEAD   is %s'%head_name,
+                 '#  Local  is %s'%local_head_ref,
+                 '#  Local  is %s commits ahead of and %s commits behind'
+                 ' last known %s'%(ahead[1:], behind[1:], upstream),
+                 '#',
+                 '# You probably need to push or pull.',
+                 '# Use "muddle status" without "-quick" to get a better idea'))
+
+        return self._status_against_remote(head_name, local_head_ref)
+
+    def _status_by_parts(self, quick=False):
+        """
+        Work out our status for a git that does not support --porcelain=v2.
+
+        Will be called in the actual checkout's directory.
+        """
         retcode, text = utils.run2("git status --porcelain", show_command=False)
         if retcode == 129:
             print "Warning: Your git does not support --porcelain; you should upgrade it."
@@ -465,22 +610,36 @@ class Git(VersionControlSystem):
 
         if quick:
             branch_name = utils.get_cmd_data("git rev-parse --abbrev-ref HEAD")
-            text = utils.get_cmd_data("git show-ref origin/%s"%branch_name)
-            ref, what = text.split()
-            if ref != local_head_ref:
-                return '\n'.join(
-                    ('After checking local HEAD against our local record of the remote HEAD',
-                     '# The local repository does not match the remote:',
-                     '#',
-                     '#  HEAD   is %s'%head_name,
-                     '#  Local  is %s'%local_head_ref,
-                     '#  last known origin/%s is %s'%(branch_name, ref),
-                     '#',
-                     '# You probably need to push or pull.',
-                     '# Use "muddle status" without "-quick" to get a better idea'))
-            else:
-                return None
+            return self._status_quick_by_branch(branch_name, head_name,
+                                                local_head_ref)
+
+        return self._status_against_remote(head_name, local_head_ref)
+
+    def _status_quick_by_branch(self, branch_name, head_name, local_head_ref):
+        """
+        Compare our HEAD with our local record of the remote branch of the
+        same name.
+        """
+        text = utils.get_cmd_data("git show-ref origin/%s"%branch_name)
+        ref, what = text.split()
+        if ref != local_head_ref:
+            return '\n'.join(
+                ('After checking local HEAD against our local record of the remote HEAD',
+                 '# The local repository does not match the remote:',
+                 '#',
+                 '#  HEAD   is %s'%head_name,
+                 '#  Local  is %s'%local_head_ref,
+                 '#  last known origin/%s is %s'%(branch_name, ref),
+                 '#',
+                 '# You probably need to push or pull.',
+                 '# Use "muddle status" without "-quick" to get a better idea'))
+        else:
+            return None
 
+    def _status_against_remote(self, head_name, local_head_ref):
+        """
+        Compare our HEAD with the equivalent HEAD in the remote repository.
+        """
         # So look up the remote equivalents...
         retcode, text = utils.run2("git ls-remote", show_command=False)
         lines = text.split('\n')
@@ -605,6 +764,15 @@ class Git(VersionControlSystem):
         else:
             raise GiveUp('Error running "git symbolic-ref -q HEAD" to detect detached HEAD')
 
+    def has_local_changes(self):
+        """
+        Will be called in the actual checkout's directory.
+        """
+        retcode, text = utils.run2("git status --porcelain", show_command=False)
+        if retcode:
+            raise GiveUp("'git status --porcelain' failed with return code %d"%retcode)
+        return bool(text.strip())
+
     def supports_branching(self):
         return True
 
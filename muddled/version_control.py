@@ -5,7 +5,10 @@ Routines which deal with version control.
 import re
 import os
 
+from functools import wraps
+
 import muddled.pkg as pkg
+import muddled.trace as trace
 import muddled.utils as utils
 
 from muddled.depend import Label
@@ -120,6 +123,17 @@ class VersionControlSystem(object):
         """
         raise GiveUp("VCS '%s' cannot calculate a checkout revision"%self.long_name)
 
+    def has_local_changes(self):
+        """
+        Does the checkout have uncommitted changes or untracked files?
+
+        Will be called in the actual checkout's directory.
+
+        Raises Unsupported if the VCS does not support this operation.
+        """
+        raise utils.Unsupported("VCS '%s' cannot tell if a checkout has"
+                                " local changes"%self.long_name)
+
     def supports_branching(self):
         """
         Does this VCS support "lightweight" branching like git?
@@ -248,6 +262,21 @@ class VersionControlSystem(object):
         return []
 
 
+def _traced_operation(fn):
+    """A decorator to record a VersionControlHandler operation in any trace.
+
+    See muddled.trace. The operation is recorded as a phase named after it
+    and the checkout it is working on.
+    """
+    @wraps(fn)
+    def wrapper(self, builder, co_label, *args, **kwargs):
+        if not trace.tracing():
+            return fn(self, builder, co_label, *args, **kwargs)
+        with trace.span('%s %s'%(fn.__name__, co_label.name), 'vcs',
+                        label=co_label, vcs=self.short_name):
+            return fn(self, builder, co_label, *args, **kwargs)
+    return wrapper
+
 class VersionControlHandler(object):
     """
     Handle all version control operations for a checkout.
@@ -339,6 +368,7 @@ class VersionControlHandler(object):
             if DEBUG: print 'Not following build description'
             return None
 
+    @_traced_operation
     def checkout(self, builder, co_label, verbose=True):
         """
         Check this checkout out of version control.
@@ -382,6 +412,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure checking out %s in %s:\n%s'%(co_label,
                          parent_dir, err))
 
+    @_traced_operation
     def pull(self, builder, co_label, upstream=None, repo=None, verbose=True):
         """
         Retrieve changes from the remote repository, and apply them to
@@ -424,6 +455,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure pulling %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def merge(self, builder, co_label, verbose=True):
         """
         Retrieve changes from the remote repository, and apply them to
@@ -459,6 +491,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure merging %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def commit(self, builder, co_label, verbose=True):
         """
         Commit any changes in the local working copy to the local repository.
@@ -478,6 +511,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure commiting %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def push(self, builder, co_label, upstream=None, repo=None, verbose=True):
         """
         Push changes in the local repository to the remote repository.
@@ -526,6 +560,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure pushing %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def status(self, builder, co_label, verbose=False, quick=False):
         """
         Report on the status of the checkout, in a VCS-appropriate manner
@@ -571,6 +606,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure finding status for %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def reparent(self, builder, co_label, force=False, verbose=True):
         """
         Re-associate the local repository with its original remote repository,
@@ -590,6 +626,7 @@ class VersionControlHandler(object):
         with Directory(actual_dir):
             self.vcs.reparent(actual_dir, repo, options, force, verbose)
 
+    @_traced_operation
     def revision_to_checkout(self, builder, co_label, force=False, before=None, verbose=False, show_pushd=True):
         """
         Determine a revision id for this checkout, usable to check it out again.
@@ -636,6 +673,25 @@ class VersionControlHandler(object):
             return self.vcs.revision_to_checkout(repo, co_leaf, options,
                                                  force, before, verbose)
 
+    @_traced_operation
+    def has_local_changes(self, builder, co_label, show_pushd=False):
+        """
+        Does the checkout have uncommitted changes or untracked files?
+
+        If 'show_pushd' is false, then we won't report as we "pushd" into the
+        checkout directory.
+
+        Raises a GiveUp exception if the VCS does not support this operation,
+        or if something goes wrong.
+        """
+        try:
+            with Directory(builder.db.get_checkout_path(co_label), show_pushd=show_pushd):
+                return self.vcs.has_local_changes()
+        except (GiveUp, Unsupported) as err:
+            raise GiveUp('Failure checking for local changes for %s in %s:\n%s'%(co_label,
+                         builder.db.get_checkout_location(co_label), err))
+
+    @_traced_operation
     def get_current_branch(self, builder, co_label, verbose=False, show_pushd=False):
         """
         Return the name of the current branch.
@@ -658,6 +714,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure getting current branch for %s in %s:\n%s'%(co_label,
                          builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def create_branch(self, builder, co_label, branch, verbose=False, show_pushd=False):
         """
         Create a (new) branch of the given name.
@@ -674,6 +731,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure creating branch %s for %s in %s:\n%s'%(branch,
                          co_label, builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def goto_branch(self, builder, co_label, branch, verbose=False, show_pushd=False):
         """
         Make the named branch the current branch.
@@ -690,6 +748,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure changing to branch %s for %s in %s:\n%s'%(branch,
                          co_label, builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def goto_revision(self, builder, co_label, revision, branch=None, verbose=False, show_pushd=False):
         """
         Go to the specified revision.
@@ -713,6 +772,7 @@ class VersionControlHandler(object):
                 raise GiveUp('Failure changing to revision %s for %s in %s:\n%s'%(revision,
                              co_label, builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def branch_exists(self, builder, co_label, branch, verbose=False, show_pushd=False):
         """
         Returns True if a branch of that name exists.
@@ -732,6 +792,7 @@ class VersionControlHandler(object):
             raise GiveUp('Failure checking existence of branch %s for %s in %s:\n%s'%(branch,
                          co_label, builder.db.get_checkout_location(co_label), err))
 
+    @_traced_operation
     def sync(self, builder, co_label, verbose=False, sync=True):
         """
         Attempt to go to the branch indicated by the build description.
@@ -884,6 +945,29 @@ vcs_dict = {}
 # And this one the documentation for each VCS
 vcs_docs = {}
 
+# The modules that provide the VCSs that come with muddle, by scheme. Each
+# registers its VCS when it is imported, which we only do when the scheme
+# is first used.
+vcs_modules = {
+    'bzr'  : 'muddled.vcs.bazaar',
+    'file' : 'muddled.vcs.file',
+    'git'  : 'muddled.vcs.git',
+    'svn'  : 'muddled.vcs.svn',
+    'weld' : 'muddled.vcs.weld',
+    }
+
+def _load_vcs(scheme):
+    """Make sure the VCS for 'scheme' is registered, if we know where it is.
+    """
+    if scheme not in vcs_dict and scheme in vcs_modules:
+        __import__(vcs_modules[scheme])
+
+def _load_all_vcs():
+    """Make sure all the VCSs that come with muddle are registered.
+    """
+    for scheme in vcs_modules:
+        _load_vcs(scheme)
+
 def register_vcs(scheme, vcs_instance, docs=None, options=None):
     """
     Register a VCS instance with a VCS scheme prefix.
@@ -899,8 +983,9 @@ def list_registered(indent=''):
     Return a list of registered version control systems.
     """
 
+    _load_all_vcs()
     str_list = []
-    for (k,v) in vcs_dict.items():
+    for (k,v) in sorted(vcs_dict.items()):
         if indent:
             str_list.append(indent)
         str_list.append(utils.pad_to(k, 20))
@@ -920,6 +1005,7 @@ def list_registered(indent=''):
 def get_vcs_instance(vcs):
     """Given a VCS short name, return a VCS instance.
     """
+    _load_vcs(vcs)
     try:
         return vcs_dict[vcs]
     except KeyError:
@@ -928,6 +1014,7 @@ def get_vcs_instance(vcs):
 def get_vcs_docs(vcs):
     """Given a VCS short name, return the docs for how muddle handles it
     """
+    _load_vcs(vcs)
     try:
         return vcs_docs[vcs]
     except KeyError:
@@ -1076,6 +1163,7 @@ def vcs_init_directory(scheme, files=None):
     Raises KeyError if the scheme is not one for which we have a registered
     handler.
     """
+    _load_vcs(scheme)
     vcs_instance = vcs_dict.get(scheme, None)
     if not vcs_instance:
         raise MuddleBug("No VCS handler registered for VCS type %s"%scheme)
@@ -220,6 +220,7 @@ from StringIO import StringIO
 
 from muddled.depend import Label
 from muddled.repository import Repository
+from muddled.workers import run_in_workers
 from muddled.utils import MuddleSortedDict, MuddleOrderedDict, \
         HashFile, GiveUp, truncate, LabelType, LabelTag, split_vcs_url, \
         sort_domains
@@ -581,7 +582,8 @@ class VersionStamp(object):
                                 truncate(str(item), columns=truncate)))
 
     @staticmethod
-    def _from_builder(stamp, builder, force=False, just_use_head=False, before=None, quiet=False):
+    def _from_builder(stamp, builder, force=False, just_use_head=False, before=None,
+                      quiet=False, jobs=1):
         """The internal mechanisms of the 'from_builder' static method.
         """
         stamp.repository = builder.db.RootRepository_pathfile.get()
@@ -609,63 +611,58 @@ class VersionStamp(object):
             print 'found %d'%len(checkout_rules)
 
         checkout_rules.sort()
+
+        # Work out which checkouts we can ask about, and their domains
+        to_query = []
+        problems = {}                   # label -> problem text
         for rule in checkout_rules:
+            label = rule.target
             try:
-                label = rule.target
+                rule.action.vcs
+            except AttributeError:
+                problems[label] = "Rule for label '%s' has no VCS"%(label)
+                if not quiet:
+                    print problems[label]
+                continue
+            if label.domain:
                 try:
-                    vcs_handler = rule.action.vcs
-                except AttributeError:
-                    stamp.problems.append("Rule for label '%s' has no VCS"%(label))
-                    if not quiet:
-                        print stamp.problems[-1]
+                    stamp.domains[label.domain] = \
+                            builder.db.get_subdomain_info(label.domain)
+                except GiveUp as exc:
+                    print exc
+                    problems[label] = str(exc)
                     continue
-                if not quiet:
-                    print "Processing %s checkout '%s'"%(vcs_handler.short_name,
-                                                 '(%s)%s'%(label.domain,label.name)
-                                                           if label.domain
-                                                           else label.name)
-                if label.domain:
-                    domain_name = label.domain
-                    domain_repo, domain_desc = builder.db.get_subdomain_info(domain_name)
-                    stamp.domains[domain_name] = (domain_repo, domain_desc)
-
-                # We always want to specify the revision in the stamp file
-                if just_use_head:
-                    if not quiet:
-                        print 'Forcing head'
-                    rev = "HEAD"
+            to_query.append(rule)
+
+        # And ask, either one at a time or several at once
+        def query(builder, rule):
+            return VersionStamp._checkout_details(builder, rule, force,
+                                                  just_use_head, before, quiet)
+        details = {}                    # label -> what query returned
+        if jobs > 1 and len(to_query) > 1:
+            for rule, result, exc in run_in_workers(builder, to_query, query, jobs):
+                if exc is None:
+                    details[rule.target] = result
                 else:
-                    rev = vcs_handler.revision_to_checkout(builder, label, force=force,
-                                                           before=before, verbose=True)
-
-                # We may also want to specify the branch
-                branch = None
-                repo = builder.db.get_checkout_repo(label)
-                if vcs_handler.vcs.supports_branching():
-                    current_branch = vcs_handler.get_current_branch(builder, label)
-                    # If the Repository doesn't ask for a particular branch,
-                    # then we normally assume it means "master".
-                    orig_branch = repo.branch
-                    if orig_branch is None:
-                        orig_branch = 'master'
-
-                    if current_branch != orig_branch:
-                        branch = current_branch
-
-                if branch:
-                    repo = repo.copy_with_changed_branch(branch, rev)
-                else:
-                    repo = repo.copy_with_changed_revision(rev)
-
-                co_dir, co_leaf = builder.db.get_checkout_dir_and_leaf(label)
-                stamp.checkouts[label] = (co_dir, co_leaf, repo)
+                    problems[rule.target] = str(exc)
+        else:
+            for rule in to_query:
+                try:
+                    details[rule.target] = query(builder, rule)
+                except GiveUp as exc:
+                    print exc
+                    problems[rule.target] = str(exc)
 
-                options = builder.db.get_checkout_vcs_options(label)
-                if options:
-                    stamp.options[label] = options
-            except GiveUp as exc:
-                print exc
-                stamp.problems.append(str(exc))
+        # Remember what we found out, in label order
+        for rule in checkout_rules:
+            label = rule.target
+            if label in problems:
+                stamp.problems.append(problems[label])
+                continue
+            co_dir, co_leaf, repo, options = details[label]
+            stamp.checkouts[label] = (co_dir, co_leaf, repo)
+            if options:
+                stamp.options[label] = options
 
         if stamp.domains and not quiet:
             domain_names = stamp.domains.keys()
@@ -689,7 +686,58 @@ class VersionStamp(object):
                 stamp.problems.append('Unable to work out revision ids for all the checkouts')
 
     @staticmethod
-    def from_builder(builder, force=False, just_use_head=False, before=None, quiet=False):
+    def _checkout_details(builder, rule, force, just_use_head, before, quiet):
+        """Work out what to put in a stamp for the checkout built by 'rule'.
+
+        Returns a tuple (co_dir, co_leaf, repo, options), where 'repo' is
+        the checkout's Repository, amended to give its current branch and
+        revision.
+
+        Raises GiveUp if we cannot work out the revision.
+        """
+        label = rule.target
+        vcs_handler = rule.action.vcs
+        if not quiet:
+            print "Processing %s checkout '%s'"%(vcs_handler.short_name,
+                                         '(%s)%s'%(label.domain,label.name)
+                                                   if label.domain
+                                                   else label.name)
+
+        # We always want to specify the revision in the stamp file
+        if just_use_head:
+            if not quiet:
+                print 'Forcing head'
+            rev = "HEAD"
+        else:
+            rev = vcs_handler.revision_to_checkout(builder, label, force=force,
+                                                   before=before, verbose=True)
+
+        # We may also want to specify the branch
+        branch = None
+        repo = builder.db.get_checkout_repo(label)
+        if vcs_handler.vcs.supports_branching():
+            current_branch = vcs_handler.get_current_branch(builder, label)
+            # If the Repository doesn't ask for a particular branch,
+            # then we normally assume it means "master".
+            orig_branch = repo.branch
+            if orig_branch is None:
+                orig_branch = 'master'
+
+            if current_branch != orig_branch:
+                branch = current_branch
+
+        if branch:
+            repo = repo.copy_with_changed_branch(branch, rev)
+        else:
+            repo = repo.copy_with_changed_revision(rev)
+
+        co_dir, co_leaf = builder.db.get_checkout_dir_and_leaf(label)
+        options = builder.db.get_checkout_vcs_options(label)
+        return co_dir, co_leaf, repo, options
+
+    @staticmethod
+    def from_builder(builder, force=False, just_use_head=False, before=None,
+                     quiet=False, jobs=1):
         """Construct a VersionStamp from a muddle build description.
 
         'builder' is the muddle Builder for our build description.
@@ -721,6 +769,10 @@ class VersionStamp(object):
         If 'quiet' is True, then we will not print information about what
         we are doing, and we will not print out problems as they are found.
 
+        If 'jobs' is more than 1, then up to that many checkouts are asked
+        about at once, each in its own process (see muddled.workers). The
+        result is the same as asking about them one at a time.
+
         Returns a tuple of:
 
             * the new VersionStamp instance
@@ -734,7 +786,8 @@ class VersionStamp(object):
                                    force=force,
                                    just_use_head=just_use_head,
                                    before=before,
-                                   quiet=quiet)
+                                   quiet=quiet,
+                                   jobs=jobs)
 
         return stamp, stamp.problems
 
@@ -1142,7 +1195,7 @@ class ReleaseStamp(VersionStamp):
         self.release_spec = ReleaseSpec()
 
     @staticmethod
-    def from_builder(builder, quiet=False):
+    def from_builder(builder, quiet=False, jobs=1):
         """Construct a ReleaseStamp from a muddle build description.
 
         'builder' is the muddle Builder for our build description.
@@ -1150,6 +1203,9 @@ class ReleaseStamp(VersionStamp):
         If 'quiet' is True, then we will not print information about what
         we are doing, and we will not print out problems as they are found.
 
+        If 'jobs' is more than 1, then up to that many checkouts are asked
+        about at once.
+
         Returns a tuple of:
 
             * the new ReleaseStamp instance
@@ -1162,7 +1218,7 @@ class ReleaseStamp(VersionStamp):
 
         VersionStamp._from_builder(stamp, builder,
                                    force=False, just_use_head=False, before=None,
-                                   quiet=quiet)
+                                   quiet=quiet, jobs=jobs)
 
         # and then add in release information
         stamp.release_spec = builder.release_spec
@@ -0,0 +1,195 @@
+"""
+Running an operation on several checkouts (or other labels) at once.
+
+Version control operations spend most of their time waiting - for the
+network, for the remote repository, or for a VCS command to start up - so
+when there are many checkouts, it is much quicker to run several of them at
+the same time. run_in_workers() does this by running the operation for
+each label in its own forked worker process.
+
+Each worker has its own current directory, so the "with Directory(...)"
+idiom used by the VCS handlers is safe, and everything a worker (or
+anything it runs) writes to stdout or stderr goes to a temporary file.
+That output is printed, in the order the labels were given, as soon as the
+worker (and all those for labels before it) have finished - so the output
+is the same as if the labels had been dealt with one after another.
+"""
+
+import cPickle
+import fcntl
+import os
+import select
+import sys
+import tempfile
+import traceback
+
+from muddled.utils import GiveUp, MuddleBug
+
+# What pickling a worker's result, or unpickling it, might raise - the
+# latter calls the __init__ (or __setstate__) of the classes in it
+PICKLE_ERRORS = (cPickle.PicklingError, cPickle.UnpicklingError, EOFError,
+                 TypeError, ValueError, AttributeError, ImportError,
+                 IndexError, KeyError, IOError)
+
+def run_in_workers(builder, items, function, jobs, stop_on_problem=False):
+    """
+    Call 'function(builder, item)' for each of 'items', up to 'jobs' at once.
+
+    Each call is made in a forked worker process. The value that 'function'
+    returns must be something that can be pickled, as must any GiveUp it
+    raises. If it raises GiveUp, the exception is printed (as part of the
+    worker's output), as well as being returned.
+
+    Any tags set by the workers are written out by them, and read back in
+    by 'builder' before we return. Anything else 'function' changes in the
+    builder is lost when its worker finishes, so anything the caller needs
+    to know must be returned.
+
+    If 'stop_on_problem' is true, then no more workers are started after
+    one has raised GiveUp, although those already running are allowed to
+    finish.
+
+    Returns a list of tuples (item, value, exception), one for each item
+    that was dealt with, in the order of 'items', where 'value' is what
+    'function' returned, and 'exception' is the GiveUp it raised (or None).
+    """
+    items = list(items)
+    running = {}                        # pipe fd -> (pid, index)
+    files = {}                          # index -> (output file, result file)
+    results = {}                        # index -> (value, exception)
+    next_to_start = 0
+    next_to_report = 0
+    reported = []
+    failed = False
+
+    while next_to_report < len(items):
+        # Start everything we can
+        while (next_to_start < len(items) and len(running) < jobs and
+               not (failed and stop_on_problem)):
+            index = next_to_start
+            next_to_start += 1
+            pid, pipe_fd, output_filename, result_filename = _start_worker(
+                                                builder, function, items[index])
+            running[pipe_fd] = (pid, index)
+            files[index] = (output_filename, result_filename)
+
+        if not running:
+            # We have stopped starting workers, and they have all finished
+            break
+
+        # Wait for one of our workers to finish. Each holds the write end
+        # of a pipe open until it exits, so we know it has finished when we
+        # get end-of-file on the read end.
+        readable, _, _ = select.select(running.keys(), [], [])
+        for pipe_fd in readable:
+            if os.read(pipe_fd, 1):
+                continue
+            os.close(pipe_fd)
+            pid, index = running.pop(pipe_fd)
+            wpid, status = os.waitpid(pid, 0)
+            value, exception = _worker_result(files[index][1], status)
+            results[index] = (value, exception)
+            if exception is not None:
+                failed = True
+
+        # Pick up any tags the workers set
+        builder.db.sync_tags()
+
+        # And report on any that are ready, in order
+        while next_to_report in results:
+            output_filename, result_filename = files.pop(next_to_report)
+            with open(output_filename) as fd:
+                sys.stdout.write(fd.read())
+            sys.stdout.flush()
+            os.remove(output_filename)
+            value, exception = results.pop(next_to_report)
+            reported.append((items[next_to_report], value, exception))
+            next_to_report += 1
+
+    return reported
+
+def _start_worker(builder, function, item):
+    """
+    Start a worker process to call 'function(builder, item)'.
+
+    Returns a tuple (pid, pipe_fd, output_filename, result_filename), where
+    'pipe_fd' is the read end of a pipe that gives end-of-file when the
+    worker exits.
+    """
+    fd, output_filename = tempfile.mkstemp(prefix='muddle-worker-')
+    result_fd, result_filename = tempfile.mkstemp(prefix='muddle-result-')
+    os.close(result_fd)
+    pipe_fd, worker_pipe_fd = os.pipe()
+    # Write out our tags now, so that the worker doesn't write them too
+    builder.db.sync_tags()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.close(fd)
+        os.close(worker_pipe_fd)
+        return pid, pipe_fd, output_filename, result_filename
+
+    # We are the worker - we must not return from here
+    status = 1
+    try:
+        try:
+            # Don't let the commands we run keep our end of the pipe open
+            os.close(pipe_fd)
+            fcntl.fcntl(worker_pipe_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            os.close(fd)
+            value, exception = None, None
+            try:
+                value = function(builder, item)
+            except GiveUp as e:
+                print e
+                exception = _picklable(e)
+            builder.db.sync_tags()
+            with open(result_filename, 'wb') as fd:
+                cPickle.dump((value, exception), fd, cPickle.HIGHEST_PROTOCOL)
+            status = 0
+        except:
+            traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+def _picklable(exception):
+    """
+    Return GiveUp 'exception', or a plain GiveUp like it if need be.
+
+    Some subclasses of GiveUp (ShellError, for instance) cannot be unpickled,
+    because their __init__ wants different arguments, so we check that this
+    one can be, and if not, return a GiveUp with its message and retcode.
+    """
+    try:
+        cPickle.loads(cPickle.dumps(exception, cPickle.HIGHEST_PROTOCOL))
+        return exception
+    except PICKLE_ERRORS:
+        return GiveUp(str(exception), exception.retcode)
+
+def _worker_result(result_filename, status):
+    """
+    Return the (value, exception) a worker left in 'result_filename'.
+
+    If the worker failed unexpectedly (its traceback will be in its output),
+    or we cannot read what it left, then the exception is a MuddleBug saying
+    so.
+    """
+    try:
+        if status == 0:
+            with open(result_filename, 'rb') as fd:
+                return cPickle.load(fd)
+        else:
+            return None, MuddleBug('Worker process failed unexpectedly'
+                                   ' (wait status %d)'%status)
+    except PICKLE_ERRORS as e:
+        return None, MuddleBug('Cannot read the result of a worker process:'
+                               ' %s: %s'%(e.__class__.__name__, e))
+    finally:
+        os.remove(result_filename)
+
+# End file.
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+"""Time how long muddle takes to start up, for some common commands
+
+    $ ./benchmark_startup.py [-n <count>] [-keep]
+
+Each command is run <count> times (default 10), in a small build tree, and
+the fastest and median times are reported. With -keep, do not delete the
+'transient' directory used for the build tree.
+
+This is not run by all_tests.py, as it doesn't pass or fail - it is meant
+for comparing one version of muddle with another.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+BENCHMARK_BUILD_DESC = """ \
+# A build description with a few packages
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    muddled.pkgs.make.medium(builder, 'third', [role], 'third',
+                             deps=['second'])
+    builder.add_default_role(role)
+"""
+
+# The commands we time
+COMMANDS = [
+    ['help'],
+    ['help', 'query'],
+    ['query', 'root'],
+    ['query', 'checkouts'],
+    ['query', 'packages'],
+    ['query', 'checkout-dirs'],
+    ['query', 'objdir', 'first{x86}'],
+    ['query', 'needed-by', 'third{x86}'],
+    ['where'],
+    ]
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'benchmark'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', BENCHMARK_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second', 'third'):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', 'all:\n\nconfig:\n\ninstall:\n\n'
+                                         'clean:\n\ndistclean:\n')
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def time_command(args, count):
+    """Run "muddle <args>" 'count' times, and return the times it took.
+    """
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for ii in range(count):
+            start = time.time()
+            retcode = subprocess.call([MUDDLE_BINARY] + args,
+                                      stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+            if retcode:
+                raise GiveUp('"muddle %s" failed'%' '.join(args))
+    return times
+
+def time_import(count):
+    """Time importing muddled.cmdline 'count' times, in a new Python each time.
+    """
+    code = ('import time; start = time.time(); import muddled.cmdline;'
+            ' print time.time() - start')
+    times = []
+    for ii in range(count):
+        text = subprocess.check_output([sys.executable, '-c', code],
+                                       cwd=os.path.dirname(MUDDLE_BINARY))
+        times.append(float(text))
+    return times
+
+def report(what, times):
+    times = sorted(times)
+    print '%8.1f %8.1f  %s'%(times[0]*1000, times[len(times)//2]*1000, what)
+
+def benchmark(count):
+    print
+    print '%8s %8s  (milliseconds, %d runs each)'%('Fastest', 'Median', count)
+    report('import muddled.cmdline', time_import(count))
+    for args in COMMANDS:
+        report('muddle %s'%' '.join(args), time_command(args, count))
+
+def main(args):
+
+    keep = False
+    count = 10
+    while args:
+        word = args.pop(0)
+        if word == '-keep':
+            keep = True
+        elif word == '-n' and args:
+            count = int(args.pop(0))
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            make_build_tree()
+            # Make sure the snapshot of the build tree is up to date
+            muddle(['query', 'root'], verbose=False)
+            benchmark(count)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+    except Exception as e:
+        print
+        traceback.print_exc()
+        sys.exit(1)
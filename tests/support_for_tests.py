@@ -68,8 +68,11 @@ MUDDLE_BINARY = os.path.join(MUDDLE_BINARY_DIR, 'muddle')
 # Make up for not necessarily having a PYTHONPATH that helps
 # Assume the location of muddle_patch.py relative to ourselves
 MUDDLE_PATCH_COMMAND = '%s/muddle_patch.py'%(PARENT_DIR)
+# And similarly for muddle_cache_server.py
+MUDDLE_CACHE_SERVER_COMMAND = '%s/muddle_cache_server.py'%(PARENT_DIR)
 
-export_names(['MUDDLE_BINARY', 'MUDDLE_PATCH_COMMAND'])
+export_names(['MUDDLE_BINARY', 'MUDDLE_PATCH_COMMAND',
+              'MUDDLE_CACHE_SERVER_COMMAND'])
 
 def flushing_print(text):
     sys.stdout.write(text)
@@ -290,7 +293,7 @@ def check_nosuch_files(paths, verbose=True):
             raise GiveUp('File %s exists'%name)
         else:
             if verbose:
-                sys.sydout.write('  -- %s\n'%name)
+                flushing_print('  -- %s\n'%name)
     if verbose:
         flushing_print('++ All named files do not exist\n')
 
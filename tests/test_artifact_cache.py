@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+"""Test restoring packages from an artifact cache ($MUDDLE_CACHE)
+
+    $ ./test_artifact_cache.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+CACHE_BUILD_DESC = """ \
+# A build description with two packages, the second depending on the first
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A muddle makefile that builds and installs a file
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\tcp $(MUDDLE_SRC)/source $(MUDDLE_OBJ)/{name}.out
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+\tmkdir -p $(MUDDLE_INSTALL)/bin
+\tcp $(MUDDLE_OBJ)/{name}.out $(MUDDLE_INSTALL)/bin/{name}
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree(name, clone_from=None):
+    """Make a build tree, with new checkouts or clones of another tree's.
+    """
+    muddle(['bootstrap', 'git+file:///nowhere', name])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', CACHE_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second'):
+            if clone_from:
+                git('clone %s %s'%(os.path.join(clone_from, 'src', name), name))
+                with Directory(name):
+                    muddle(['import'])
+                continue
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE.format(name=name))
+                touch('source', 'Version 1 of %s\n'%name)
+                git('add Makefile.muddle source')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def check_output(text, built, restored):
+    for name in ('first', 'second'):
+        was_built = '> Building package:%s{x86}/built'%name in text
+        was_restored = '> Restored package:%s{x86}/* from the cache'%name in text
+        if was_built != (name in built) or was_restored != (name in restored):
+            raise GiveUp('Expected to build %s and restore %s, but got:\n%s'%(
+                         built, restored, text))
+
+def check_installed(first, second):
+    check_file_v_text('install/x86/bin/first', 'Version %d of first\n'%first)
+    check_file_v_text('install/x86/bin/second', 'Version %d of second\n'%second)
+    check_file_v_text('obj/first/x86/first.out', 'Version %d of first\n'%first)
+
+def check_stats(hits, misses, stored):
+    text = captured_muddle(['query', 'cache-stats'])
+    for name, value in (('Hits', hits), ('Misses', misses), ('Stored', stored)):
+        if '%s: %s\n'%(name, ' '*(15-len(name)) + str(value)) not in text:
+            raise GiveUp('Expected %s %d in cache stats:\n%s'%(name, value, text))
+
+def test_first_tree():
+    """Building a tree fills the cache.
+    """
+    make_build_tree('cache-one')
+    text = captured_muddle(['build', '_all'])
+    check_output(text, ['first', 'second'], [])
+    check_installed(1, 1)
+    check_stats(hits=0, misses=2, stored=2)
+
+def test_second_tree(first_tree):
+    """Building the same thing in another tree, at the same path, uses the cache.
+    """
+    make_build_tree('cache-two', clone_from=first_tree)
+    text = captured_muddle(['build', '_all'])
+    check_output(text, [], ['first', 'second'])
+    check_installed(1, 1)
+    check_stats(hits=2, misses=2, stored=2)
+
+    # A package with local changes is not restored (or stored)
+    with Directory('src/first'):
+        touch('source', 'Version 2 of first\n')
+    muddle(['distrebuild', 'first'])
+    text = captured_muddle(['build', '_all'])
+    check_installed(2, 1)
+
+    # Committing the change makes it something new, which needs building
+    # (as does everything that depends upon it)
+    with Directory('src/first'):
+        git('commit -a -m "Version 2"')
+    muddle(['veryclean'])
+    text = captured_muddle(['build', '-j', '2', '_all'])
+    check_output(text, ['first', 'second'], [])
+    check_installed(2, 1)
+
+    # And now it's in the cache
+    muddle(['veryclean'])
+    text = captured_muddle(['build', '_all'])
+    check_output(text, [], ['first', 'second'])
+    check_installed(2, 1)
+
+def test_eviction():
+    """A small cache only keeps the most recently used entries.
+    """
+    with Directory('src/first'):
+        touch('source', 'Version 3 of first\n')
+        git('commit -a -m "Version 3"')
+    os.environ['MUDDLE_CACHE_SIZE'] = '40'
+    try:
+        muddle(['veryclean'])
+        text = captured_muddle(['build', 'first'])
+        check_output(text, ['first'], [])
+        # Storing version 3 of first means we have to forget the entries for
+        # version 1 of first and second, and version 2 of first (the
+        # entries for second share a file, so that doesn't help)
+        text = captured_muddle(['query', 'cache-stats'])
+        if 'Entries:         2\n' not in text or 'Evicted:         3\n' not in text:
+            raise GiveUp('Unexpected cache stats after eviction:\n%s'%text)
+    finally:
+        del os.environ['MUDDLE_CACHE_SIZE']
+
+def test_other_path(first_tree):
+    """A tree at a different path can't use the cache.
+
+    (What is built may contain the paths it was built with.)
+    """
+    make_build_tree('cache-three', clone_from=first_tree)
+    text = captured_muddle(['build', '_all'])
+    check_output(text, ['first', 'second'], [])
+    check_installed(1, 1)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        os.environ['MUDDLE_CACHE'] = os.path.join(root_dir, 'cache')
+        try:
+            with NewDirectory('one'):
+                banner('FIRST TREE')
+                test_first_tree()
+
+            # The second tree replaces the first, at the same path
+            first_tree = os.path.join(root_dir, 'first')
+            os.rename(os.path.join(root_dir, 'one'), first_tree)
+            with NewDirectory('one'):
+                banner('SECOND TREE')
+                test_second_tree(first_tree)
+
+                banner('EVICTION')
+                test_eviction()
+
+            with NewDirectory('two'):
+                banner('TREE AT ANOTHER PATH')
+                test_other_path(first_tree)
+        finally:
+            del os.environ['MUDDLE_CACHE']
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
@@ -243,6 +243,553 @@ package:pkg_1{role_1}/preconfig <-NoAction-- [ checkout:co_1{role_1}/pulled ]
     r2_required_by = depend.required_by(rs, l2)
     assert depend.rule_list_to_string(r2_required_by) == "[ checkout:co_1{role_1}/pulled, deployment:dep_1{role_2}/built, package:pkg_1{role_1}/preconfig,  ]"
 
+def ruleset_index_unit_test():
+    """
+    Check that indexed RuleSet look-ups agree with a simple scan.
+    """
+
+    rs = depend.RuleSet()
+    for name in ('co_1', 'co_2', '*'):
+        rs.add(depend.Rule(Label.from_string('checkout:%s/checked_out'%name), None))
+    for role in ('x86', 'arm', None):
+        for name in ('pkg_1', 'pkg_2'):
+            l = Label(utils.LabelType.Package, name, role, utils.LabelTag.Built)
+            rs.add(depend.Rule(l, None))
+    rs.add(depend.Rule(Label.from_string('package:(sub)pkg_1{arm}/built'), None))
+    rs.add(depend.Rule(Label.from_string('package:pkg_3{*}/*'), None))
+
+    def scan(label):
+        return set(v for k, v in rs.map.items() if label.just_match(k))
+
+    queries = ['checkout:*/*', 'checkout:co_1/checked_out', 'checkout:co_3/*',
+               'package:*{arm}/built', 'package:(*)*{arm}/built',
+               'package:pkg_1/built', 'package:pkg_3{x86}/built',
+               '*:*{*}/*', '*:(*)*{*}/*', 'package:(sub)*{*}/*']
+    for q in queries:
+        label = Label.from_string(q)
+        assert rs.rules_for_target(label) == scan(label), q
+        assert rs.targets_match(label) == set(r.target for r in scan(label)), q
+
+    # Adding a new target only forgets the look-ups it would match
+    arm = Label.from_string('package:*{arm}/built')
+    x86 = Label.from_string('package:*{x86}/built')
+    assert len(rs.rules_for_target(arm)) == 3
+    assert len(rs.rules_for_target(x86)) == 3
+    rs.add(depend.Rule(Label.from_string('package:pkg_4{arm}/built'), None))
+    assert arm not in rs.cache
+    assert x86 in rs.cache
+    assert len(rs.rules_for_target(arm)) == 4
+
+    # And rule_for_target can also add targets
+    new = Label.from_string('package:pkg_5{arm}/built')
+    rs.rule_for_target(new, createIfNotPresent=True)
+    assert new in rs.targets_match(arm)
+
+    # Ignoring tags still honours the role exactly
+    rules = rs.rules_for_target(Label.from_string('package:pkg_1{arm}/installed'),
+                                useTags=False, useMatch=False)
+    assert len(rules) == 1
+
+def ruleset_dependents_unit_test():
+    """
+    Check the RuleSet reverse dependency index, and required_by.
+    """
+
+    co = Label.from_string('checkout:co_1/checked_out')
+    pre = Label.from_string('package:pkg_1{x86}/preconfig')
+    built = Label.from_string('package:pkg_1{x86}/built')
+    other = Label.from_string('package:pkg_2{x86}/built')
+    dep = Label.from_string('deployment:dep_1/deployed')
+
+    rs = depend.RuleSet()
+    rs.add(depend.Rule(co, None))
+    rs.add(depend.depend_one(None, pre, co))
+    rs.add(depend.depend_one(None, built, pre))
+    rs.add(depend.Rule(other, None))
+    # A wildcarded dependency, added after the rule is in the RuleSet
+    rule = rs.rule_for_target(dep, createIfNotPresent=True)
+    rule.add(Label.from_string('package:*{x86}/built'))
+
+    def scan(label, useTags=True, useMatch=True):
+        result = set()
+        for v in rs.map.values():
+            for d in v.deps:
+                if useMatch:
+                    if d.match(label) is not None:
+                        result.add(v)
+                elif useTags:
+                    if d == label:
+                        result.add(v)
+                elif d.match_without_tag(label):
+                    result.add(v)
+        return result
+
+    for label in (co, pre, built, other, Label.from_string('package:*{*}/*'),
+                  Label.from_string('checkout:co_1/pulled')):
+        for useTags in (True, False):
+            for useMatch in (True, False):
+                assert rs.rules_which_depend_on(label, useTags, useMatch) == \
+                        scan(label, useTags, useMatch), (label, useTags, useMatch)
+
+    assert depend.required_by(rs, co) == set([co, pre, built, dep])
+    assert depend.required_by(rs, other) == set([other, dep])
+
+def needed_to_build_unit_test():
+    """
+    Check the order of needed_to_build, and that it notices cycles.
+    """
+
+    rs = depend.RuleSet()
+    base = Label.from_string('package:base{x86}/initial')
+    depend.depend_chain(None, base, ['configured', 'built', 'installed'], rs)
+    app = Label.from_string('package:app{x86}/initial')
+    depend.depend_chain(None, app, ['configured', 'built', 'installed'], rs)
+    rs.rule_for_target(app.copy_with_tag('configured')).add(base.copy_with_tag('installed'))
+    # A wildcarded target rule adds to every matching target
+    extra = Label.from_string('checkout:extra/checked_out')
+    rs.add(depend.Rule(extra, None))
+    wild = rs.rule_for_target(Label.from_string('package:*{x86}/built'),
+                              createIfNotPresent=True)
+    wild.add(extra)
+
+    def check_order(rules):
+        done = set()
+        for rule in rules:
+            for dep in rule.deps:
+                assert dep in done, '%s before %s'%(rule.target, dep)
+            done.add(rule.target)
+        return done
+
+    final = app.copy_with_tag('installed')
+    done = check_order(depend.needed_to_build(rs, final))
+    assert final in done
+    assert base.copy_with_tag('installed') in done
+    assert extra in done
+    # Asking again gives the same answer (from the remembered plan)
+    assert depend.needed_to_build(rs, final) == depend.needed_to_build(rs, final)
+
+    # Wildcards, with more than one target sharing dependencies
+    done = check_order(depend.needed_to_build(rs,
+                       Label.from_string('package:*{x86}/installed'), useMatch=True))
+    assert final in done and base.copy_with_tag('installed') in done
+
+    # Changing the rule set changes the plan
+    late = Label.from_string('checkout:late/checked_out')
+    rs.add(depend.Rule(late, None))
+    rs.rule_for_target(final).add(late)
+    assert late in check_order(depend.needed_to_build(rs, final))
+
+    # And circularity is reported
+    rs.rule_for_target(base).add(final)
+    try:
+        depend.needed_to_build(rs, final)
+    except utils.GiveUp as e:
+        assert 'Dependency graph is circular' in str(e)
+        assert str(base) in str(e)
+    else:
+        assert False, 'Circular dependency not detected'
+
+def label_environment_unit_test():
+    """
+    Test which actions take their environment from the builder.
+    """
+    import muddled.pkgs.make as make
+
+    assert not depend.uses_label_environment(pkg.NoAction())
+    assert make.MakeBuilder.uses_label_environment
+
+    maker = make.MakeBuilder('fred', 'x86', 'fred')
+    assert depend.uses_label_environment(maker)
+
+    # A subclass that does not override build_label is still OK
+    class QuietMakeBuilder(make.MakeBuilder):
+        def _make_command(self, builder, makefile_name):
+            return ['make', '-s', '-f', makefile_name]
+    assert depend.uses_label_environment(QuietMakeBuilder('fred', 'x86', 'fred'))
+
+    # But one that does must say so itself
+    class OddMakeBuilder(make.MakeBuilder):
+        def build_label(self, builder, label):
+            utils.run0(['true'])
+    assert not depend.uses_label_environment(OddMakeBuilder('fred', 'x86', 'fred'))
+
+    # Amending the environment only changes the dictionary we give it
+    env = {'MUDDLE_PKGCONFIG_DIRS_AS_PATH':'/a:/b', 'PKG_CONFIG_LIBDIR':'/c'}
+    maker._amend_env('/src/fred', env)
+    assert env == {'MUDDLE_PKGCONFIG_DIRS_AS_PATH':'/a:/b', 'MUDDLE_SRC':'/src/fred'}
+    assert os.environ.get('MUDDLE_SRC') != '/src/fred'
+
+    # And the environment we give a command is the one it gets
+    env = {'PATH':os.environ['PATH'], 'MUDDLE_TEST_VALUE':'fred'}
+    assert utils.run1(['sh', '-c', 'echo $MUDDLE_TEST_VALUE'], env=env,
+                      show_command=False) == 'fred\n'
+    assert utils.get_cmd_data(['sh', '-c', 'echo $MUDDLE_TEST_VALUE'],
+                              env=env) == 'fred\n'
+
+def environment_index_unit_test():
+    """
+    Test finding the environments that apply to a label.
+    """
+    import shutil
+    import tempfile
+
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, '.muddle'))
+        with open(os.path.join(root, '.muddle', 'Description'), 'w') as fd:
+            fd.write('builds/01.py\n')
+        builder = mechanics.Builder(root, '/bin/muddle')
+
+        def brute_force(label):
+            to_apply = []
+            for (k, v) in builder.env.items():
+                m = k.match(label)
+                if m is not None:
+                    to_apply.append((m, k, v))
+            return sorted(to_apply, key=lambda x: x[0])
+
+        env_labels = [Label.from_string(x) for x in (
+            'package:*{*}/*', 'package:*{x86}/*', 'package:fred{x86}/*',
+            'package:fred{*}/built', 'checkout:fred/*', '*:*{*}/*',
+            'package:jim{arm}/*', 'package:(sub)fred{x86}/*')]
+        for n, l in enumerate(env_labels):
+            builder.get_environment_for(l).set('VAR%d'%n, 'value%d'%n)
+
+        labels = [Label.from_string(x) for x in (
+            'package:fred{x86}/built', 'package:fred{x86}/installed',
+            'package:jim{x86}/built', 'package:jim{arm}/built',
+            'checkout:fred/checked_out', 'deployment:fred/deployed',
+            'package:*{x86}/*', 'package:(sub)fred{x86}/built')]
+        for l in labels:
+            assert builder.list_environments_for(l) == brute_force(l)
+
+        # Asking again gives the same answer
+        fred = Label.from_string('package:fred{x86}/built')
+        assert builder.list_environments_for(fred) == brute_force(fred)
+        env = builder.effective_environment_for(fred)
+        assert not env.empty('VAR2')
+        assert env.empty('VAR6')
+
+        # Adding a new environment is noticed
+        builder.get_environment_for(Label.from_string('package:fred{*}/*')).set('NEW', '1')
+        assert builder.list_environments_for(fred) == brute_force(fred)
+        assert not builder.effective_environment_for(fred).empty('NEW')
+
+        # As is changing one
+        builder.get_environment_for(env_labels[0]).set('CHANGED', '1')
+        assert not builder.effective_environment_for(fred).empty('CHANGED')
+
+        # And changing the environment we were given does not matter
+        env = builder.effective_environment_for(fred)
+        env.set('MINE', '1')
+        assert builder.effective_environment_for(fred).empty('MINE')
+    finally:
+        shutil.rmtree(root)
+
+def label_interning_unit_test():
+    """
+    Check shared (interned) labels, and changing their domain.
+    """
+
+    import cPickle
+
+    l = Label.from_string('package:pkg_1{x86}/preconfig')
+    built = l.copy_with_tag('built')
+    assert built is l.copy_with_tag('built')
+    assert built is Label.from_string('package:pkg_1{x86}/built').intern()
+    assert built.copy_with_role('arm').copy_with_role('x86') is built
+    assert l.copy_with_tag('built', system=True) is not built
+    assert not hasattr(built, '__dict__')
+
+    # Wildcards are not shared, and copies are always new
+    assert l.copy_with_tag('*') is not l.copy_with_tag('*')
+    assert built.copy() is not built
+    assert built.copy() == built
+
+    # Labels survive pickling, hash and all
+    again = cPickle.loads(cPickle.dumps(built, cPickle.HIGHEST_PROTOCOL))
+    assert again == built
+    assert hash(again) == hash(built)
+    assert str(again) == str(built)
+
+    # A subdomain's labels are not shared with ours, so changing their
+    # domain does not affect our labels
+    with depend.NewLabelTable():
+        sub = l.copy_with_tag('built')
+        assert sub is not built
+        assert sub is l.copy_with_tag('built')
+        sub._mark_unswept()
+        sub._change_domain('sub')
+    assert str(sub) == 'package:(sub)pkg_1{x86}/built'
+    assert str(built) == 'package:pkg_1{x86}/built'
+    assert l.copy_with_tag('built') is built
+
+    # The hash ignores the domain, but sorting does not
+    assert hash(sub) == hash(built)
+    assert sub != built
+    assert built < sub
+    assert sorted([sub, built]) == [built, sub]
+
+def label_parsing_cache_unit_test():
+    """
+    Check that parsing the same label twice gives the same (shared) label.
+    """
+
+    a = Label.from_string('package:(d1)pkg_2{x86}/built[T]')
+    assert a is Label.from_string('package:(d1)pkg_2{x86}/built[T]')
+    assert a.transient and a.domain == 'd1'
+    assert a is not Label.from_string('package:(d1)pkg_2{x86}/built')
+
+    Package = utils.LabelType.Package
+    b = Label.from_fragment('pkg_2{x86}/built', Package, None, 'd1')
+    assert b is Label.from_fragment('pkg_2{x86}/built', Package, None, 'd1')
+    assert b is Label.from_string('package:(d1)pkg_2{x86}/built')
+    # The defaults are part of what we remember
+    c = Label.from_fragment('pkg_2/built', Package, 'x86', 'd1')
+    assert c is b
+    c = Label.from_fragment('pkg_2/built', Package, 'arm', 'd1')
+    assert c.role == 'arm'
+
+    # Wildcarded labels are still new each time
+    w = Label.from_string('package:*{x86}/*')
+    assert w == Label.from_string('package:*{x86}/*')
+    assert w is not Label.from_string('package:*{x86}/*')
+
+    # Bad labels are still bad the second time
+    for i in range(2):
+        try:
+            Label.from_string('package:busybox')
+        except utils.GiveUp:
+            pass
+        else:
+            raise utils.GiveUp('Parsing a bad label did not fail')
+
+    # And a subdomain gets its own labels, even though we remember the parse
+    with depend.NewLabelTable():
+        sub = Label.from_string('package:(d1)pkg_2{x86}/built')
+    assert sub is not b
+    assert sub == b
+
+def tag_store_unit_test():
+    """
+    Test keeping tags as files, in a journal, and both.
+    """
+    import shutil
+    import tempfile
+    import muddled.db as db
+
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, '.muddle'))
+        os.makedirs(os.path.join(root, 'domains', 'sub', '.muddle'))
+
+        built = Label.from_string('package:fred-x{x86-64}/built')
+        co = Label.from_string('checkout:fred/checked_out')
+        sub = Label.from_string('package:(sub)jim{arm}/installed')
+        journal = os.path.join(root, '.muddle', 'tags.journal')
+
+        d = db.Database(root)
+        assert d.tag_store() == 'files'
+        for label in (built, co, sub):
+            d.set_tag(label)
+        assert os.path.exists(d.tag_file_name(built))
+        assert os.path.exists(d.tag_file_name(sub))
+
+        # Move to the journal, and we should still have our tags
+        d.change_tag_store('journal', verbose=False)
+        assert not os.path.exists(os.path.join(root, '.muddle', 'tags'))
+        d = db.Database(root)
+        assert d.tag_store() == 'journal'
+        assert d.is_tag(built) and d.is_tag(co) and d.is_tag(sub)
+        assert d.is_tag(built.copy_with_tag('built', system=True))
+
+        # New tags are only written out when we sync
+        installed = built.copy_with_tag('installed')
+        d.set_tag(installed)
+        d.clear_tag(co)
+        assert d.is_tag(installed) and not d.is_tag(co)
+        assert not db.Database(root).is_tag(installed)
+        d.sync_tags()
+        other = db.Database(root)
+        assert other.is_tag(installed) and not other.is_tag(co)
+        assert not os.path.exists(d.tag_file_name(installed))
+
+        # And we see what another muddle has written when we next sync
+        other.set_tag(co)
+        other.sync_tags()
+        assert not d.is_tag(co)
+        d.sync_tags()
+        assert d.is_tag(co)
+
+        # Tag files are ignored for a journal
+        utils.ensure_dir(os.path.dirname(d.tag_file_name(co)))
+        touched = co.copy_with_tag('pulled')
+        open(d.tag_file_name(touched), 'w').close()
+        assert not db.Database(root).is_tag(touched)
+
+        # But not in compat mode
+        d.change_tag_store('compat', verbose=False)
+        d = db.Database(root)
+        assert d.tag_store() == 'compat'
+        assert d.is_tag(touched) and d.is_tag(installed)
+        assert os.path.exists(d.tag_file_name(installed))
+        d.clear_tag(installed)
+        d.sync_tags()
+        assert not db.Database(root).is_tag(installed)
+
+        # Forgetting tags by type rewrites the journal (as "muddle veryclean"
+        # does, after deleting the tag files)
+        shutil.rmtree(os.path.join(root, '.muddle', 'tags', 'package'))
+        d.tags_for_domain(None).forget(('package',))
+        assert not db.Database(root).is_tag(built)
+        assert db.Database(root).is_tag(co)
+        with open(journal) as fd:
+            assert 'package:' not in fd.read()
+
+        # And back to files, for all domains
+        d.change_tag_store('files', verbose=False)
+        assert not os.path.exists(journal)
+        d = db.Database(root)
+        assert d.tag_store() == 'files'
+        assert d.is_tag(co) and d.is_tag(touched) and d.is_tag(sub)
+        assert not d.is_tag(built)
+        assert d.tags_for_domain('sub').store() == 'files'
+    finally:
+        shutil.rmtree(root)
+
+def tag_files_preload_unit_test():
+    """
+    Test that we list the tag files once, rather than looking for each.
+    """
+    import shutil
+    import tempfile
+    import time
+    import muddled.db as db
+
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, '.muddle'))
+        built = Label.from_string('package:fred{x86}/built')
+        co = Label.from_string('checkout:fred/checked_out')
+
+        d = db.Database(root)
+        d.set_tag(co)
+        tags = d.tags_for_domain(None)
+        assert d.is_tag(co) and not d.is_tag(built)
+        assert tags.files == set([('checkout', 'fred', 'checked_out')])
+
+        # We don't look for a tag file once we've listed them
+        file_name = d.tag_file_name(built)
+        utils.ensure_dir(os.path.dirname(file_name))
+        open(file_name, 'w').close()
+        assert not d.is_tag(built)
+        assert db.Database(root).is_tag(built)
+
+        # Unless something may have changed them
+        d.sync_tags()
+        assert d.is_tag(built)
+
+        # Setting and clearing tags keeps our list up-to-date
+        d.clear_tag(co)
+        assert not d.is_tag(co) and not os.path.exists(d.tag_file_name(co))
+        d.set_tag(co)
+        assert d.is_tag(co) and os.path.exists(d.tag_file_name(co))
+        assert tags.files == set([('checkout', 'fred', 'checked_out'),
+                                  ('package', 'fred', 'x86-built')])
+
+        # And we notice tag files that someone else has removed
+        os.remove(file_name)
+        assert d.is_tag(built)
+        d.sync_tags()
+        assert not d.is_tag(built)
+        assert tags.files == set([('checkout', 'fred', 'checked_out')])
+
+        # But after a sync we only list again the directories that changed
+        # (since they were last listed, more than a second ago)
+        long_ago = time.time() - 10
+        for dir_name in (os.path.dirname(d.tag_file_name(co)),
+                         os.path.dirname(file_name)):
+            os.utime(dir_name, (long_ago, long_ago))
+        d = db.Database(root)
+        assert d.is_tag(co) and not d.is_tag(built)
+        listed = []
+        real_listdir = db._listdir
+        def counting_listdir(path):
+            listed.append(path)
+            return real_listdir(path)
+        db._listdir = counting_listdir
+        try:
+            d.sync_tags()
+            assert d.is_tag(co) and not d.is_tag(built)
+            assert listed == [], listed
+            open(file_name, 'w').close()
+            d.sync_tags()
+            assert d.is_tag(co) and d.is_tag(built)
+            assert listed == [os.path.dirname(file_name)], listed
+        finally:
+            db._listdir = real_listdir
+    finally:
+        shutil.rmtree(root)
+
+def fingerprint_file_merge_unit_test():
+    """
+    Test that committing fingerprints keeps those written by someone else.
+    """
+    import shutil
+    import tempfile
+    import muddled.db as db
+
+    root = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(root, '_fingerprints')
+        fred = Label.from_string('package:fred{x86}/built')
+        jim = Label.from_string('package:jim{x86}/built')
+
+        ours = db.FingerprintFile(file_name)
+        theirs = db.FingerprintFile(file_name)
+        ours.set(fred, 'aaaa')
+        theirs.set(jim, 'bbbb')
+        theirs.commit()
+        ours.commit()
+        assert ours.get(jim) == 'bbbb'
+
+        # Only the fingerprints we set replace theirs
+        theirs.set(jim, 'cccc')
+        theirs.commit()
+        ours.set(fred, 'dddd')
+        ours.commit()
+        check = db.FingerprintFile(file_name)
+        assert check.get(fred) == 'dddd' and check.get(jim) == 'cccc'
+    finally:
+        shutil.rmtree(root)
+
+def worker_exceptions_unit_test():
+    """
+    Test that workers return exceptions that can't be unpickled as GiveUp.
+    """
+    from muddled.workers import run_in_workers
+
+    class FakeDatabase(object):
+        def sync_tags(self):
+            pass
+
+    class FakeBuilder(object):
+        db = FakeDatabase()
+
+    def fail(builder, item):
+        if item == 'shell':
+            raise utils.ShellError('false', 3)
+        else:
+            raise utils.Unsupported('Not here')
+
+    results = run_in_workers(FakeBuilder(), ['shell', 'unsupported'], fail, 2)
+    (item1, value1, exc1), (item2, value2, exc2) = results
+    assert type(exc1) == utils.GiveUp
+    assert str(exc1) == "Command 'false' failed with retcode 3"
+    assert exc1.retcode == 3
+    assert type(exc2) == utils.Unsupported
+    assert str(exc2) == 'Not here'
+
 def utils_unit_test():
     """
     Unit testing on various utility code.
@@ -292,6 +839,37 @@ def vcs_unit_test():
     assert vcs == "cvs"
     assert url == "pserver://Foo.example.com/usr/cvs/foo"
 
+def git_status_v2_unit_test():
+    """
+    Test parsing "git status --porcelain=v2 --branch".
+    """
+    from muddled.vcs.git import _parse_status_v2
+    text = ('# branch.oid 0123456789abcdef0123456789abcdef01234567\n'
+            '# branch.head master\n'
+            '# branch.upstream origin/master\n'
+            '# branch.ab +2 -0\n'
+            '1 .M N... 100644 100644 100644 aaaa bbbb changed file.c\n'
+            '1 A. N... 000000 100644 100644 0000 cccc added.c\n'
+            '2 R. N... 100644 100644 100644 dddd dddd R100 new.c\told.c\n'
+            'u UU N... 100644 100644 100644 100644 eeee ffff 1111 both.c\n'
+            '? untracked/\n')
+    headers, changes = _parse_status_v2(text)
+    assert headers == {'branch.oid' : '0123456789abcdef0123456789abcdef01234567',
+                       'branch.head' : 'master',
+                       'branch.upstream' : 'origin/master',
+                       'branch.ab' : '+2 -0'}
+    assert changes == [' M changed file.c',
+                       'A  added.c',
+                       'R  old.c -> new.c',
+                       'UU both.c',
+                       '?? untracked/']
+
+    headers, changes = _parse_status_v2('# branch.oid 0123\n'
+                                        '# branch.head (detached)\n')
+    assert headers['branch.head'] == '(detached)'
+    assert 'branch.upstream' not in headers
+    assert changes == []
+
 def label_domain_sort():
     """Test sorting labels with domain names in them.
     """
@@ -458,8 +1036,32 @@ def run_tests():
     filespec_unit_test()
     print "> VCS"
     vcs_unit_test()
+    print "> git status"
+    git_status_v2_unit_test()
     print "> Depends"
     depend_unit_test()
+    print "> RuleSet index"
+    ruleset_index_unit_test()
+    print "> RuleSet dependents"
+    ruleset_dependents_unit_test()
+    print "> needed_to_build"
+    needed_to_build_unit_test()
+    print "> Label environment"
+    label_environment_unit_test()
+    print "> Environment index"
+    environment_index_unit_test()
+    print "> Label interning"
+    label_interning_unit_test()
+    print "> Label parsing cache"
+    label_parsing_cache_unit_test()
+    print "> Tag stores"
+    tag_store_unit_test()
+    print "> Tag files preload"
+    tag_files_preload_unit_test()
+    print "> Fingerprint file merge"
+    fingerprint_file_merge_unit_test()
+    print "> Worker exceptions"
+    worker_exceptions_unit_test()
     print "> Label domain sort"
     label_domain_sort()
 
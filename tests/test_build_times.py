@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+"""Test recording how long labels take to build, and using that
+
+    $ ./test_build_times.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+BUILD_DESC = """ \
+# A build description with a slow package, and a package depending on it
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'slow', [role], 'slow')
+    muddled.pkgs.make.medium(builder, 'fast', [role], 'fast')
+    muddled.pkgs.make.medium(builder, 'last', [role], 'last',
+                             deps=['slow', 'fast'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A simple muddle makefile
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\t{command}
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'build-times'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name, command in (('slow', 'sleep 2'), ('fast', 'true'),
+                              ('last', 'true')):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE.format(command=command))
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def parse_duration(text):
+    """Return the seconds in a duration, as written by format_duration().
+    """
+    seconds = 0.0
+    for number, unit in re.findall(r'([0-9.]+)([hms])', text):
+        seconds += float(number) * {'h':3600, 'm':60, 's':1}[unit]
+    return seconds
+
+def test_build_times():
+    make_build_tree()
+
+    # Before anything is built, we can't say much
+    text = captured_muddle(['build', '_all'])
+    if '> About ' in text:
+        raise GiveUp('Unexpected estimate on the first build:\n%s'%text)
+
+    text = captured_muddle(['query', 'critical-path', 'last{x86}'])
+    lines = text.splitlines()
+    chain = [line.split()[-1] for line in lines if line.startswith('  ')]
+    if ('package:slow{x86}/built' not in chain or
+        'package:fast{x86}/built' in chain or
+        chain[-1] != 'package:last{x86}/postinstalled'):
+        raise GiveUp('Unexpected critical path:\n%s'%text)
+    # Building package:slow takes (at least) two seconds, but how much more
+    # depends on how busy the machine is
+    match = re.match(r'Critical path for package:last{x86}/postinstalled'
+                     r' \(about ([^)]+)\)', lines[0])
+    if not match or parse_duration(match.group(1)) < 2.0:
+        raise GiveUp('Unexpected critical path length:\n%s'%text)
+
+    # Now we know how long things take, we can estimate how long is left
+    muddle(['veryclean'])
+    text = captured_muddle(['build', '_all'])
+    estimates = [parse_duration(left) for left in
+                 re.findall(r'^> About (.+) left \(', text, re.MULTILINE)]
+    if not estimates or max(estimates) < 2.0:
+        raise GiveUp('Expected an estimate of the time left:\n%s'%text)
+
+def test_timings():
+    # The slowest label was building package:slow
+    text = captured_muddle(['query', 'timings', '-top', '1'])
+    lines = text.splitlines()
+    if (not lines[0].startswith('The 1 slowest labels') or
+        not lines[3].endswith('package:slow{x86}/built')):
+        raise GiveUp('Unexpected slowest label:\n%s'%text)
+    for wanted in ('Total time per package:', 'Total time per role:',
+                   'Total time per domain:', '(top level)'):
+        if wanted not in text:
+            raise GiveUp('Expected "%s" in the timings:\n%s'%(wanted, text))
+    package_lines = lines[lines.index('Total time per package:')+2:]
+    if package_lines[0].split()[-1] != 'slow':
+        raise GiveUp('Expected package slow to take the longest:\n%s'%text)
+
+    # We can restrict the report to particular labels
+    text = captured_muddle(['query', 'timings', '-sort', 'name', 'fast'])
+    if 'package:slow' in text or 'package:fast{x86}/built' not in text:
+        raise GiveUp('Unexpected timings for package fast:\n%s'%text)
+
+    # A failed build is recorded as such, but doesn't spoil our estimates
+    with Directory('src'):
+        with Directory('fast'):
+            touch('Makefile.muddle', MAKEFILE.format(command='exit 3'))
+    text = captured_muddle(['rebuild', 'fast'], error_fails=False)
+    text = captured_muddle(['query', 'timings', 'fast'])
+    if 'package:fast{x86}/built (failed, status 2)' not in text:
+        raise GiveUp('Expected a failed build of package fast:\n%s'%text)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('BUILD TIMES')
+            test_build_times()
+
+            banner('TIMINGS')
+            test_timings()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
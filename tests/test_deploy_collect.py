@@ -266,7 +266,8 @@ def make_old_build_tree():
                 touch('01.py', DEPLOYMENT_BUILD_DESC_12)
                 # Then remove the .pyc file, because Python probably won't realise
                 # that this new 01.py is later than the previous version
-                os.remove('01.pyc')
+                if os.path.exists('01.pyc'):
+                    os.remove('01.pyc')
 
             with NewDirectory('first_co'):
                 git('init')
@@ -331,7 +332,8 @@ def make_old_build_tree():
                 # Then remove the .pyc file, because Python probably won't
                 # realise that this new 01.py is later than the previous
                 # version
-                os.remove('01.pyc')
+                if os.path.exists('01.pyc'):
+                    os.remove('01.pyc')
 
         muddle(['veryclean'])
         muddle([])
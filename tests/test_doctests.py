@@ -14,6 +14,9 @@ def main():
     total_failures = 0
     with Directory(support_for_tests.PARENT_DIR):    # hopefully, muddled is herein
         for dirpath, dirnames, filenames in os.walk('muddled'):
+            if '__init__.py' not in filenames:
+                # Not a package - for instance, muddled/resources
+                continue
             for name in filenames:
                 base, ext = os.path.splitext(name)
                 if ext != '.py':
@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+"""Test rebuilding packages whose fingerprints have changed
+
+    $ ./test_fingerprints.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+FINGERPRINT_BUILD_DESC = """ \
+# A build description with three packages, the last depending on the first
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second')
+    muddled.pkgs.make.medium(builder, 'last', [role], 'last',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A simple muddle makefile
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'fingerprints'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', FINGERPRINT_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second', 'last'):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE)
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def built_packages(text):
+    """Return the names of the packages built, according to 'text'.
+    """
+    names = set()
+    for line in text.splitlines():
+        if line.startswith('> Building package:'):
+            names.add(line[len('> Building package:'):].split('{')[0])
+    return names
+
+def check_built(text, expected):
+    built = built_packages(text)
+    if built != set(expected):
+        raise GiveUp('Expected to build %s, but built %s:\n%s'%(sorted(expected),
+                     sorted(built), text))
+
+def commit_change(name, what):
+    with Directory('src'):
+        with Directory(name):
+            touch('README', '%s change to %s\n'%(what, name))
+            git('add README')
+            git('commit -m "Change %s"'%name)
+
+def test_without_fingerprints():
+    """Normally, only the tags matter.
+    """
+    make_build_tree()
+    text = captured_muddle(['build', '_all'])
+    check_built(text, ['first', 'second', 'last'])
+
+    commit_change('first', 'A')
+    text = captured_muddle(['build', '_all'])
+    check_built(text, [])
+
+def test_with_fingerprints():
+    """With $MUDDLE_FINGERPRINTS, changed packages are rebuilt.
+    """
+    # The first time, we trust the existing tags
+    text = captured_muddle(['build', '_all'])
+    check_built(text, [])
+    check_files(['.muddle/_fingerprints'])
+
+    commit_change('first', 'Another')
+    text = captured_muddle(['build', '_all'])
+    check_built(text, ['first', 'last'])
+    if '> Building package:first{x86}/preconfig' not in text:
+        raise GiveUp('Did not rebuild package:first from the start:\n%s'%text)
+
+    # And now everything is up-to-date again
+    text = captured_muddle(['build', '_all'])
+    check_built(text, [])
+
+    # Changing a package that nothing depends on just rebuilds it
+    commit_change('second', 'A')
+    text = captured_muddle(['build', '-j', '2', '_all'])
+    check_built(text, ['second'])
+
+    # Changing a checkout without committing doesn't change its revision
+    with Directory('src'):
+        with Directory('last'):
+            touch('README', 'Not committed\n')
+    text = captured_muddle(['build', '_all'])
+    check_built(text, [])
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('WITHOUT FINGERPRINTS')
+            test_without_fingerprints()
+
+            banner('WITH FINGERPRINTS')
+            os.environ['MUDDLE_FINGERPRINTS'] = 'yes'
+            try:
+                test_with_fingerprints()
+            finally:
+                del os.environ['MUDDLE_FINGERPRINTS']
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+"""Test sharing git mirrors between build trees, with $MUDDLE_GIT_MIRRORS
+
+    $ ./test_git_mirrors.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import sys
+import time
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.mirrors import GitMirrors, LAST_USED_FILE
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+CHECKOUTS = ('co1', 'co2')
+
+BUILD_DESC = """ \
+# A build description with a couple of simple checkouts
+
+import muddled.checkouts.simple
+
+def describe_to(builder):
+    builder.build_name = 'git_mirrors'
+    for name in {checkouts!r}:
+        muddled.checkouts.simple.relative(builder, name)
+"""
+
+def make_repositories():
+    """Make a (non-bare) repository for the build description and each checkout.
+    """
+    with NewDirectory('repo'):
+        with NewDirectory('builds'):
+            git('init')
+            touch('01.py', BUILD_DESC.format(checkouts=CHECKOUTS))
+            touch('.gitignore', '*.pyc\n')
+            git('add 01.py .gitignore')
+            git('commit -m "Build description"')
+        for name in CHECKOUTS:
+            with NewDirectory(name):
+                git('init')
+                touch('file.txt', 'Checkout %s\n'%name)
+                git('add file.txt')
+                git('commit -m "First commit"')
+
+def head_of(git_dir, ref='master'):
+    return get_stdout('git --git-dir=%s rev-parse %s'%(git_dir, ref)).strip()
+
+def check_mirrors(mirrors, root_repo, names):
+    """Check that 'mirrors' has just the mirrors for 'names', up to date.
+    """
+    urls = sorted(url for last_used, path, url in mirrors.mirrors())
+    expected = sorted('%s/%s'%(root_repo, name) for name in names)
+    if urls != expected:
+        raise GiveUp('Expected mirrors of:\n  %s\nbut found:\n  %s'%(
+                     '\n  '.join(expected), '\n  '.join(urls)))
+    for name in names:
+        url = '%s/%s'%(root_repo, name)
+        mirror_head = head_of(mirrors.mirror_path(url))
+        repo_head = head_of(os.path.join('repo', name, '.git'))
+        if mirror_head != repo_head:
+            raise GiveUp('Mirror of %s is at %s, not %s'%(name, mirror_head,
+                                                          repo_head))
+
+def check_in_text(text, expected):
+    if expected not in text:
+        raise GiveUp('Did not find "%s" in:\n%s'%(expected, text))
+
+def check_dissociated(build_dir, names):
+    """Check that checkouts 'names' do not depend on the mirrors.
+    """
+    for name in names:
+        alternates = os.path.join(build_dir, 'src', name, '.git', 'objects',
+                                  'info', 'alternates')
+        if os.path.exists(alternates):
+            raise GiveUp('Checkout %s still uses %s'%(name, alternates))
+
+def test_checkout(root_repo, mirrors):
+    banner('CHECKOUT WITH MIRRORS')
+    with NewDirectory('build1'):
+        muddle(['init', 'git+%s'%root_repo, 'builds/01.py'])
+        text = captured_muddle(['checkout', '_all'])
+        print text
+        for name in CHECKOUTS:
+            check_in_text(text, '--reference %s --dissociate'%
+                               mirrors.mirror_path('%s/%s'%(root_repo, name)))
+    check_mirrors(mirrors, root_repo, ('builds',) + CHECKOUTS)
+    check_dissociated('build1', ('builds',) + CHECKOUTS)
+
+    banner('CHECKOUT IN A SECOND BUILD TREE')
+    with NewDirectory('build2'):
+        muddle(['init', 'git+%s'%root_repo, 'builds/01.py'])
+        muddle(['checkout', '_all'])
+        for name in CHECKOUTS:
+            with Directory(os.path.join('src', name)):
+                check_files(['file.txt'])
+    check_dissociated('build2', ('builds',) + CHECKOUTS)
+
+def test_pull(root_repo, mirrors):
+    banner('PULL WITH MIRRORS')
+    with Directory(os.path.join('repo', 'co1')):
+        append('file.txt', 'A change\n')
+        git('commit -a -m "A change"')
+    with Directory('build1'):
+        text = captured_muddle(['pull', '_all'])
+        print text
+        check_in_text(text, 'git fetch --quiet %s'%
+                           mirrors.mirror_path('%s/co1'%root_repo))
+        if 'Warning' in text:
+            raise GiveUp('Unexpected warning when pulling')
+        with open(os.path.join('src', 'co1', 'file.txt')) as fd:
+            if 'A change' not in fd.read():
+                raise GiveUp('co1 was not pulled')
+        if head_of(os.path.join('src', 'co1', '.git'), 'origin/master') != \
+                head_of(os.path.join('..', 'repo', 'co1', '.git')):
+            raise GiveUp('origin/master was not updated in co1')
+    check_mirrors(mirrors, root_repo, ('builds',) + CHECKOUTS)
+
+def test_no_mirror_dir(root_repo):
+    banner('CHECKOUT WITH A BROKEN MIRROR DIRECTORY')
+    touch('not_a_directory', 'Just a file\n')
+    old_mirrors = os.environ['MUDDLE_GIT_MIRRORS']
+    os.environ['MUDDLE_GIT_MIRRORS'] = os.path.abspath('not_a_directory')
+    try:
+        with NewDirectory('build3'):
+            muddle(['init', 'git+%s'%root_repo, 'builds/01.py'])
+            text = captured_muddle(['checkout', '_all'])
+            print text
+            check_in_text(text, 'Warning: cannot create git mirror directory')
+            for name in CHECKOUTS:
+                with Directory(os.path.join('src', name)):
+                    check_files(['file.txt'])
+    finally:
+        os.environ['MUDDLE_GIT_MIRRORS'] = old_mirrors
+
+def test_prune_no_mirror_dir():
+    banner('CACHE PRUNE BEFORE THE MIRROR DIRECTORY EXISTS')
+    old_mirrors = os.environ['MUDDLE_GIT_MIRRORS']
+    os.environ['MUDDLE_GIT_MIRRORS'] = os.path.abspath('no_mirrors_yet')
+    try:
+        with Directory('build1'):
+            text = captured_muddle(['cache', 'prune'])
+            print text
+            check_in_text(text, 'Removed 0 git mirrors not used for 30 days')
+        if os.path.exists('no_mirrors_yet'):
+            raise GiveUp('Pruning created the mirror directory')
+    finally:
+        os.environ['MUDDLE_GIT_MIRRORS'] = old_mirrors
+
+def test_prune(root_repo, mirrors):
+    banner('CACHE PRUNE')
+    text = captured_muddle(['cache', 'prune'])
+    print text
+    check_in_text(text, 'Removed 0 git mirrors not used for 30 days')
+    check_mirrors(mirrors, root_repo, ('builds',) + CHECKOUTS)
+
+    # Pretend co2's mirror has not been used for 20 days
+    last_used = os.path.join(mirrors.mirror_path('%s/co2'%root_repo),
+                             LAST_USED_FILE)
+    when = time.time() - 20*24*60*60
+    os.utime(last_used, (when, when))
+
+    text = captured_muddle(['-n', 'cache', 'prune', '-days', '10'])
+    print text
+    check_in_text(text, 'Would remove 1 git mirror not used for 10 days')
+    check_mirrors(mirrors, root_repo, ('builds',) + CHECKOUTS)
+
+    text = captured_muddle(['cache', 'prune', '-days', '10'])
+    print text
+    check_in_text(text, 'of %s/co2'%root_repo)
+    check_in_text(text, 'Removed 1 git mirror not used for 10 days')
+    check_mirrors(mirrors, root_repo, ('builds', 'co1'))
+    # The lock file is left alone, in case another muddle is waiting on it
+    lock_file = '%s.lock'%os.path.splitext(
+                                mirrors.mirror_path('%s/co2'%root_repo))[0]
+    if not os.path.exists(lock_file):
+        raise GiveUp('Pruning removed %s'%lock_file)
+
+    banner('PULL AFTER CACHE PRUNE')
+    # The checkouts don't depend on the mirror, and pulling makes it again
+    with Directory(os.path.join('repo', 'co2')):
+        append('file.txt', 'A change\n')
+        git('commit -a -m "A change"')
+    with Directory('build2'):
+        muddle(['pull', '_all'])
+        with open(os.path.join('src', 'co2', 'file.txt')) as fd:
+            if 'A change' not in fd.read():
+                raise GiveUp('co2 was not pulled')
+    check_mirrors(mirrors, root_repo, ('builds',) + CHECKOUTS)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep) as root_d:
+        make_repositories()
+        root_repo = 'file://' + os.path.join(root_dir, 'repo')
+        mirrors_dir = os.path.join(root_dir, 'mirrors')
+        os.environ['MUDDLE_GIT_MIRRORS'] = mirrors_dir
+        mirrors = GitMirrors(mirrors_dir)
+        test_checkout(root_repo, mirrors)
+        test_pull(root_repo, mirrors)
+        test_no_mirror_dir(root_repo)
+        test_prune_no_mirror_dir()
+        test_prune(root_repo, mirrors)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
+        sys.exit(1)
+
+# vim: set tabstop=8 softtabstop=4 shiftwidth=4 expandtab:
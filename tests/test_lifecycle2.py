@@ -417,7 +417,8 @@ def main(args):
                             append('01.py', '    builder.follow_build_desc_branch = True\n')
                             # Then remove the .pyc file, because Python probably won't realise
                             # that this new 01.py is later than the previous version
-                            os.remove('01.pyc')
+                            if os.path.exists('01.pyc'):
+                                os.remove('01.pyc')
 
             # It shouldn't make a difference - only the top-level build
             # description gets followed
@@ -460,7 +461,8 @@ def main(args):
                     append('01.py', '    builder.follow_build_desc_branch = True\n')
                     # Then remove the .pyc file, because Python probably won't realise
                     # that this new 01.py is later than the previous version
-                    os.remove('01.pyc')
+                    if os.path.exists('01.pyc'):
+                        os.remove('01.pyc')
 
             text = captured_muddle(['query', 'checkout-branches'])
             lines = text.splitlines()
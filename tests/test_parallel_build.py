@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+"""Test building packages in parallel, with "muddle build -j <N>"
+
+    $ ./test_parallel_build.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+PARALLEL_BUILD_DESC = """ \
+# A build description with three independent packages, and one that
+# depends on all of them
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    for name in ('first', 'second', 'third'):
+        muddled.pkgs.make.medium(builder, name, [role], name)
+    muddled.pkgs.make.medium(builder, 'last', [role], 'last',
+                             deps=['first', 'second', 'third'])
+    builder.add_default_role(role)
+"""
+
+# Each of the independent packages waits (for a while) until all three have
+# started to build, which they can only do if they are built at the same time.
+WAITING_MAKEFILE = """\
+# A muddle makefile that waits for its siblings
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\ttouch $(MUDDLE_ROOT)/started-{name}
+\tfor n in 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20; do \\
+\t  if [ -e $(MUDDLE_ROOT)/started-first -a \\
+\t       -e $(MUDDLE_ROOT)/started-second -a \\
+\t       -e $(MUDDLE_ROOT)/started-third ]; then break; fi; \\
+\t  sleep 0.5; \\
+\tdone
+\ttest -e $(MUDDLE_ROOT)/started-first -a \\
+\t     -e $(MUDDLE_ROOT)/started-second -a \\
+\t     -e $(MUDDLE_ROOT)/started-third
+\t{then}
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+\ttouch $(MUDDLE_INSTALL)/{name}
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+# The last package needs everything the others installed
+LAST_MAKEFILE = """\
+# A muddle makefile that relies on its dependencies
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\ttest -e $(MUDDLE_INSTALL)/first
+\ttest -e $(MUDDLE_INSTALL)/second
+\ttest -e $(MUDDLE_INSTALL)/third
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+\ttouch $(MUDDLE_INSTALL)/last
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'parallel-build'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', PARALLEL_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second', 'third', 'last'):
+            with NewDirectory(name):
+                git('init')
+                if name == 'last':
+                    touch('Makefile.muddle', LAST_MAKEFILE)
+                else:
+                    touch('Makefile.muddle',
+                          WAITING_MAKEFILE.format(name=name, then='true'))
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def check_output_not_mixed(text):
+    """Each package's make output should follow its "> Building" line.
+    """
+    current = None
+    for line in text.splitlines():
+        if line.startswith('> Building '):
+            current = line[len('> Building '):]
+        elif line.startswith('Make ') and ' for ' in line:
+            label = line.split(' for ')[1]
+            if label != current:
+                raise GiveUp('Output for %s appears under "> Building %s"'%(label, current))
+
+def test_parallel_build():
+    """Build our independent packages at the same time.
+    """
+    make_build_tree()
+
+    text = captured_muddle(['build', '-j', '3', '_all'])
+    print text
+    check_output_not_mixed(text)
+
+    check_files(['install/x86/first', 'install/x86/second',
+                 'install/x86/third', 'install/x86/last'])
+    check_files(['.muddle/tags/package/last/x86-postinstalled'])
+
+    # Everything is built, so doing it again should build nothing
+    text = captured_muddle(['build', '-j3', '_all'])
+    if '> Building package:' in text:
+        raise GiveUp('Rebuilt something that was already built:\n%s'%text)
+
+def test_default_from_environment():
+    """MUDDLE_JOBS gives the number of jobs if -j is not used.
+    """
+    muddle(['distrebuild', '-j', '1', 'last'])
+    for name in ('first', 'second', 'third'):
+        os.remove('started-%s'%name)
+    os.environ['MUDDLE_JOBS'] = '3'
+    try:
+        muddle(['rebuild', 'first', 'second', 'third'])
+    finally:
+        del os.environ['MUDDLE_JOBS']
+
+    # And a bad value is rejected
+    os.environ['MUDDLE_JOBS'] = 'many'
+    try:
+        text = captured_muddle(['build', '_all'], error_fails=False)
+    finally:
+        del os.environ['MUDDLE_JOBS']
+    if "$MUDDLE_JOBS must be a number of jobs, not 'many'" not in text:
+        raise GiveUp('Unexpected output for a bad MUDDLE_JOBS:\n%s'%text)
+
+def test_failure_stops_scheduling():
+    """A failed build stops anything else being started.
+    """
+    with Directory('src'):
+        with Directory('first'):
+            # Fail once the other packages have started
+            touch('Makefile.muddle', WAITING_MAKEFILE.format(name='first',
+                                                             then='false'))
+    for name in ('first', 'second', 'third'):
+        os.remove('started-%s'%name)
+
+    try:
+        text = captured_muddle(['rebuild', '-j', '3', '_all'])
+        raise GiveUp('Building a failing package did not fail')
+    except subprocess.CalledProcessError as e:
+        text = e.output
+    print text
+
+    # The packages already building should have been allowed to finish,
+    # but 'last' should not have been started
+    check_files(['.muddle/tags/package/second/x86-built',
+                 '.muddle/tags/package/third/x86-built'])
+    check_nosuch_files(['.muddle/tags/package/first/x86-built',
+                        '.muddle/tags/package/last/x86-built'])
+    if '> Building package:last' in text:
+        raise GiveUp('Started building package:last after a failure')
+    # And we are told which label we asked for could not be built, as we
+    # would be if building one label at a time
+    if "Can't build package:first{x86}" not in text:
+        raise GiveUp('Not told that package:first could not be built')
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('PARALLEL BUILD')
+            test_parallel_build()
+
+            banner('DEFAULT FROM ENVIRONMENT')
+            test_default_from_environment()
+
+            banner('FAILURE STOPS SCHEDULING')
+            test_failure_stops_scheduling()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
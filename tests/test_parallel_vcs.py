@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+"""Test dealing with several checkouts at once, with "-j <N>"
+
+    $ ./test_parallel_vcs.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+CHECKOUTS = ('co1', 'co2', 'co3', 'co4', 'co5')
+
+BUILD_DESC = """ \
+# A build description with several simple checkouts
+
+import muddled.checkouts.simple
+import muddled.pkgs.make
+
+def describe_to(builder):
+    builder.build_name = 'parallel_vcs'
+    for name in {checkouts!r}:
+        muddled.checkouts.simple.relative(builder, name)
+    # Muddle only knows about the domains in a build through its packages
+    muddled.pkgs.make.simple(builder, 'package', 'x86', 'co1')
+"""
+
+def make_repositories(checkouts):
+    """Make a (non-bare) repository for the build description and each checkout.
+    """
+    with NewDirectory('repo'):
+        with NewDirectory('builds'):
+            git('init')
+            touch('01.py', BUILD_DESC.format(checkouts=checkouts))
+            touch('.gitignore', '*.pyc\n')
+            git('add 01.py .gitignore')
+            git('commit -m "Build description"')
+        for name in CHECKOUTS:
+            with NewDirectory(name):
+                git('init')
+                touch('file.txt', 'Checkout %s\n'%name)
+                git('add file.txt')
+                git('commit -m "First commit"')
+
+def change_repository(name, text='A change\n'):
+    with Directory(os.path.join('repo', name)):
+        append('file.txt', text)
+        git('commit -a -m "A change"')
+
+def check_just_pulled(build_dir, names):
+    expected = ''.join('checkout:%s/checked_out\n'%name for name in sorted(names))
+    filename = os.path.join(build_dir, '.muddle', '_just_pulled')
+    with open(filename) as fd:
+        actual = fd.read()
+    if actual != expected:
+        raise GiveUp('%s contains:\n%s\ninstead of:\n%s'%(filename, actual,
+                                                          expected))
+
+def check_in_order(text, *words):
+    """Check that each of 'words' occurs in 'text', in order.
+    """
+    where = 0
+    for word in words:
+        where = text.find(word, where)
+        if where == -1:
+            raise GiveUp('Did not find "%s" (in order) in:\n%s'%(word, text))
+
+def test_checkout(root_repo, build_dir):
+    banner('CHECKOUT -j 3')
+    with NewDirectory(build_dir):
+        muddle(['init', 'git+%s'%root_repo, 'builds/01.py'])
+        text = captured_muddle(['checkout', '-j', '3', '_all'])
+        print text
+        check_in_order(text, 'Checking out up to 3 checkouts at once',
+                       '> Building checkout:co1/checked_out',
+                       '> Building checkout:co2/checked_out',
+                       '> Building checkout:co3/checked_out',
+                       '> Building checkout:co4/checked_out',
+                       '> Building checkout:co5/checked_out')
+        for name in CHECKOUTS:
+            with Directory(os.path.join('src', name)):
+                check_files(['file.txt'])
+
+        # Everything is checked out, so checking out again does nothing
+        text = captured_muddle(['checkout', '-j3', '_all'])
+        if '> Building' in text:
+            raise GiveUp('Checking out again did something:\n%s'%text)
+
+def test_pull(root_repo, build_dir):
+    banner('PULL -j 3')
+    change_repository('co2')
+    change_repository('co4')
+    with Directory(build_dir):
+        text = captured_muddle(['pull', '-j', '3', '_all'])
+        print text
+        check_in_order(text, 'Pulling up to 3 checkouts at once',
+                       '> Building checkout:co1/pulled',
+                       '> Building checkout:co2/pulled',
+                       '> Building checkout:co3/pulled',
+                       '> Building checkout:co4/pulled',
+                       '> Building checkout:co5/pulled',
+                       'The following checkouts were pulled',
+                       'checkout:co2/checked_out',
+                       'checkout:co4/checked_out')
+        check_just_pulled('.', ['co2', 'co4'])
+        with open(os.path.join('src', 'co4', 'file.txt')) as fd:
+            if 'A change' not in fd.read():
+                raise GiveUp('co4 was not pulled')
+
+        banner('PULL -j 3 WITH NOTHING TO PULL')
+        muddle(['pull', '-j3', '_all'])
+        check_just_pulled('.', [])
+
+def test_pull_build_desc_first(root_repo, build_dir):
+    banner('PULL -j 2 WITH A NEW BUILD DESCRIPTION')
+    # A new build description that adds a checkout - which we can only
+    # know about if the build description is pulled (and reloaded) first
+    with Directory(os.path.join('repo', 'builds')):
+        touch('01.py', BUILD_DESC.format(checkouts=CHECKOUTS + ('co6',)))
+        git('commit -a -m "Add co6"')
+    with NewDirectory(os.path.join('repo', 'co6')):
+        git('init')
+        touch('file.txt', 'Checkout co6\n')
+        git('add file.txt')
+        git('commit -m "First commit"')
+    change_repository('co1')
+    with Directory(build_dir):
+        text = captured_muddle(['pull', '-j', '2', '_all'])
+        print text
+        check_in_order(text, 'Pulling build description checkout:builds/pulled',
+                       'Reloading build description',
+                       'Now pulling the rest of the checkouts',
+                       'Pulling up to 2 checkouts at once',
+                       '> Building checkout:co1/pulled',
+                       '> Building checkout:co6/checked_out')
+        check_just_pulled('.', ['builds', 'co1', 'co6'])
+        with Directory(os.path.join('src', 'co6')):
+            check_files(['file.txt'])
+
+def test_pull_problems(root_repo, build_dir):
+    banner('PULL -j 3 WITH A PROBLEM')
+    change_repository('co1', 'Another change\n')
+    change_repository('co5', 'Another change\n')
+    # A local change that stops co3 being pulled
+    with Directory(build_dir):
+        with Directory(os.path.join('src', 'co3')):
+            touch('file.txt', 'A local change\n')
+            git('commit -a -m "A local change"')
+    change_repository('co3', 'A conflicting change\n')
+    with Directory(build_dir):
+        rc, text = captured_muddle2(['pull', '-j', '3', '_all'])
+        print text
+        if rc == 0:
+            raise GiveUp('Pull with a problem did not fail')
+        check_in_order(text, '> Building checkout:co3/pulled',
+                       'The following checkouts were pulled',
+                       'The following problems occurred',
+                       'co3')
+        # The other checkouts were still pulled
+        check_just_pulled('.', ['co1', 'co5'])
+
+        banner('PULL -j 3 -stop WITH A PROBLEM')
+        rc, text = captured_muddle2(['pull', '-j', '3', '-stop', '_all'])
+        print text
+        if rc == 0:
+            raise GiveUp('Pull -stop with a problem did not fail')
+        # Our -stop means we can't start anything after co3
+        if '> Building checkout:co6/pulled' in text:
+            raise GiveUp('Pull -stop did not stop')
+
+def test_status(root_repo, build_dir):
+    banner('STATUS -j 3')
+    with Directory(build_dir):
+        # Only co3 (which we could not pull) needs attention
+        rc, text = captured_muddle2(['status', '-j', '3', '-quick', '_all'])
+        print text
+        check_in_order(text, 'Checking 7 checkouts',
+                       'git status for checkout:co3/checked_out',
+                       '1 commits ahead of and 1 commits behind last known origin/master',
+                       'The following checkouts need attention:\n'
+                       '  checkout:co3/checked_out\n')
+
+        # An untracked file in co2, and a local commit in co4
+        touch(os.path.join('src', 'co2', 'new.txt'), 'New file\n')
+        with Directory(os.path.join('src', 'co4')):
+            append('file.txt', 'A local change\n')
+            git('commit -a -m "A local change"')
+
+        rc, text = captured_muddle2(['status', '-j3', '-quick', '_all'])
+        print text
+        if rc == 0:
+            raise GiveUp('Status with changes did not fail')
+        check_in_order(text, 'git status for checkout:co2/checked_out',
+                       '?? new.txt',
+                       'git status for checkout:co4/checked_out',
+                       '1 commits ahead of and 0 commits behind last known origin/master',
+                       'The following checkouts need attention:',
+                       'checkout:co2/checked_out',
+                       'checkout:co4/checked_out')
+
+        # "-j" on its own still means "join"
+        rc, text = captured_muddle2(['status', '-j', '-quick', '-j', '2', '_all'])
+        print text
+        check_in_order(text, 'The following checkouts need attention:\n'
+                       '  checkout:co2/checked_out checkout:co3/checked_out'
+                       ' checkout:co4/checked_out')
+
+        # And the same without -quick, which asks the remote repositories,
+        # one at a time
+        rc, text = captured_muddle2(['status', '_all'])
+        print text
+        check_in_order(text, 'git status for checkout:co2/checked_out',
+                       '?? new.txt',
+                       'git status for checkout:co4/checked_out',
+                       'The local repository does not match the remote',
+                       'The following checkouts need attention:')
+
+def stamp_lines(filename):
+    """Return the lines of a stamp file, ignoring comments.
+    """
+    with open(filename) as fd:
+        return [line for line in fd if not line.startswith('#')]
+
+def test_stamp(root_repo, build_dir):
+    banner('STAMP SAVE -j 3')
+    with Directory(build_dir):
+        muddle(['stamp', 'save', 'serial'])
+        text = captured_muddle(['stamp', 'save', '-j', '3', 'parallel'])
+        print text
+        check_in_order(text, "Processing git checkout 'builds'",
+                       "Processing git checkout 'co1'",
+                       "Processing git checkout 'co6'",
+                       'Renaming _temporary.stamp to parallel.stamp')
+        serial = stamp_lines('serial.stamp')
+        if stamp_lines('parallel.stamp') != serial:
+            raise GiveUp('Stamp files serial.stamp and parallel.stamp differ')
+
+        banner('STAMP VERSION -j 3')
+        muddle(['stamp', 'version', '-j', '3'])
+        if stamp_lines(os.path.join('versions', 'parallel_vcs.stamp')) != serial:
+            raise GiveUp('Stamp files serial.stamp and'
+                         ' versions/parallel_vcs.stamp differ')
+
+def test_unstamp(root_dir, build_dir):
+    banner('UNSTAMP -j 3 WITH PROBLEMS')
+    # Our stamp file has revisions for co3 and co4 that were never pushed,
+    # so they cannot be checked out - but everything else should be
+    stamp_file = os.path.join(build_dir, 'serial.stamp')
+    with NewDirectory(os.path.join(root_dir, 'broken')):
+        rc, text = captured_muddle2(['unstamp', '-j', '3', stamp_file])
+        print text
+        if rc == 0:
+            raise GiveUp('Unstamp with problems did not fail')
+        check_in_order(text, 'The following problems occurred',
+                       'Failure checking out checkout:co3/checked_out',
+                       'Failure checking out checkout:co4/checked_out')
+        for name in ('co1', 'co2', 'co5', 'co6'):
+            with Directory(os.path.join('src', name)):
+                check_files(['file.txt'])
+
+    banner('UNSTAMP -j 3')
+    with Directory(build_dir):
+        os.remove(os.path.join('src', 'co2', 'new.txt'))
+        for name in ('co3', 'co4'):
+            with Directory(os.path.join('src', name)):
+                git('reset --hard origin/master')
+        muddle(['stamp', 'save', 'pushed'])
+    stamp_file = os.path.join(build_dir, 'pushed.stamp')
+    with NewDirectory(os.path.join(root_dir, 'unstamped')):
+        text = captured_muddle(['unstamp', '-j', '3', stamp_file])
+        print text
+        check_in_order(text, 'Unstamping checkout builds',
+                       'Unstamping checkout co6',
+                       'Checking out up to 3 checkouts at once',
+                       '> Building checkout:co1/checked_out',
+                       '> Building checkout:co6/checked_out',
+                       'The build looks as if it restored correctly')
+        for name in CHECKOUTS + ('co6',):
+            with Directory(os.path.join('src', name)):
+                check_files(['file.txt'])
+        muddle(['stamp', 'save', 'unstamped'])
+        if stamp_lines('unstamped.stamp') != stamp_lines(stamp_file):
+            raise GiveUp('Stamp file unstamped.stamp differs from %s'%stamp_file)
+
+    banner('UNSTAMP -j 3 -update')
+    change_repository('co2', 'Yet another change\n')
+    change_repository('co5', 'Yet another change\n')
+    with Directory(build_dir):
+        muddle(['pull', '_all'])
+        muddle(['stamp', 'save', 'updated'])
+    with Directory(os.path.join(root_dir, 'unstamped')):
+        text = captured_muddle(['unstamp', '-j', '3', '-update',
+                                os.path.join(build_dir, 'updated.stamp')])
+        print text
+        check_in_order(text, 'Pulling up to 3 checkouts at once',
+                       '> Building checkout:co2/pulled',
+                       '> Building checkout:co5/pulled')
+        check_just_pulled('.', ['co2', 'co5'])
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep) as root_d:
+        make_repositories(CHECKOUTS)
+        root_repo = 'file://' + os.path.join(root_dir, 'repo')
+        build_dir = os.path.join(root_dir, 'build')
+        test_checkout(root_repo, build_dir)
+        test_pull(root_repo, build_dir)
+        test_pull_build_desc_first(root_repo, build_dir)
+        test_pull_problems(root_repo, build_dir)
+        test_status(root_repo, build_dir)
+        test_stamp(root_repo, build_dir)
+        test_unstamp(root_dir, build_dir)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
+        sys.exit(1)
+
+# vim: set tabstop=8 softtabstop=4 shiftwidth=4 expandtab:
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+"""Test profiling muddle itself, with "muddle --profile"
+
+    $ ./test_profile.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import pstats
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+PROFILE_BUILD_DESC = """ \
+# A build description with two packages, one depending on the other
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A simple muddle makefile
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'profile'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', PROFILE_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second'):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE)
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def test_profile():
+    make_build_tree()
+
+    # Make sure we run the build description, rather than using a snapshot
+    if os.path.exists('.muddle/_builder_snapshot'):
+        os.remove('.muddle/_builder_snapshot')
+
+    text = captured_muddle(['--profile', 'build', '_all'])
+    if 'Profile (sorted by cumulative) written to' not in text:
+        raise GiveUp('Expected a profile report:\n%s'%text)
+    for phase in ('Loading build descriptions', 'Constructing the rule set',
+                  'Planning what to build', 'Running actions',
+                  'Version control operations'):
+        lines = [line for line in text.splitlines() if line.endswith(phase)]
+        if not lines:
+            raise GiveUp('Expected a time for phase "%s":\n%s'%(phase, text))
+    running = [line for line in text.splitlines()
+               if line.endswith('Running actions')][0]
+    if float(running.split()[0]) <= 0:
+        raise GiveUp('Running actions should have taken some time:\n%s'%text)
+
+    # The profile we wrote out can be read back in
+    stats = pstats.Stats('muddle.prof')
+    if not stats.total_calls:
+        raise GiveUp('The profile in muddle.prof is empty')
+
+    text = captured_muddle(['--profile=tottime', 'query', 'checkouts'])
+    if 'Profile (sorted by tottime) written to' not in text:
+        raise GiveUp('Expected a profile report sorted by tottime:\n%s'%text)
+
+    text = captured_muddle(['--profile=sideways', 'query', 'checkouts'],
+                           error_fails=False)
+    if 'Unexpected sort order for --profile, "sideways"' not in text:
+        raise GiveUp('Expected an error for --profile=sideways:\n%s'%text)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('PROFILE')
+            test_profile()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+"""Test sharing packages through a remote artifact cache ($MUDDLE_REMOTE_CACHE)
+
+    $ ./test_remote_cache.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+CACHE_BUILD_DESC = """ \
+# A build description with two packages, the second depending on the first
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A muddle makefile that builds and installs a file
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\tcp $(MUDDLE_SRC)/source $(MUDDLE_OBJ)/{name}.out
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+\tmkdir -p $(MUDDLE_INSTALL)/bin
+\tcp $(MUDDLE_OBJ)/{name}.out $(MUDDLE_INSTALL)/bin/{name}
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree(name, clone_from=None):
+    """Make a build tree, with new checkouts or clones of another tree's.
+    """
+    muddle(['bootstrap', 'git+file:///nowhere', name])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', CACHE_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second'):
+            if clone_from:
+                git('clone %s %s'%(os.path.join(clone_from, 'src', name), name))
+                with Directory(name):
+                    muddle(['import'])
+                continue
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE.format(name=name))
+                touch('source', 'Version 1 of %s\n'%name)
+                git('add Makefile.muddle source')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def check_output(text, built, restored):
+    for name in ('first', 'second'):
+        was_built = '> Building package:%s{x86}/built'%name in text
+        was_restored = '> Restored package:%s{x86}/* from the cache'%name in text
+        if was_built != (name in built) or was_restored != (name in restored):
+            raise GiveUp('Expected to build %s and restore %s, but got:\n%s'%(
+                         built, restored, text))
+
+def check_stats(**expected):
+    text = captured_muddle(['query', 'cache-stats'])
+    for name, value in expected.items():
+        name = name.capitalize()
+        if '%s: %s\n'%(name, ' '*(15-len(name)) + str(value)) not in text:
+            raise GiveUp('Expected %s %d in cache stats:\n%s'%(name, value, text))
+
+def check_installed():
+    check_file_v_text('install/x86/bin/first', 'Version 1 of first\n')
+    check_file_v_text('install/x86/bin/second', 'Version 1 of second\n')
+    check_file_v_text('obj/second/x86/second.out', 'Version 1 of second\n')
+
+def start_server(directory):
+    """Start muddle_cache_server.py, and return (process, URL).
+    """
+    process = subprocess.Popen([sys.executable, MUDDLE_CACHE_SERVER_COMMAND,
+                                '-port', '0', directory],
+                               stdout=subprocess.PIPE)
+    line = process.stdout.readline()
+    if not line.startswith('Serving '):
+        process.kill()
+        raise GiveUp('Unexpected output from %s: %s'%(MUDDLE_CACHE_SERVER_COMMAND,
+                                                      line))
+    return process, line.split()[1]
+
+def test_upload(server_dir):
+    """Building a tree uploads its packages.
+    """
+    os.environ['MUDDLE_CACHE'] = os.path.join(os.getcwd(), 'cache')
+    make_build_tree('remote-one')
+    text = captured_muddle(['build', '_all'])
+    check_output(text, ['first', 'second'], [])
+    check_stats(stored=2, fetched=0)
+    entries = [name for name in os.listdir(server_dir) if name.endswith('.tar.gz')]
+    if len(entries) != 2:
+        raise GiveUp('Expected two entries in the remote cache, not %s'%entries)
+
+def test_fetch(first_tree):
+    """Another host (with its own local cache) fetches them.
+    """
+    os.environ['MUDDLE_CACHE'] = os.path.join(os.getcwd(), 'cache')
+    make_build_tree('remote-two', clone_from=first_tree)
+    text = captured_muddle(['build', '-j', '2', '_all'])
+    check_output(text, [], ['first', 'second'])
+    check_installed()
+    check_stats(hits=2, misses=0, fetched=2, stored=0)
+
+    # And a serial build also fetches what it needs
+    muddle(['veryclean'])
+    os.environ['MUDDLE_CACHE'] = os.path.join(os.getcwd(), 'another-cache')
+    text = captured_muddle(['build', '_all'])
+    check_output(text, [], ['first', 'second'])
+    check_installed()
+    check_stats(hits=2, misses=0, fetched=2)
+
+def test_corrupt(server_dir):
+    """A corrupt entry in the remote cache is treated as a miss.
+    """
+    for name in os.listdir(server_dir):
+        if name.endswith('.tar.gz'):
+            path = os.path.join(server_dir, name)
+            with open(path, 'r+b') as fd:
+                fd.truncate(os.path.getsize(path) // 2)
+    muddle(['veryclean'])
+    os.environ['MUDDLE_CACHE'] = os.path.join(os.getcwd(), 'yet-another-cache')
+    text = captured_muddle(['build', '_all'])
+    check_output(text, ['first', 'second'], [])
+    check_installed()
+    if 'Warning: Cannot fetch' not in text:
+        raise GiveUp('Expected a warning about the corrupt entries:\n%s'%text)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        server_dir = os.path.join(root_dir, 'server')
+        server, url = start_server(server_dir)
+        os.environ['MUDDLE_REMOTE_CACHE'] = url
+        try:
+            with NewDirectory('one'):
+                banner('UPLOAD')
+                test_upload(server_dir)
+
+            # Cache entries are only used at the same path, so the "other
+            # host" builds where the first tree was
+            first_tree = os.path.join(root_dir, 'first')
+            os.rename(os.path.join(root_dir, 'one'), first_tree)
+            with NewDirectory('one'):
+                banner('FETCH')
+                test_fetch(first_tree)
+
+                banner('CORRUPT ENTRIES')
+                test_corrupt(server_dir)
+        finally:
+            server.kill()
+            server.wait()
+            del os.environ['MUDDLE_REMOTE_CACHE']
+            if 'MUDDLE_CACHE' in os.environ:
+                del os.environ['MUDDLE_CACHE']
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
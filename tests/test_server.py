@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+"""Test "muddle server", and the muddle_client.py resource that talks to it
+
+    $ ./test_server.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+MUDDLE_CLIENT = os.path.join(os.path.dirname(MUDDLE_BINARY), 'muddled',
+                             'resources', 'muddle_client.py')
+
+# A build description that tells us when it is run
+SERVER_BUILD_DESC = """ \
+# A build description that announces itself
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    print 'Describing the build'
+    role = 'x86'
+    for name in ({names}):
+        muddled.pkgs.make.medium(builder, name, [role], name)
+    builder.add_default_role(role)
+"""
+
+# A Makefile that asks muddle where things are
+QUERYING_MAKEFILE = """\
+# A muddle makefile that uses $(MUDDLE) query
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+\techo '$(MUDDLE)' > $(MUDDLE_INSTALL)/muddle-was
+\t$(MUDDLE) query objdir $(MUDDLE_LABEL) > $(MUDDLE_INSTALL)/objdir
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def rewrite(filename, content):
+    touch(filename, content)
+    # Then remove the .pyc file, because Python probably won't realise
+    # that this new file is later than the previous version
+    if os.path.exists(filename + 'c'):
+        os.remove(filename + 'c')
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'server-test'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('01.py', SERVER_BUILD_DESC.format(names="'first', 'second'"))
+
+        for name in ('first', 'second'):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', QUERYING_MAKEFILE)
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def client(args, error_fails=True):
+    """Run muddle via the client, returning (retcode, output).
+
+    We ask muddle not to use its build tree snapshot, so that we can tell
+    when it is muddle itself (and not the server) that answers.
+    """
+    cmd = [sys.executable, MUDDLE_CLIENT, MUDDLE_BINARY] + args
+    print '>> client %s'%' '.join(args)
+    env = os.environ.copy()
+    env['MUDDLE_NO_SNAPSHOT'] = 'yes'
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         env=env)
+    output, _ = p.communicate()
+    if error_fails and p.returncode:
+        print output
+        raise GiveUp('Client failed with retcode %d'%p.returncode)
+    return p.returncode, output
+
+def answered_by_server(args):
+    retcode, output = client(args)
+    if 'Describing the build' in output:
+        raise GiveUp('"muddle %s" was not answered by the server:\n%s'%(' '.join(args), output))
+    return output
+
+def servers_started():
+    if not os.path.exists('server.log'):
+        return 0
+    return open('server.log').read().count('Serving queries for')
+
+def start_server():
+    started = servers_started()
+    log = open('server.log', 'a')
+    server = subprocess.Popen([MUDDLE_BINARY, 'server'], stdout=log,
+                              stderr=subprocess.STDOUT)
+    for count in range(100):
+        if servers_started() > started:
+            return server
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+    print open('server.log').read()
+    raise GiveUp('Server did not start')
+
+def stop_server(server):
+    server.terminate()
+    retcode = server.wait()
+    if retcode:
+        print open('server.log').read()
+        raise GiveUp('Server exited with retcode %d'%retcode)
+
+def test_queries(server):
+    """Queries are answered by the server, just as muddle would.
+    """
+    for args in (['query', 'checkouts'],
+                 ['query', 'objdir', 'first{x86}'],
+                 ['query', 'dependencies', 'user-short', 'second{x86}'],
+                ):
+        expected = captured_muddle(args)
+        output = answered_by_server(args)
+        if output != expected:
+            raise GiveUp('Server output for "muddle %s" was:\n%s\n'
+                         'but muddle said:\n%s'%(' '.join(args), output, expected))
+
+    # From within the build tree, too
+    with Directory('src'):
+        with Directory('first'):
+            output = answered_by_server(['query', 'objdir', 'first{x86}'])
+            check_text(output, captured_muddle(['query', 'objdir', 'first{x86}']))
+
+    # Errors give the same exit status
+    retcode, output = client(['query', 'objdir', 'package:nosuch'],
+                             error_fails=False)
+    if retcode != 1 or 'A package label needs a role' not in output:
+        raise GiveUp('Unexpected retcode %d and output:\n%s'%(retcode, output))
+
+    # Anything else is run by muddle itself
+    retcode, output = client(['help', 'server'])
+    if 'Describing the build' not in output:
+        raise GiveUp('Expected muddle itself to run "muddle help":\n%s'%output)
+    if ':Syntax: muddle server' not in output:
+        raise GiveUp('Unexpected output from "muddle help server":\n%s'%output)
+
+def test_makefiles_use_server(server):
+    """Whilst the server is running, $(MUDDLE) runs the client.
+    """
+    muddle(['build', 'first'])
+    text = open('install/x86/muddle-was').read()
+    if 'muddle_client.py' not in text:
+        raise GiveUp('$(MUDDLE) was %s'%text)
+    check_file_v_text('install/x86/objdir',
+                      captured_muddle(['query', 'objdir', 'first{x86}']))
+
+def test_reload(server):
+    """Changing the build description makes the server reload it.
+    """
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('01.py', SERVER_BUILD_DESC.format(names="'first', 'second', 'third'"))
+    output = answered_by_server(['query', 'checkouts'])
+    check_text_endswith(output, 'builds\nfirst\nsecond\nthird\n')
+    if 'Loading the build description again' not in open('server.log').read():
+        raise GiveUp('Server did not report reloading the build description')
+
+def test_stopped():
+    """Once the server has stopped, the client runs muddle itself.
+    """
+    check_nosuch_files(['.muddle/_server.sock'])
+    retcode, output = client(['query', 'checkouts'])
+    if 'Describing the build' not in output:
+        raise GiveUp('Expected muddle itself to answer:\n%s'%output)
+
+    muddle(['build', 'second'])
+    text = open('install/x86/muddle-was').read()
+    if 'muddle_client.py' in text:
+        raise GiveUp('$(MUDDLE) was %s'%text)
+
+def test_stale_socket():
+    """A server that was killed leaves its socket, which a new one replaces.
+    """
+    server = start_server()
+    server.send_signal(signal.SIGKILL)
+    server.wait()
+    check_files(['.muddle/_server.sock'])
+
+    # The client copes with this
+    retcode, output = client(['query', 'checkouts'])
+    if 'Describing the build' not in output:
+        raise GiveUp('Expected muddle itself to answer:\n%s'%output)
+
+    server = start_server()
+    try:
+        answered_by_server(['query', 'checkouts'])
+        # And we can only have one server at a time
+        text = captured_muddle(['server'], error_fails=False)
+        if '"muddle server" is already running' not in text:
+            raise GiveUp('Unexpected output from a second server:\n%s'%text)
+    finally:
+        stop_server(server)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            make_build_tree()
+
+            server = start_server()
+            try:
+                banner('QUERIES')
+                test_queries(server)
+
+                banner('MAKEFILES USE SERVER')
+                test_makefiles_use_server(server)
+
+                banner('RELOAD')
+                test_reload(server)
+            except:
+                server.kill()
+                server.wait()
+                raise
+            stop_server(server)
+
+            banner('STOPPED')
+            test_stopped()
+
+            banner('STALE SOCKET')
+            test_stale_socket()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+"""Test using a snapshot of the loaded build tree, in .muddle/_builder_snapshot
+
+    $ ./test_snapshot.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+# A build description that tells us when it is run, and that uses an Action
+# defined in the build description itself
+SNAPSHOT_BUILD_DESC = """ \
+# A build description that announces itself
+
+import os
+
+import muddled.pkgs.make
+from muddled.depend import Action, Label, Rule
+from muddled.utils import LabelType
+
+from helper import HELPER_TEXT
+
+class WriteNote(Action):
+    def build_label(self, builder, label):
+        with open(os.path.join(builder.db.root_path, 'note.txt'), 'w') as fd:
+            fd.write('%s for %s\\n'%(HELPER_TEXT, label))
+
+def describe_to(builder):
+    print 'Describing the build'
+    role = 'x86'
+    for name in ({names}):
+        muddled.pkgs.make.medium(builder, name, [role], name)
+    builder.ruleset.add(Rule(Label(LabelType.Package, 'note', role, 'built'),
+                             WriteNote()))
+    builder.add_default_role(role)
+"""
+
+HELPER = """\
+HELPER_TEXT = '{text}'
+"""
+
+# And one which can't be pickled
+LAMBDA_BUILD_DESC = """ \
+# A build description that uses a lambda in an action
+
+import muddled.pkgs.make
+from muddled.depend import Action, Label, Rule
+from muddled.utils import LabelType
+
+class CallIt(Action):
+    def __init__(self, fn):
+        self.fn = fn
+    def build_label(self, builder, label):
+        self.fn()
+
+def describe_to(builder):
+    print 'Describing the build'
+    builder.ruleset.add(Rule(Label(LabelType.Package, 'note', 'x86', 'built'),
+                             CallIt(lambda: None)))
+"""
+
+def described(args):
+    """Run muddle, and report if it had to load the build description.
+    """
+    text = captured_muddle(args)
+    return 'Describing the build' in text, text
+
+def check_described(args, expected):
+    was_described, text = described(args)
+    if was_described != expected:
+        raise GiveUp('Expected build description %sto be loaded, for'
+                     ' "muddle %s":\n%s'%('' if expected else 'not ',
+                                          ' '.join(args), text))
+    return text
+
+def rewrite(filename, content):
+    touch(filename, content)
+    # Then remove the .pyc file, because Python probably won't realise
+    # that this new file is later than the previous version
+    if os.path.exists(filename + 'c'):
+        os.remove(filename + 'c')
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'snapshot-test'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('01.py', SNAPSHOT_BUILD_DESC.format(names="'first',"))
+            rewrite('helper.py', HELPER.format(text='Noted'))
+
+        for name in ('first', 'second'):
+            with NewDirectory(name):
+                touch('Makefile.muddle', '# Nothing to do\n')
+
+def test_snapshot_is_used():
+    """The first muddle writes a snapshot, and later ones use it.
+    """
+    make_build_tree()
+
+    check_described(['query', 'checkouts'], True)
+    check_files(['.muddle/_builder_snapshot'])
+    text = check_described(['query', 'checkouts'], False)
+    check_text_endswith(text, 'builds\nfirst\n')
+
+    # An Action defined in the build description works from the snapshot
+    check_described(['buildlabel', 'package:note{x86}/built'], False)
+    check_file_v_text('note.txt', 'Noted for package:note{x86}/built\n')
+
+def test_snapshot_is_invalidated():
+    """Changing the build description (or anything else in its checkout)
+    means we load the build description again.
+    """
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('01.py', SNAPSHOT_BUILD_DESC.format(names="'first', 'second'"))
+    text = check_described(['query', 'checkouts'], True)
+    check_text_endswith(text, 'builds\nfirst\nsecond\n')
+    check_described(['query', 'checkouts'], False)
+
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('helper.py', HELPER.format(text='Changed'))
+    check_described(['query', 'checkouts'], True)
+    check_described(['query', 'checkouts'], False)
+
+    # And we can ask not to use the snapshot at all
+    os.environ['MUDDLE_NO_SNAPSHOT'] = 'yes'
+    try:
+        check_described(['query', 'checkouts'], True)
+    finally:
+        del os.environ['MUDDLE_NO_SNAPSHOT']
+
+def test_cannot_pickle():
+    """If we can't pickle the Builder, we just don't have a snapshot.
+    """
+    with Directory('src'):
+        with Directory('builds'):
+            rewrite('01.py', LAMBDA_BUILD_DESC)
+    check_described(['query', 'checkouts'], True)
+    check_nosuch_files(['.muddle/_builder_snapshot'])
+    check_described(['query', 'checkouts'], True)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('SNAPSHOT IS USED')
+            test_snapshot_is_used()
+
+            banner('SNAPSHOT IS INVALIDATED')
+            test_snapshot_is_invalidated()
+
+            banner('CANNOT PICKLE')
+            test_cannot_pickle()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
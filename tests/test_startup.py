@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+"""Test that muddle only imports what it needs when it starts up
+
+    $ ./test_startup.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+
+See also benchmark_startup.py, which times how long muddle takes to start.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+# Modules that should only be imported when they are needed
+LAZY_MODULES = ['httplib', 'urllib', 'pydoc', 'muddled.docreport',
+                'muddled.vcs.bazaar', 'muddled.vcs.file', 'muddled.vcs.git',
+                'muddled.vcs.svn', 'muddled.vcs.weld']
+
+CHECK_IMPORTS = """\
+import sys
+import muddled.cmdline
+print ' '.join(name for name in {modules!r} if name in sys.modules)
+"""
+
+STARTUP_BUILD_DESC = """ \
+# A build description with one package
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    muddled.pkgs.make.medium(builder, 'first', ['x86'], 'first')
+    builder.add_default_role('x86')
+"""
+
+def imported_modules():
+    """Return which of LAZY_MODULES importing muddled.cmdline imports.
+    """
+    code = CHECK_IMPORTS.format(modules=LAZY_MODULES)
+    text = subprocess.check_output([sys.executable, '-c', code],
+                                   cwd=os.path.dirname(MUDDLE_BINARY))
+    return text.split()
+
+def test_imports():
+    imported = imported_modules()
+    if imported:
+        raise GiveUp('Importing muddled.cmdline also imported %s'%', '.join(imported))
+
+def test_lazy_command():
+    # "muddle doc" is defined in muddled.docreport, which is imported when
+    # we need it
+    text = captured_muddle(['help', 'categories'])
+    if ' doc ' not in text:
+        raise GiveUp('Expected "doc" in the list of commands:\n%s'%text)
+    text = captured_muddle(['help', 'doc'])
+    if not text.startswith('doc\n') or 'muddle doc [<switch> ...] [<what>]' not in text:
+        raise GiveUp('Unexpected help for "muddle doc":\n%s'%text)
+    text = captured_muddle(['doc', '-nopager', 'GiveUp'])
+    if 'muddled.utils.GiveUp' not in text:
+        raise GiveUp('Unexpected output from "muddle doc GiveUp":\n%s'%text)
+
+def test_lazy_vcs():
+    # All the VCSs are still there when we want to know about them
+    text = captured_muddle(['query', 'vcs'])
+    for scheme in ('bzr', 'file', 'git', 'svn', 'weld'):
+        if '\n  %s '%scheme not in text:
+            raise GiveUp('Expected VCS %s in the list of VCSs:\n%s'%(scheme, text))
+    text = captured_muddle(['help', 'vcs', 'git'])
+    if 'git' not in text.lower():
+        raise GiveUp('Unexpected help for the git VCS:\n%s'%text)
+
+    # And we can build with one
+    muddle(['bootstrap', 'git+file:///nowhere', 'startup'])
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', STARTUP_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+        with NewDirectory('first'):
+            git('init')
+            touch('Makefile.muddle', 'all:\n\nconfig:\n\ninstall:\n\n'
+                                     'clean:\n\ndistclean:\n')
+            git('add Makefile.muddle')
+            git('commit -m "A commit"')
+            muddle(['import'])
+    text = captured_muddle(['query', 'checkout-id', 'first'])
+    if not text.strip():
+        raise GiveUp('Expected a revision id for checkout first')
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    banner('IMPORTS')
+    test_imports()
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        banner('LAZY COMMANDS')
+        test_lazy_command()
+
+        with NewDirectory('build'):
+            banner('LAZY VCS')
+            test_lazy_vcs()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
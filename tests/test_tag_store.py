@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+"""Test keeping tags in a journal, with "muddle tagstore"
+
+    $ ./test_tag_store.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+TAG_STORE_BUILD_DESC = """ \
+# A build description with two packages, one depending on the other
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A muddle makefile that (optionally) checks something first
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+\t{check}
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+# When 'second' is built, the tags for 'first' should already be written out,
+# so that (for instance) another muddle would see them
+CHECK_FIRST = ("grep 'package:first{x86}/postinstalled'"
+               " $(MUDDLE_ROOT)/.muddle/tags.journal")
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'tag-store'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', TAG_STORE_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name, check in (('first', 'true'), ('second', CHECK_FIRST)):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE.format(check=check))
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def check_journal_has(wanted, unwanted=()):
+    with open('.muddle/tags.journal') as fd:
+        text = fd.read()
+    for label in wanted:
+        if label not in text:
+            raise GiveUp('Expected %s in the tags journal:\n%s'%(label, text))
+    for label in unwanted:
+        if label not in text:
+            continue
+        # It's OK if it has been retracted since
+        lines = [line for line in text.splitlines() if line.endswith(label)]
+        if not lines[-1].startswith('-'):
+            raise GiveUp('Did not expect %s in the tags journal:\n%s'%(label, text))
+
+def test_journal():
+    """Move to a journal, and build using it.
+    """
+    make_build_tree()
+
+    muddle(['tagstore', 'journal'])
+    check_files(['.muddle/TagStore', '.muddle/tags.journal'])
+    check_nosuch_files(['.muddle/tags'])
+    check_journal_has(['checkout:first/checked_out',
+                       'checkout:second/checked_out'])
+    text = captured_muddle(['tagstore'])
+    if 'journal' not in text:
+        raise GiveUp('Unexpected "muddle tagstore" output:\n%s'%text)
+
+    muddle(['build', '_all'])
+    check_journal_has(['package:first{x86}/postinstalled',
+                       'package:second{x86}/postinstalled'])
+    check_nosuch_files(['.muddle/tags/package'])
+
+    # Everything is built, so doing it again should build nothing
+    text = captured_muddle(['build', '_all'])
+    if '> Building package:' in text:
+        raise GiveUp('Rebuilt something that was already built:\n%s'%text)
+
+    # Retracting a tag works as it always did
+    muddle(['retract', 'package:second{x86}/postinstalled'])
+    check_journal_has([], ['package:second{x86}/postinstalled'])
+    text = captured_muddle(['build', '-j', '2', '_all'])
+    if '> Building package:second{x86}/postinstalled' not in text:
+        raise GiveUp('Did not rebuild package:second:\n%s'%text)
+
+    # And "muddle veryclean" forgets the package tags
+    muddle(['veryclean'])
+    check_journal_has(['checkout:first/checked_out'],
+                      ['package:first{x86}/postinstalled'])
+    text = captured_muddle(['build', '_all'])
+    if '> Building package:first{x86}/postinstalled' not in text:
+        raise GiveUp('Did not rebuild package:first after veryclean:\n%s'%text)
+
+def test_compat():
+    """In compat mode, tag files are written, and touching them works.
+    """
+    muddle(['tagstore', 'compat'])
+    check_files(['.muddle/tags.journal',
+                 '.muddle/tags/package/first/x86-postinstalled'])
+
+    muddle(['retract', 'package:first{x86}/built'])
+    check_nosuch_files(['.muddle/tags/package/first/x86-built'])
+    touch('.muddle/tags/package/first/x86-built')
+    text = captured_muddle(['build', 'first'])
+    if '> Building package:first{x86}/built' in text:
+        raise GiveUp('Rebuilt something whose tag file was touched:\n%s'%text)
+    if '> Building package:first{x86}/installed' not in text:
+        raise GiveUp('Did not build package:first{x86}/installed:\n%s'%text)
+
+    # Retracting package:first also retracted package:second
+    muddle(['build', '_all'])
+
+def test_back_to_files():
+    """And back to tag files again.
+    """
+    muddle(['tagstore', 'files'])
+    check_nosuch_files(['.muddle/TagStore', '.muddle/tags.journal'])
+    check_files(['.muddle/tags/checkout/first/checked_out',
+                 '.muddle/tags/package/first/x86-built',
+                 '.muddle/tags/package/second/x86-postinstalled'])
+    text = captured_muddle(['build', '_all'])
+    if '> Building package:' in text:
+        raise GiveUp('Rebuilt something that was already built:\n%s'%text)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('JOURNAL')
+            test_journal()
+
+            banner('COMPAT')
+            test_compat()
+
+            banner('BACK TO FILES')
+            test_back_to_files()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'
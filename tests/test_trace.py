@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+"""Test writing a trace of what muddle does, with "muddle --trace"
+
+    $ ./test_trace.py [-keep]
+
+With -keep, do not delete the 'transient' directory used for the tests.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import traceback
+
+from support_for_tests import *
+try:
+    import muddled.cmdline
+except ImportError:
+    # Try one level up
+    sys.path.insert(0, get_parent_dir(__file__))
+    import muddled.cmdline
+
+from muddled.utils import GiveUp, normalise_dir
+from muddled.withdir import Directory, NewDirectory, TransientDirectory
+
+TRACE_BUILD_DESC = """ \
+# A build description with two packages, one depending on the other
+
+import muddled.pkgs.make
+
+def describe_to(builder):
+    role = 'x86'
+    muddled.pkgs.make.medium(builder, 'first', [role], 'first')
+    muddled.pkgs.make.medium(builder, 'second', [role], 'second',
+                             deps=['first'])
+    builder.add_default_role(role)
+"""
+
+MAKEFILE = """\
+# A simple muddle makefile
+all:
+\t@echo Make all for '$(MUDDLE_LABEL)'
+
+config:
+\t@echo Make configure for '$(MUDDLE_LABEL)'
+
+install:
+\t@echo Make install for '$(MUDDLE_LABEL)'
+
+clean:
+\t@echo Make clean for '$(MUDDLE_LABEL)'
+
+distclean:
+\t@echo Make distclean for '$(MUDDLE_LABEL)'
+
+.PHONY: all config install clean distclean
+"""
+
+def make_build_tree():
+    muddle(['bootstrap', 'git+file:///nowhere', 'trace'])
+
+    with Directory('src'):
+        with Directory('builds'):
+            touch('01.py', TRACE_BUILD_DESC)
+            # Then remove the .pyc file, because Python probably won't realise
+            # that this new 01.py is later than the previous version
+            if os.path.exists('01.pyc'):
+                os.remove('01.pyc')
+
+        for name in ('first', 'second'):
+            with NewDirectory(name):
+                git('init')
+                touch('Makefile.muddle', MAKEFILE)
+                git('add Makefile.muddle')
+                git('commit -m "A commit"')
+                muddle(['import'])
+
+def read_trace(filename):
+    """Return the complete events in a trace, and the names of its processes.
+    """
+    with open(filename) as fd:
+        events = json.load(fd)
+    spans = [e for e in events if e['ph'] == 'X']
+    names = dict((e['pid'], e['args']['name']) for e in events
+                 if e['ph'] == 'M' and e['name'] == 'process_name')
+    for event in spans:
+        if event['pid'] not in names:
+            raise GiveUp('Event for unnamed process %s: %s'%(event['pid'], event))
+    return spans, names
+
+def check_spans(spans, wanted):
+    """Check we have a span for each (name, category) in 'wanted'.
+    """
+    found = set((e['name'], e['cat']) for e in spans)
+    for name, category in wanted:
+        if (name, category) not in found:
+            raise GiveUp('Expected a "%s" span for %s, but only have:\n  %s'%(
+                         category, name, '\n  '.join(sorted('%s %s'%x for x in found))))
+
+def test_trace():
+    make_build_tree()
+
+    # Make sure we run the build description, rather than using a snapshot
+    if os.path.exists('.muddle/_builder_snapshot'):
+        os.remove('.muddle/_builder_snapshot')
+
+    muddle(['--trace', 'build.json', 'build', '_all'])
+    spans, names = read_trace('build.json')
+    check_spans(spans, [('import', 'load'),
+                        ('load_builder', 'load'),
+                        ('build description (top level)', 'load'),
+                        ('needed_to_build', 'plan'),
+                        ('muddle build', 'command'),
+                        ('package:first{x86}/built', 'build'),
+                        ('package:second{x86}/installed', 'build'),
+                        ('make', 'command')])
+    if len(names) != 1:
+        raise GiveUp('Expected one process in the trace, not %s'%names)
+
+    # The phases should nest properly
+    command = [e for e in spans if e['name'] == 'muddle build'][0]
+    built = [e for e in spans if e['name'] == 'package:first{x86}/built'][0]
+    if not (command['ts'] <= built['ts'] and
+            built['ts'] + built['dur'] <= command['ts'] + command['dur']):
+        raise GiveUp('Building package:first is not within "muddle build":\n'
+                     '%s\n%s'%(command, built))
+
+    # VCS operations are traced
+    muddle(['--trace', 'vcs.json', 'query', 'checkout-id', 'first'])
+    spans, names = read_trace('vcs.json')
+    check_spans(spans, [('revision_to_checkout first', 'vcs'),
+                        ('git', 'command')])
+
+    # And a parallel build shows each build process
+    muddle(['veryclean'])
+    muddle(['--trace', 'parallel.json', 'build', '-j', '2', '_all'])
+    spans, names = read_trace('parallel.json')
+    check_spans(spans, [('package:first{x86}/built', 'build'),
+                        ('package:second{x86}/built', 'build')])
+    if len(names) < 2:
+        raise GiveUp('Expected the build processes in the trace, not just %s'%names)
+
+def main(args):
+
+    keep = False
+    if args:
+        if len(args) == 1 and args[0] == '-keep':
+            keep = True
+        else:
+            print __doc__
+            return
+
+    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+
+    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep):
+        with NewDirectory('build'):
+            banner('TRACE')
+            test_trace()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        main(args)
+        print '\nGREEN light\n'
+    except Exception as e:
+        print
+        traceback.print_exc()
+        print '\nRED light\n'